@@ -0,0 +1,202 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import accumulate, chain, compress, groupby, islice, repeat
+from math import fsum
+from operator import attrgetter, gt, itemgetter, le, mul, not_, sub, truediv
+from typing import Dict, List, Optional, Tuple
+
+from model import ReadingColumns, ReadingIndex, SqliteReadings, date_from_days
+
+RESET_RATIO = 0.5
+ALLOWED_FREQUENCIES = (50.0, 60.0)
+ROLLING_WINDOW = 7
+PYRAMID_LEVELS = 16
+
+class CounterAnomaly:
+    __slots__ = ('position', 'kind', 'previous', 'current')
+
+    def __init__(self, position: int, kind: str, previous: float, current: float):
+        self.position = position
+        self.kind = kind
+        self.previous = previous
+        self.current = current
+
+    def __str__(self):
+        what = "Сброс счётчика" if self.kind == 'reset' else "Отрицательный прирост"
+        return f"{what} в показании {self.position + 1}: {self.previous} -> {self.current}"
+
+def _column(readings, field: str):
+    if isinstance(readings, ReadingColumns):
+        return getattr(readings, field)
+    if isinstance(readings, SqliteReadings):
+        return readings.column(field)
+    return list(map(attrgetter(field), readings))
+
+def _series(readings, field: str, index: ReadingIndex = None):
+    column = _column(readings, field)
+    for resource_type, days, positions in (index or ReadingIndex(readings)).runs():
+        yield resource_type, days, positions, list(map(column.__getitem__, positions))
+
+def _period_keys(days: List[int], period: str) -> List[datetime]:
+    dates = {day: date_from_days(day) for day in set(days)}
+    if period == 'month':
+        dates = {day: date.replace(day=1) for day, date in dates.items()}
+    elif period != 'day':
+        raise ValueError("Период должен быть 'day' или 'month'.")
+    return list(map(dates.__getitem__, days))
+
+def _deltas(values: List[float], reset_ratio: float) -> tuple:
+    current = values[1:]
+    deltas = list(map(sub, current, values))
+    drops = list(compress(range(len(deltas)), map(gt, values, current)))
+    dropped = list(map(current.__getitem__, drops))
+    resets = list(map(le, dropped, map(mul, map(values.__getitem__, drops), repeat(reset_ratio))))
+    # при сбросе счётчик начал с нуля, иначе прирост считаем нулевым
+    for i, value, reset in zip(drops, dropped, resets):
+        deltas[i] = value if reset else 0.0
+    return deltas, drops, resets
+
+def _period_totals(days: List[int], deltas: List[float], period: str) -> List[Tuple[datetime, float]]:
+    keys = _period_keys(days[1:], period)
+    return [(key, sum(map(itemgetter(1), group))) for key, group in groupby(zip(keys, deltas), itemgetter(0))]
+
+def consumption(readings, field: str, period: str = 'day', reset_ratio: float = RESET_RATIO,
+                index: ReadingIndex = None) -> Dict[str, List[Tuple[datetime, float]]]:
+    result = {}
+    for resource_type, days, _, values in _series(readings, field, index):
+        result[resource_type] = _period_totals(days, _deltas(values, reset_ratio)[0], period)
+    return result
+
+def counter_anomalies(readings, field: str, reset_ratio: float = RESET_RATIO,
+                      index: ReadingIndex = None) -> List[CounterAnomaly]:
+    anomalies = []
+    for _, _, positions, values in _series(readings, field, index):
+        _, drops, resets = _deltas(values, reset_ratio)
+        for i, reset in zip(drops, resets):
+            anomalies.append(CounterAnomaly(positions[i + 1], 'reset' if reset else 'negative', values[i], values[i + 1]))
+    return anomalies
+
+def rolling_average(readings, field: str, window: int = ROLLING_WINDOW,
+                    index: ReadingIndex = None) -> Dict[str, List[Tuple[datetime, float]]]:
+    if window < 1:
+        raise ValueError("Окно усреднения должно быть положительным.")
+    result = {}
+    for resource_type, days, _, values in _series(readings, field, index):
+        size = len(values)
+        sums = list(accumulate(values, initial=0.0))
+        # сумма последних window значений: разность префиксных сумм со сдвигом
+        lagged = chain(repeat(0.0, min(window - 1, size)), sums[:max(size - window + 1, 0)])
+        totals = map(sub, islice(sums, 1, None), lagged)
+        counts = chain(range(1, min(window, size) + 1), repeat(window, max(size - window, 0)))
+        dates = {day: date_from_days(day) for day in set(days)}
+        result[resource_type] = list(zip(map(dates.__getitem__, days), map(truediv, totals, counts)))
+    return result
+
+def frequency_anomalies(readings, allowed: Tuple[float, ...] = ALLOWED_FREQUENCIES) -> List[int]:
+    frequency = _column(readings, 'frequency')
+    return list(compress(range(len(frequency)), map(not_, map(frozenset(allowed).__contains__, frequency))))
+
+def summarize(water_readings, electricity_readings, period: str = 'month',
+              water_index: ReadingIndex = None, electricity_index: ReadingIndex = None) -> Dict[str, dict]:
+    summary = {}
+    collections = ((water_readings, water_index, 'total_volume', 'flow_rate'),
+                   (electricity_readings, electricity_index, 'total_energy', 'power'))
+    for readings, index, counter, rate in collections:
+        if not len(readings):
+            continue
+        index = index or ReadingIndex(readings)
+        rates = {resource_type: values for resource_type, _, _, values in _series(readings, rate, index)}
+        bad_frequency = set(frequency_anomalies(readings)) if counter == 'total_energy' else set()
+        for resource_type, days, positions, values in _series(readings, counter, index):
+            deltas, drops, resets = _deltas(values, RESET_RATIO)
+            periods = _period_totals(days, deltas, period)
+            recent = rates[resource_type][-ROLLING_WINDOW:]
+            summary[resource_type] = {
+                'readings': len(positions),
+                'first': date_from_days(days[0]),
+                'last': date_from_days(days[-1]),
+                'consumption': fsum(deltas),
+                'periods': periods,
+                'resets': resets.count(True),
+                'negative': resets.count(False),
+                'average_rate': fsum(rates[resource_type]) / len(positions),
+                'recent_rate': fsum(recent) / len(recent),
+                'bad_frequency': len(bad_frequency.intersection(positions)),
+            }
+    return summary
+
+class MinMaxPyramid:
+    """Минимумы и максимумы ряда по дням и по интервалам в 2**level дней.
+
+    График берёт самый подробный уровень, на котором видимых интервалов не больше, чем пикселей,
+    поэтому рисование не зависит от числа показаний. Изменение одного дня пересчитывает по интервалу на уровень.
+    """
+
+    def __init__(self, days: List[int] = (), values: List[float] = (), levels: int = PYRAMID_LEVELS):
+        # days по возрастанию, как в ReadingIndex.runs
+        self.levels = [(array('q'), array('d'), array('d')) for _ in range(levels + 1)]
+        keys, mins, maxs = self.levels[0]
+        lo = 0
+        for day in dict.fromkeys(days):
+            hi = bisect_right(days, day, lo)
+            keys.append(day)
+            mins.append(min(values[lo:hi]))
+            maxs.append(max(values[lo:hi]))
+            lo = hi
+        for level in range(1, levels + 1):
+            self._build(level)
+
+    def _build(self, level: int):
+        keys, mins, maxs = self.levels[level]
+        lower_keys, lower_mins, lower_maxs = self.levels[level - 1]
+        lo = 0
+        while lo < len(lower_keys):
+            key = lower_keys[lo] >> 1
+            hi = bisect_left(lower_keys, (key + 1) << 1, lo)
+            keys.append(key)
+            mins.append(min(lower_mins[lo:hi]))
+            maxs.append(max(lower_maxs[lo:hi]))
+            lo = hi
+
+    def __len__(self):
+        return len(self.levels[0][0])
+
+    def span(self) -> Optional[Tuple[int, int]]:
+        keys = self.levels[0][0]
+        return (keys[0], keys[-1]) if keys else None
+
+    def _set(self, level: int, key: int, bounds: Optional[Tuple[float, float]]):
+        keys, mins, maxs = self.levels[level]
+        idx = bisect_left(keys, key)
+        present = idx < len(keys) and keys[idx] == key
+        if bounds is None:
+            if present:
+                del keys[idx], mins[idx], maxs[idx]
+        elif present:
+            mins[idx], maxs[idx] = bounds
+        else:
+            keys.insert(idx, key)
+            mins.insert(idx, bounds[0])
+            maxs.insert(idx, bounds[1])
+
+    def set_day(self, day: int, values: List[float]):
+        # values - все значения ряда за день, пустой список убирает день
+        self._set(0, day, (min(values), max(values)) if values else None)
+        for level in range(1, len(self.levels)):
+            key = day >> level
+            lower_keys, lower_mins, lower_maxs = self.levels[level - 1]
+            lo = bisect_left(lower_keys, key << 1)
+            hi = bisect_left(lower_keys, (key + 1) << 1, lo)
+            self._set(level, key, (min(lower_mins[lo:hi]), max(lower_maxs[lo:hi])) if hi > lo else None)
+
+    def buckets(self, first: int, last: int, max_buckets: int) -> tuple:
+        """Уровень и интервалы (ключи, минимумы, максимумы), пересекающие дни first..last."""
+        for level, (keys, mins, maxs) in enumerate(self.levels):
+            lo = bisect_left(keys, first >> level)
+            hi = bisect_right(keys, last >> level, lo)
+            if hi - lo <= max_buckets or level == len(self.levels) - 1:
+                return level, keys[lo:hi], mins[lo:hi], maxs[lo:hi]
+
+def series_pyramids(readings, field: str, index: ReadingIndex = None) -> Dict[str, MinMaxPyramid]:
+    return {resource_type: MinMaxPyramid(days, values) for resource_type, days, _, values in _series(readings, field, index)}
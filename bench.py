@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from cache import ParseCache, read_meter_columns_cached
+from model import SqliteStore, parse_meter_readings, read_file, read_meter_columns, read_sqlite, write_file
+
+WATER_SHARE = 0.5
+STARTUP_REPEAT = 5
+
+def _bad_line(rng: random.Random, date: str) -> str:
+    kind = rng.randrange(3)
+    if kind == 0:
+        return f"Вода;{rng.randint(32, 99)}.13.2024;1.5;2.5;100.0"
+    if kind == 1:
+        return f"Электричество;{date};abc;1.23;654.3;50"
+    return f"Вода;{date};1.5;2.5"
+
+def generate_meter_file(file_path: str, lines: int, error_rate: float = 0.01, seed: int = 0, batch: int = 10000):
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        for batch_start in range(0, lines, batch):
+            rows = []
+            for i in range(batch_start, min(batch_start + batch, lines)):
+                date = (start + timedelta(days=i // 1000)).strftime('%d.%m.%Y')
+                if rng.random() < error_rate:
+                    rows.append(_bad_line(rng, date))
+                elif rng.random() < WATER_SHARE:
+                    rows.append(f"Вода;{date};{rng.uniform(0, 30):.2f};{rng.uniform(0, 20):.1f};{rng.uniform(0, 5000):.1f}")
+                else:
+                    rows.append(f"Электричество;{date};{rng.uniform(0, 30):.2f};{rng.uniform(0, 9):.2f};"
+                                f"{rng.uniform(0, 9000):.1f};{rng.choice((50, 60))}")
+            file.write('\n'.join(rows) + '\n')
+
+def _measure(action, repeat: int, memory: bool) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - started)
+    result = {'seconds': min(timings)}
+    if memory:
+        tracemalloc.start()
+        action()
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+def _gui_load(data_path: str):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5 import QtWidgets
+        from view import MeterApp
+    except ImportError:
+        return None
+    from unittest import mock
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    window = MeterApp()
+    # замеряется разбор, а не попадания в кэш; кэш пользователя при этом не заполняется
+    window.cache = None
+    window.file_path = data_path
+
+    def load():
+        with mock.patch.object(window, 'show_errors'):
+            window.load_data()
+            while window.task is not None:
+                app.processEvents()
+                time.sleep(0.001)
+    return load
+
+def _sqlite_import(data_path: str, db_path: str):
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    with SqliteStore(db_path) as store:
+        store.import_csv(data_path)
+
+def measure_startup(repeat: int = STARTUP_REPEAT) -> dict:
+    # холодный запуск CLI в отдельном процессе на файле из одной строки
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+    with tempfile.TemporaryDirectory() as directory:
+        data_path = os.path.join(directory, 'one.csv')
+        generate_meter_file(data_path, 1, error_rate=0)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, script, 'validate', data_path], stdout=subprocess.DEVNULL, check=True)
+            timings.append(time.perf_counter() - started)
+    seconds = min(timings)
+    return {'seconds': seconds, 'rows': 1, 'rows_per_sec': 1 / seconds}
+
+def run_benchmarks(data_path: str, stages=None, repeat: int = 1, memory: bool = True) -> dict:
+    lines = read_file(data_path)
+    line_count = len(lines)
+    water, electricity, _ = parse_meter_readings(lines)
+    readings = water + electricity
+    output_path = data_path + '.out'
+    db_path = data_path + '.db'
+    cache_dir = tempfile.TemporaryDirectory()
+    cache = ParseCache(cache_dir.name)
+    actions = {
+        'read_file': lambda: read_file(data_path),
+        'parse_meter_readings': lambda: parse_meter_readings(lines),
+        'read_meter_columns': lambda: read_meter_columns(data_path),
+        'read_meter_columns_cached': lambda: read_meter_columns_cached(data_path, cache),
+        'str_format': lambda: [str(reading) for reading in readings],
+        'write_file': lambda: write_file(output_path, water, electricity),
+        # база против CSV: импорт сравнивается с read_meter_columns, чтение базы - с кэшем разбора
+        'sqlite_import': lambda: _sqlite_import(data_path, db_path),
+        'read_sqlite': lambda: read_sqlite(db_path),
+        'gui_load': lambda: _gui_load(data_path),
+        'cli_startup': None,
+    }
+    results = {}
+    try:
+        for name, action in actions.items():
+            if stages and name not in stages:
+                continue
+            if name == 'cli_startup':
+                results[name] = measure_startup(max(repeat, STARTUP_REPEAT))
+                continue
+            if name == 'gui_load':
+                action = action()
+                if action is None:
+                    results[name] = {'skipped': 'PyQt5 недоступен'}
+                    continue
+            if name == 'read_meter_columns_cached':
+                # замеряется повторное открытие, первый разбор заполняет кэш
+                action()
+            if name == 'read_sqlite' and not os.path.exists(db_path):
+                _sqlite_import(data_path, db_path)
+            result = _measure(action, repeat, memory)
+            rows = len(readings) if name in ('str_format', 'write_file', 'read_sqlite') else line_count
+            result['rows'] = rows
+            result['rows_per_sec'] = rows / result['seconds'] if result['seconds'] else None
+            results[name] = result
+    finally:
+        cache_dir.cleanup()
+        for path in (output_path, db_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return {
+        'meta': {
+            'lines': line_count,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'stages': results,
+    }
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list:
+    regressions = []
+    for name, result in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if not previous or 'rows_per_sec' not in result or 'rows_per_sec' not in previous:
+            continue
+        ratio = result['rows_per_sec'] / previous['rows_per_sec']
+        if ratio < 1 - max_regression:
+            regressions.append(f"{name}: {result['rows_per_sec']:.0f} строк/с против {previous['rows_per_sec']:.0f} ({ratio - 1:+.0%})")
+    return regressions
+
+def print_report(results: dict):
+    print(f"Строк во входном файле: {results['meta']['lines']}")
+    for name, result in results['stages'].items():
+        if 'skipped' in result:
+            print(f"{name:<28} пропущено: {result['skipped']}")
+            continue
+        if name == 'cli_startup':
+            print(f"{name:<28} {result['seconds'] * 1000:8.1f} мс")
+            continue
+        peak = f"{result['peak_bytes'] / 2 ** 20:9.1f} МБ" if 'peak_bytes' in result else ''
+        print(f"{name:<28} {result['seconds']:8.3f} с {result['rows_per_sec']:12.0f} строк/с {peak}")
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Замеры производительности разбора и записи показаний счётчиков.")
+    parser.add_argument('--lines', type=int, default=1000000, help="число строк в синтетическом файле")
+    parser.add_argument('--error-rate', type=float, default=0.01, help="доля некорректных строк")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help="готовый файл вместо синтетического")
+    parser.add_argument('--stage', action='append', dest='stages', help="запустить только указанный этап")
+    parser.add_argument('--repeat', type=int, default=1, help="повторов на этап, берётся лучшее время")
+    parser.add_argument('--no-memory', action='store_true', help="не измерять пиковую память")
+    parser.add_argument('--output', help="сохранить результаты в JSON")
+    parser.add_argument('--baseline', help="JSON предыдущего запуска для сравнения")
+    parser.add_argument('--max-regression', type=float, default=0.2, help="допустимое падение пропускной способности")
+    parser.add_argument('--max-startup', type=float, help="предельное время запуска CLI в секундах")
+    args = parser.parse_args(argv)
+
+    data_path = args.data
+    temp_dir = None
+    if data_path is None:
+        temp_dir = tempfile.TemporaryDirectory()
+        data_path = os.path.join(temp_dir.name, 'meters.csv')
+        generate_meter_file(data_path, args.lines, args.error_rate, args.seed)
+    try:
+        results = run_benchmarks(data_path, args.stages, args.repeat, not args.no_memory)
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    results['meta']['error_rate'] = args.error_rate
+    results['meta']['seed'] = args.seed
+    print_report(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+    startup = results['stages'].get('cli_startup')
+    if args.max_startup is not None and startup is not None and startup['seconds'] > args.max_startup:
+        print(f"Запуск CLI {startup['seconds'] * 1000:.0f} мс, допустимо {args.max_startup * 1000:.0f} мс")
+        return 1
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"Регрессия: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+from model import ElectricityMeterReading, WaterMeterReading, parse_date
+
+class LegacyWaterMeterReading:
+    def __init__(self, resource_type: str, date: datetime, value: float, flow_rate: float, total_volume: float):
+        self.resource_type = resource_type
+        self.date = date
+        self.value = value
+        self.flow_rate = flow_rate
+        self.total_volume = total_volume
+
+class LegacyElectricityMeterReading:
+    def __init__(self, resource_type: str, date: datetime, value: float, power: float, total_energy: float, frequency: float):
+        self.resource_type = resource_type
+        self.date = date
+        self.value = value
+        self.power = power
+        self.total_energy = total_energy
+        self.frequency = frequency
+
+def _fresh_date(i: int) -> datetime:
+    return datetime.strptime((datetime(2024, 1, 1) + timedelta(days=i % 365)).strftime('%d.%m.%Y'), '%d.%m.%Y')
+
+def _shared_date(i: int) -> datetime:
+    return parse_date((datetime(2024, 1, 1) + timedelta(days=i % 365)).strftime('%d.%m.%Y'))
+
+def measure(factory, count: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    readings = [factory(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del readings
+    return (after - before) / count
+
+def main(count: int = 200000):
+    cases = [
+        ("Вода, dict + новый datetime",
+         lambda i: LegacyWaterMeterReading("Вода", _fresh_date(i), i * 0.5, 1.5, i * 2.0)),
+        ("Вода, __slots__ + общий datetime",
+         lambda i: WaterMeterReading("Вода", _shared_date(i), i * 0.5, 1.5, i * 2.0)),
+        ("Электричество, dict + новый datetime",
+         lambda i: LegacyElectricityMeterReading("Электричество", _fresh_date(i), i * 0.5, 1.5, i * 2.0, 50.0)),
+        ("Электричество, __slots__ + общий datetime",
+         lambda i: ElectricityMeterReading("Электричество", _shared_date(i), i * 0.5, 1.5, i * 2.0, 50.0)),
+    ]
+    results = [(name, measure(factory, count)) for name, factory in cases]
+    for name, size in results:
+        print(f"{name:<45} {size:8.1f} байт/объект")
+    for (_, legacy), (name, compact) in zip(results[::2], results[1::2]):
+        print(f"{name.split(',')[0]}: экономия {legacy - compact:.1f} байт/объект ({1 - compact / legacy:.0%})")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from typing import Optional
+
+from instrument import count, stage
+from model import BINARY_SUFFIX, BINARY_VERSION, CHUNK_SIZE, ERRORS_SUFFIX, PARSER_VERSION, ErrorCollector, _error_result
+from model import _replace_atomically
+from model import read_binary, read_meter_columns, write_binary
+
+CACHE_DIR = os.environ.get('METER_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'meter-readings'))
+CACHE_LIMIT = 512 << 20
+SOURCES_SUFFIX = '.lines'
+SOURCES_MAGIC = b'MSRC'
+_SOURCES_HEADER = struct.Struct('<4sxxxxqqq')
+
+def file_digest(file_path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ParseCache:
+    def __init__(self, directory: str = None, limit: int = CACHE_LIMIT):
+        self.directory = directory or CACHE_DIR
+        self.limit = limit
+
+    def key(self, file_path: str) -> str:
+        return f"{file_digest(file_path)}-p{PARSER_VERSION}-b{BINARY_VERSION}"
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key)
+        return base + BINARY_SUFFIX, base + ERRORS_SUFFIX, base + SOURCES_SUFFIX
+
+    def discard(self, key: str):
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load(self, key: str):
+        data_path, errors_path, _ = self._paths(key)
+        try:
+            with stage('cache_load'):
+                water, electricity = read_binary(data_path)
+                errors = ErrorCollector.load(errors_path, None)
+        except FileNotFoundError:
+            count('cache_miss')
+            return None
+        except (OSError, ValueError, UnicodeDecodeError, struct.error):
+            # повреждённая запись: удаляем и разбираем файл заново
+            count('cache_corrupt')
+            self.discard(key)
+            return None
+        count('cache_hit')
+        try:
+            os.utime(data_path)
+        except OSError:
+            pass
+        return water, electricity, errors
+
+    def load_sources(self, key: str):
+        # номера исходных строк показаний: (число строк файла, (вода, электричество)) или None
+        try:
+            with open(self._paths(key)[2], 'rb') as file:
+                magic, line_count, water_count, electricity_count = _SOURCES_HEADER.unpack(file.read(_SOURCES_HEADER.size))
+                if magic != SOURCES_MAGIC:
+                    return None
+                sources = array('q'), array('q')
+                sources[0].fromfile(file, water_count)
+                sources[1].fromfile(file, electricity_count)
+        except (OSError, EOFError, struct.error):
+            return None
+        if sys.byteorder == 'big':
+            for lines in sources:
+                lines.byteswap()
+        return line_count, sources
+
+    def store(self, key: str, water_readings, electricity_readings, errors: ErrorCollector, sources: tuple = None):
+        # запись читают вызывающие с любым пределом ошибок, поэтому кэшируется только полный набор
+        if errors.dropped:
+            raise ValueError("В кэш можно сохранить только полный набор ошибок.")
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, errors_path, sources_path = self._paths(key)
+        # ошибки и номера строк пишутся первыми: запись считается готовой, когда появился файл данных
+        with stage('cache_store'):
+            errors.dump(errors_path)
+            if sources is not None:
+                line_count, (water_lines, electricity_lines) = sources
+                with _replace_atomically(sources_path, 'wb') as file:
+                    file.write(_SOURCES_HEADER.pack(SOURCES_MAGIC, line_count, len(water_lines), len(electricity_lines)))
+                    for lines in (water_lines, electricity_lines):
+                        if sys.byteorder == 'big':
+                            lines = array('q', lines)
+                            lines.byteswap()
+                        lines.tofile(file)
+            write_binary(data_path, water_readings, electricity_readings)
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(BINARY_SUFFIX):
+                key = name[:-len(BINARY_SUFFIX)]
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                    paths = self._paths(key)
+                    size = stat.st_size + os.path.getsize(paths[1])
+                    if os.path.exists(paths[2]):
+                        size += os.path.getsize(paths[2])
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, size, key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.limit:
+                break
+            self.discard(key)
+            total -= size
+
+def file_unchanged(file_path: str, stat: os.stat_result) -> bool:
+    try:
+        current = os.stat(file_path)
+    except OSError:
+        return False
+    return (current.st_size, current.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+def read_meter_columns_cached(file_path: str, cache: Optional[ParseCache] = None, collector: ErrorCollector = None):
+    # в кэше лежат все ошибки файла, предел collector применяется при выдаче
+    cache = cache or ParseCache()
+    errors = ErrorCollector(None) if collector is None else collector
+    before = os.stat(file_path)
+    key = cache.key(file_path)
+    cached = cache.load(key)
+    if cached is not None:
+        water_columns, electricity_columns, stored = cached
+        errors.merge(stored)
+        return water_columns, electricity_columns, _error_result(errors, collector)
+    all_errors = ErrorCollector(None)
+    water_columns, electricity_columns, _ = read_meter_columns(file_path, collector=all_errors)
+    errors.merge(all_errors)
+    # файл менялся во время разбора: результат не соответствует посчитанному хэшу
+    if file_unchanged(file_path, before):
+        try:
+            cache.store(key, water_columns, electricity_columns, all_errors)
+        except OSError:
+            pass
+    return water_columns, electricity_columns, _error_result(errors, collector)
@@ -0,0 +1,165 @@
+import argparse
+import os
+import sys
+
+import instrument
+from model import BINARY_SUFFIX, ERRORS_SUFFIX, ErrorCollector, is_binary_path, is_sqlite_path, read_binary, read_meter_columns
+from model import read_sqlite, write_binary, write_file, write_sqlite
+
+def _load(file_path: str, collector: ErrorCollector = None):
+    # по умолчанию ошибки только считаются: печатать их нужно лишь validate
+    collector = ErrorCollector(0) if collector is None else collector
+    if is_binary_path(file_path):
+        water, electricity = read_binary(file_path)
+        return water, electricity, collector
+    if is_sqlite_path(file_path):
+        water, electricity = read_sqlite(file_path)
+        return water, electricity, collector
+    return read_meter_columns(file_path, collector=collector)
+
+def validate(args) -> int:
+    failed = False
+    for file_path in args.files:
+        spill_path = file_path + ERRORS_SUFFIX if args.errors_file else None
+        with ErrorCollector(args.max_errors, spill_path) as collector:
+            water, electricity, errors = _load(file_path, collector)
+        print(f"{file_path}: показаний {len(water) + len(electricity)}, ошибок {len(errors)}")
+        for error in errors:
+            print(f"  {error}")
+        if errors.dropped:
+            print(f"  ... ещё {errors.dropped}")
+        if errors:
+            print(f"  {errors.summary()}")
+        if spill_path is not None:
+            print(f"  все ошибки записаны в {spill_path}")
+        failed = failed or bool(errors)
+    return 1 if failed else 0
+
+def convert(args) -> int:
+    water, electricity, errors = _load(args.source)
+    if is_sqlite_path(args.target):
+        write = write_sqlite
+    else:
+        write = write_binary if is_binary_path(args.target) else write_file
+    write(args.target, water, electricity)
+    print(f"{args.target}: записано показаний {len(water) + len(electricity)}, пропущено строк с ошибками {len(errors)}")
+    return 1 if errors and args.strict else 0
+
+def summarize(args) -> int:
+    # аналитика нужна только этой команде
+    from analytics import summarize as summarize_readings
+    water, electricity, errors = _load(args.file)
+    summary = summarize_readings(water, electricity, args.period)
+    date_format = '%m.%Y' if args.period == 'month' else '%d.%m.%Y'
+    for resource_type, item in summary.items():
+        print(f"{resource_type}: показаний {item['readings']} ({item['first']:%d.%m.%Y} - {item['last']:%d.%m.%Y})")
+        print(f"  потребление {item['consumption']:.2f}, сбросов счётчика {item['resets']}, "
+              f"отрицательных приростов {item['negative']}, частота не 50/60 Гц: {item['bad_frequency']}")
+        print(f"  средняя мощность/расход {item['average_rate']:.2f} (последние {item['recent_rate']:.2f})")
+        for start, total in item['periods']:
+            print(f"  {start:{date_format}}\t{total:.2f}")
+    if errors:
+        print(f"Строк с ошибками: {len(errors)}")
+    return 0
+
+def merge(args) -> int:
+    from merge import merge_files
+    stats = merge_files(args.files, args.output, args.rule, temp_dir=args.temp_dir)
+    print(f"{args.output}: {stats}")
+    for file_path, errors in stats.errors.items():
+        if errors:
+            print(f"  {file_path}: {errors.summary()}")
+    return 0
+
+def publish(args) -> int:
+    import signal
+    import time
+    from cache import file_unchanged
+    from shm import SharedReadingsPublisher, segment_name
+    name = args.name or segment_name(args.file)
+    # по SIGTERM выходим через finally, чтобы сегмент был удалён
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with SharedReadingsPublisher(name) as publisher:
+        try:
+            while True:
+                stat = os.stat(args.file)
+                errors = publisher.publish_file(args.file, ErrorCollector(0))
+                print(f"{name}: поколение {publisher.generation}, показаний {publisher.readings}, ошибок {len(errors)}", flush=True)
+                while file_unchanged(args.file, stat):
+                    time.sleep(args.interval)
+        except KeyboardInterrupt:
+            return 0
+
+def gui(args) -> int:
+    from PyQt5 import QtWidgets
+    from view import MeterApp
+
+    app = QtWidgets.QApplication(sys.argv[:1])
+    window = MeterApp()
+    window.show()
+    if args.file:
+        window.file_path = args.file
+        window.load_data()
+    return app.exec_()
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Показания счётчиков: проверка, преобразование и сводка без GUI.")
+    parser.add_argument('--profile', metavar='REPORT',
+                        help=f"замерить этапы и записать отчёт (JSON или *{instrument.PROMETHEUS_SUFFIX}), "
+                             f"то же задаёт {instrument.PROFILE_ENV}")
+    parser.add_argument('--cprofile', metavar='PATH', help="сохранить статистику cProfile для pstats")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('validate', help="проверить файлы и вывести ошибки")
+    command.add_argument('files', nargs='+')
+    command.add_argument('--max-errors', type=int, default=20, help="сколько ошибок выводить на файл")
+    command.add_argument('--errors-file', action='store_true', help=f"записать все ошибки рядом с файлом в *{ERRORS_SUFFIX}")
+    command.set_defaults(handler=validate)
+
+    command = commands.add_parser('convert', help=f"преобразовать друг в друга CSV, {BINARY_SUFFIX} и базу SQLite (*.sqlite, *.db)")
+    command.add_argument('source')
+    command.add_argument('target')
+    command.add_argument('--strict', action='store_true', help="код возврата 1, если были ошибки")
+    command.set_defaults(handler=convert)
+
+    command = commands.add_parser('summarize', help="сводка потребления")
+    command.add_argument('file')
+    command.add_argument('--period', choices=('day', 'month'), default='month')
+    command.set_defaults(handler=summarize)
+
+    command = commands.add_parser('merge', help="слить файлы в один по типу и дате без дубликатов")
+    command.add_argument('files', nargs='+')
+    command.add_argument('-o', '--output', required=True)
+    # то же, что merge.CONFLICT_RULES: модуль слияния с tempfile импортируется только этой командой
+    command.add_argument('--rule', choices=('first', 'last', 'max', 'keep', 'error'), default='first',
+                         help="какое из разных показаний за одну дату оставить")
+    command.add_argument('--temp-dir', help="каталог для временных отсортированных прогонов")
+    command.set_defaults(handler=merge)
+
+    command = commands.add_parser('publish', help="разобрать файл и держать показания в общей памяти для других процессов")
+    command.add_argument('file')
+    command.add_argument('--name', help="имя сегмента, по умолчанию выводится из пути к файлу (shm.segment_name)")
+    command.add_argument('--interval', type=float, default=1.0, help="как часто проверять изменение файла, с")
+    command.set_defaults(handler=publish)
+
+    command = commands.add_parser('gui', help="открыть окно приложения")
+    command.add_argument('file', nargs='?')
+    command.set_defaults(handler=gui)
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.profile or args.cprofile:
+        instrument.enable(args.profile, args.cprofile)
+    else:
+        instrument.enable_from_env()
+    try:
+        return args.handler(args)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    finally:
+        instrument.finish()
+
+if __name__ == "__main__":
+    sys.exit(main())
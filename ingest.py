@@ -0,0 +1,349 @@
+import io
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, chain, compress, count, islice, repeat
+from operator import lt, ne, or_, sub
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from instrument import record, stage
+from model import CHUNK_SIZE, WRITE_BATCH, ElectricityMeterReading, ElectricityReadingColumns, ReadingColumns
+from model import STORED_TYPES, WaterMeterReading, WaterReadingColumns, _replace_atomically, write_file
+from model import ErrorCollector, _error_result, _parse_columns_blocks, iter_blocks, iter_meter_readings
+
+RANGE_SIZE = 32 << 20
+INDEX_CHUNK = 4 << 20
+# показание добавлено или изменено после загрузки: исходной строки у него нет
+NO_SOURCE = -1
+INDEX_MAGIC = b'MIDX'
+INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct('<4sHxxqqq')
+
+def split_file(file_path: str, range_size: int = RANGE_SIZE) -> List[Tuple[int, int]]:
+    size = os.path.getsize(file_path)
+    ranges = []
+    with open(file_path, 'rb') as file:
+        start = 0
+        while start < size:
+            end = start + range_size
+            if end < size:
+                file.seek(end - 1)
+                file.readline()
+                end = file.tell()
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _parse_range(task: Tuple[str, int, int, int]):
+    file_path, start, end, limit = task
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8').readlines()
+    water_columns, electricity_columns, errors = _parse_columns_blocks(iter_blocks(lines), ErrorCollector(limit))
+    return water_columns, electricity_columns, errors, len(lines)
+
+def read_columns_parallel(file_path: str, workers: int = None, range_size: int = RANGE_SIZE, collector: ErrorCollector = None):
+    water_columns = WaterReadingColumns()
+    electricity_columns = ElectricityReadingColumns()
+    errors = ErrorCollector(None) if collector is None else collector
+    # процессу не нужно передавать назад больше ошибок, чем сохранит общий collector; в spill пишутся все
+    limit = None if errors.spill_path is not None else errors.limit
+    tasks = [(file_path, start, end, limit) for start, end in split_file(file_path, range_size)]
+    line_offset = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for water, electricity, range_errors, line_count in executor.map(_parse_range, tasks):
+            water_columns.extend_columns(water)
+            electricity_columns.extend_columns(electricity)
+            for error in range_errors:
+                error.line_number += line_offset
+            errors.merge(range_errors)
+            line_offset += line_count
+
+    return water_columns, electricity_columns, _error_result(errors, collector)
+
+def parse_file_parallel(file_path: str, workers: int = None, range_size: int = RANGE_SIZE, collector: ErrorCollector = None):
+    water_columns, electricity_columns, errors = read_columns_parallel(file_path, workers, range_size, collector)
+    return list(water_columns), list(electricity_columns), errors
+
+def line_offsets(data) -> array:
+    # смещения начала каждой строки и конец файла: строка n занимает data[offsets[n]:offsets[n + 1]]
+    size = len(data)
+    offsets = array('q', [0])
+    pos = 0
+    while pos < size:
+        pieces = data[pos:pos + INDEX_CHUNK].split(b'\n')
+        if len(pieces) == 1:
+            end = data.find(b'\n', pos)
+            if end < 0:
+                break
+            pos = end + 1
+            offsets.append(pos)
+            continue
+        pieces.pop()
+        offsets.extend(islice(accumulate(map((1).__add__, map(len, pieces)), initial=pos), 1, None))
+        pos = offsets[-1]
+    if offsets[-1] != size:
+        offsets.append(size)
+    return offsets
+
+class IndexedMeterFile:
+    def __init__(self, file_path: str, index_path: str = None):
+        self.file_path = file_path
+        self.index_path = index_path or file_path + '.idx'
+        self._file = open(file_path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b''
+        self.offsets = self._load_index(stat)
+        if self.offsets is None:
+            self.offsets = self._build_index()
+            self._save_index(stat)
+
+    def _load_index(self, stat):
+        try:
+            with open(self.index_path, 'rb') as file:
+                header = file.read(_INDEX_HEADER.size)
+                magic, version, size, mtime_ns, count = _INDEX_HEADER.unpack(header)
+                if (magic, version, size, mtime_ns) != (INDEX_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns):
+                    return None
+                offsets = array('q')
+                offsets.fromfile(file, count)
+        except (OSError, EOFError, struct.error):
+            return None
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        return offsets
+
+    def _save_index(self, stat):
+        offsets = array('q', self.offsets)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+        temp_path = self.index_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(_INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, stat.st_size, stat.st_mtime_ns, len(offsets)))
+                offsets.tofile(file)
+            os.replace(temp_path, self.index_path)
+        except OSError:
+            # индекс только ускоряет повторное открытие, без него можно работать
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _build_index(self) -> array:
+        return line_offsets(self._mmap)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def line(self, n: int) -> str:
+        if not 0 <= n < len(self):
+            raise IndexError("Номер строки вне файла.")
+        line = self._mmap[self.offsets[n]:self.offsets[n + 1]].decode('utf-8')
+        if line.endswith('\n'):
+            line = line[:-1]
+        return line[:-1] if line.endswith('\r') else line
+
+    def lines(self, start: int, stop: int) -> List[str]:
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return []
+        text = self._mmap[self.offsets[start]:self.offsets[stop]].decode('utf-8').replace('\r\n', '\n')
+        lines = text.split('\n')
+        if text.endswith('\n'):
+            lines.pop()
+        return lines
+
+    def readings(self, start: int, count: int) -> list:
+        return list(iter_meter_readings(self.lines(start, start + count), start))
+
+    def reading(self, n: int):
+        items = list(iter_meter_readings([self.line(n)], n))
+        return items[0] if items else None
+
+def _source_runs(sources: array) -> Iterator[Tuple[int, int]]:
+    # участки, где исходные строки идут подряд; показание без исходной строки всегда отдельный участок
+    breaks = compress(count(1), map(or_, map(ne, map(sub, islice(sources, 1, None), sources), repeat(1)),
+                                    map(lt, sources, repeat(NO_SOURCE + 1))))
+    start = 0
+    for stop in chain(breaks, (len(sources),)):
+        if start < stop:
+            yield start, stop
+        start = stop
+
+def _format_range(readings, start: int, stop: int) -> Iterator[str]:
+    for batch_start in range(start, stop, WRITE_BATCH):
+        batch_stop = min(stop, batch_start + WRITE_BATCH)
+        if isinstance(readings, ReadingColumns):
+            yield '\n'.join(readings.format_rows(batch_start, batch_stop)) + '\n'
+        else:
+            yield ''.join([f"{readings[idx]}\n" for idx in range(batch_start, batch_stop)])
+
+def write_file_incremental(file_path: str, water_readings, electricity_readings, sources: Tuple[array, array],
+                           line_count: int, progress: Callable[[int], None] = None) -> int:
+    """Перезаписывает file_path, копируя неизменённые показания прямо из его байтов.
+
+    sources - номера строк file_path для каждого показания (NO_SOURCE для новых и изменённых),
+    line_count - число строк файла при загрузке. Если файл уже не тот, пишет всё заново как write_file.
+    Возвращает число скопированных без разбора показаний.
+    """
+    collections = (water_readings, electricity_readings)
+    offsets = None
+    if all(len(lines) == len(readings) for lines, readings in zip(sources, collections)):
+        with open(file_path, 'rb') as source:
+            size = os.fstat(source.fileno()).st_size
+            if size:
+                with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    offsets = line_offsets(data)
+        # строки считаются не так, как при загрузке (одиночные \r), или файл уже другой
+        if offsets is not None and (len(offsets) - 1 != line_count or max(chain(*sources), default=NO_SOURCE) >= line_count):
+            offsets = None
+    if offsets is None:
+        write_file(file_path, water_readings, electricity_readings, progress)
+        return 0
+    with stage('write_incremental'), _replace_atomically(file_path, 'wb') as output:
+        with open(file_path, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if len(data) != size:
+                raise ValueError("Файл изменился во время сохранения.")
+            copied = _copy_runs(output, data, offsets, collections, sources, progress)
+    record('write_incremental', len(water_readings) + len(electricity_readings))
+    return copied
+
+def _copy_runs(output, data, offsets: array, collections: Iterable, sources: Iterable[array],
+               progress: Callable[[int], None] = None) -> int:
+    copied = 0
+    done = 0
+    # короткие участки (исходный файл вперемешку вода/электричество) собираются в один write
+    pieces = []
+    buffered = 0
+    for readings, lines in zip(collections, sources):
+        dirty_start = None
+        for start, stop in chain(_source_runs(lines), ((len(lines), len(lines)),)):
+            if start < stop and lines[start] == NO_SOURCE:
+                # подряд идущие изменённые показания форматируются одной пачкой
+                if dirty_start is None:
+                    dirty_start = start
+                continue
+            if dirty_start is not None:
+                output.write(b''.join(pieces))
+                pieces = []
+                buffered = 0
+                for text in _format_range(readings, dirty_start, start):
+                    output.write(text.encode('utf-8'))
+                dirty_start = None
+            if start < stop:
+                begin, end = offsets[lines[start]], offsets[lines[stop - 1] + 1]
+                if end - begin > CHUNK_SIZE:
+                    output.write(b''.join(pieces))
+                    pieces = []
+                    buffered = 0
+                    for pos in range(begin, end, CHUNK_SIZE):
+                        output.write(data[pos:min(end, pos + CHUNK_SIZE)])
+                else:
+                    pieces.append(data[begin:end])
+                    buffered += end - begin
+                if data[end - 1:end] != b'\n':
+                    # последняя строка файла без перевода строки
+                    pieces.append(b'\n')
+                copied += stop - start
+            if buffered >= CHUNK_SIZE or start == stop:
+                output.write(b''.join(pieces))
+                pieces = []
+                buffered = 0
+                if progress is not None:
+                    progress(done + stop)
+        done += len(lines)
+    return copied
+
+class MeterFileFollower:
+    def __init__(self, file_path: str, chunk_size: int = CHUNK_SIZE):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.line_count = 0
+        self._identity = None
+        self._last_line_start = 0
+        self._last_line_crc = 0
+
+    def changed(self) -> bool:
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            # файл могли переименовать при ротации, новый ещё не создан
+            return False
+        if self._identity is None:
+            return False
+        if (stat.st_dev, stat.st_ino) != self._identity or stat.st_size < self.offset:
+            return True
+        if not self.offset:
+            return False
+        with open(self.file_path, 'rb') as file:
+            file.seek(self._last_line_start)
+            last_line = file.read(self.offset - self._last_line_start)
+        return zlib.crc32(last_line) != self._last_line_crc
+
+    def iter_new_blocks(self) -> Iterator[List[str]]:
+        try:
+            file = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            return
+        with file:
+            stat = os.fstat(file.fileno())
+            self._identity = (stat.st_dev, stat.st_ino)
+            file.seek(self.offset)
+            tail = b''
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    break
+                data = tail + chunk
+                end = data.rfind(b'\n') + 1
+                if not end:
+                    tail = data
+                    continue
+                data, tail = data[:end], data[end:]
+                last_line_start = data.rfind(b'\n', 0, end - 1) + 1
+                lines = data[:-1].decode('utf-8').replace('\r\n', '\n').split('\n')
+                self._last_line_start = self.offset + last_line_start
+                self._last_line_crc = zlib.crc32(data[last_line_start:])
+                self.offset += end
+                self.line_count += len(lines)
+                yield lines
+
+    def read_new(self) -> List[str]:
+        return [line for block in self.iter_new_blocks() for line in block]
+
+    def poll(self):
+        if self.changed():
+            return None
+        start = self.line_count
+        water_readings = []
+        electricity_readings = []
+        errors = []
+        for item in iter_meter_readings(self.read_new(), start, STORED_TYPES):
+            if isinstance(item, WaterMeterReading):
+                water_readings.append(item)
+            elif isinstance(item, ElectricityMeterReading):
+                electricity_readings.append(item)
+            else:
+                errors.append(str(item))
+        return water_readings, electricity_readings, errors
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+from contextlib import nullcontext
+from typing import Dict, Optional
+
+# путь к отчёту (*.prom - формат Prometheus, иначе JSON); включает замеры без флагов командной строки
+PROFILE_ENV = 'METER_PROFILE'
+CPROFILE_ENV = 'METER_CPROFILE'
+PROMETHEUS_SUFFIX = '.prom'
+
+_DISABLED = nullcontext()
+_session = None
+
+class StageStats:
+    __slots__ = ('seconds', 'calls', 'rows', 'errors')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.errors = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'seconds': self.seconds,
+            'calls': self.calls,
+            'rows': self.rows,
+            'rows_per_sec': self.rows / self.seconds if self.rows and self.seconds else None,
+            'errors': self.errors,
+        }
+
+class _Timer:
+    __slots__ = ('stats', 'started')
+
+    def __init__(self, stats: StageStats):
+        self.stats = stats
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self.stats
+
+    def __exit__(self, *exc_info):
+        self.stats.seconds += time.perf_counter() - self.started
+        self.stats.calls += 1
+
+class Session:
+    def __init__(self, report_path: str = None, cprofile_path: str = None):
+        self.report_path = report_path
+        self.cprofile_path = cprofile_path
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.profiler = None
+        if cprofile_path is not None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stats(self, name: str) -> StageStats:
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return stats
+
+    def report(self) -> dict:
+        return {
+            'wall_seconds': time.perf_counter() - self.started,
+            'peak_rss_bytes': peak_rss(),
+            'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+    def finish(self) -> dict:
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.cprofile_path)
+            self.profiler = None
+        report = self.report()
+        if self.report_path is not None:
+            write_report(self.report_path, report)
+        return report
+
+def peak_rss() -> Optional[int]:
+    # resource есть только на Unix
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def enable(report_path: str = None, cprofile_path: str = None) -> Session:
+    global _session
+    _session = Session(report_path, cprofile_path)
+    return _session
+
+def enabled() -> bool:
+    return _session is not None
+
+def finish() -> Optional[dict]:
+    global _session
+    session, _session = _session, None
+    return None if session is None else session.finish()
+
+def stage(name: str):
+    # выключенные замеры стоят одного сравнения: общий пустой контекст без обращения к часам
+    if _session is None:
+        return _DISABLED
+    return _Timer(_session.stats(name))
+
+def record(name: str, rows: int = 0, errors: int = 0):
+    if _session is not None:
+        stats = _session.stats(name)
+        stats.rows += rows
+        stats.errors += errors
+
+def count(name: str, value: int = 1):
+    if _session is not None:
+        _session.counters[name] = _session.counters.get(name, 0) + value
+
+def prometheus_text(report: dict, prefix: str = 'meter') -> str:
+    lines = []
+    metrics = (('seconds', 'время этапа, с'), ('calls', 'число вызовов'), ('rows', 'обработано строк'), ('errors', 'ошибок'))
+    for field, help_text in metrics:
+        lines.append(f"# HELP {prefix}_stage_{field}_total {help_text}")
+        lines.append(f"# TYPE {prefix}_stage_{field}_total counter")
+        lines.extend(f'{prefix}_stage_{field}_total{{stage="{name}"}} {stats[field]}' for name, stats in report['stages'].items())
+    for name, value in report['counters'].items():
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    lines.append(f"# TYPE {prefix}_wall_seconds gauge")
+    lines.append(f"{prefix}_wall_seconds {report['wall_seconds']}")
+    if report['peak_rss_bytes'] is not None:
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes {report['peak_rss_bytes']}")
+    return '\n'.join(lines) + '\n'
+
+def write_report(file_path: str, report: dict):
+    if file_path.endswith(PROMETHEUS_SUFFIX):
+        text = prometheus_text(report)
+    else:
+        import json
+        text = json.dumps(report, ensure_ascii=False, indent=2) + '\n'
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+
+def enable_from_env() -> bool:
+    report_path = os.environ.get(PROFILE_ENV)
+    cprofile_path = os.environ.get(CPROFILE_ENV)
+    if not (report_path or cprofile_path) or enabled():
+        return False
+    import atexit
+    enable(report_path or None, cprofile_path or None)
+    atexit.register(finish)
+    return True
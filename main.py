@@ -1,9 +1,7 @@
-from PyQt5 import QtWidgets
-from view import MeterApp
 import sys
 
+from cli import main
+
 if __name__ == "__main__":
-    app = QtWidgets.QApplication(sys.argv)
-    window = MeterApp()
-    window.show()
-    sys.exit(app.exec_())
+    # без аргументов открывается окно, как раньше; PyQt5 загружается только для него
+    sys.exit(main(sys.argv[1:] or ['gui']))
@@ -0,0 +1,147 @@
+import os
+import tempfile
+from heapq import merge
+from itertools import chain, groupby, islice, repeat
+from operator import itemgetter, methodcaller, sub
+from typing import Dict, Iterable, Iterator, List
+
+from instrument import record, stage
+from model import CHUNK_SIZE, WRITE_BATCH, ErrorCollector, _replace_atomically, date_from_days, format_date
+from model import _parse_block, iter_file_blocks, reading_type
+
+RUN_SIZE = 1 << 18
+MERGE_FANIN = 64
+CONFLICT_RULES = ('first', 'last', 'max', 'keep', 'error')
+# сдвиг дней: ключ прогона сравнивается как строка, дни до 1970 года не должны быть отрицательными
+_DAY_OFFSET = 10 ** 7
+
+class MergeStats:
+    __slots__ = ('readings', 'duplicates', 'conflicts', 'written', 'runs', 'errors')
+
+    def __init__(self):
+        self.readings = 0
+        self.duplicates = 0
+        self.conflicts = 0
+        self.written = 0
+        self.runs = 0
+        self.errors: Dict[str, ErrorCollector] = {}
+
+    def __str__(self):
+        return (f"прочитано показаний {self.readings}, дубликатов {self.duplicates}, "
+                f"конфликтов {self.conflicts}, записано {self.written}")
+
+def _records(file_path: str, source: int, errors: ErrorCollector) -> Iterator[List[str]]:
+    # строка прогона: тип, дни, источник и номер строки, исходная строка файла;
+    # порядок строк совпадает с порядком сортировки. Числа заново не форматируются, строка уже в формате файла
+    start = 0
+    for block in iter_file_blocks(file_path):
+        parsed, block_errors = _parse_block(block, start)
+        errors.extend(block_errors)
+        for resource_types, _, days, _, indexes in parsed.values():
+            texts = map(str.strip, map(block.__getitem__, map(sub, indexes, repeat(start))))
+            yield list(map('{}\t{:08d}\t{:06d}{:012d}\t{}\n'.format, resource_types, map(_DAY_OFFSET.__add__, days),
+                           repeat(source), indexes, texts))
+        start += len(block)
+
+def _spill(lines: List[str], directory: str) -> str:
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with open(fd, 'w', encoding='utf-8') as file:
+        for start in range(0, len(lines), WRITE_BATCH):
+            file.writelines(lines[start:start + WRITE_BATCH])
+    return path
+
+def _iter_run(path: str) -> Iterator[str]:
+    with open(path, 'r', encoding='utf-8', buffering=CHUNK_SIZE) as file:
+        yield from file
+
+def _sorted_runs(blocks: Iterable[List[str]], directory: str, run_size: int, stats: MergeStats) -> List[str]:
+    runs = []
+    blocks = iter(blocks)
+    while True:
+        lines = []
+        with stage('merge_runs'):
+            for block in blocks:
+                lines.extend(block)
+                if len(lines) >= run_size:
+                    break
+            lines.sort()
+        stats.readings += len(lines)
+        if not lines:
+            return runs
+        runs.append(_spill(lines, directory))
+        stats.runs += 1
+
+def _reduce_runs(runs: List[str], directory: str, fanin: int) -> List[str]:
+    # открытых файлов одновременно не больше fanin: лишние прогоны сливаются в промежуточные
+    while len(runs) > fanin:
+        group, runs = runs[:fanin], runs[fanin:]
+        fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+        with open(fd, 'w', encoding='utf-8') as file:
+            file.writelines(merge(*map(_iter_run, group)))
+        for run in group:
+            os.remove(run)
+        runs.append(path)
+    return runs
+
+def _resolve(key: tuple, texts: List[str], rule: str) -> List[str]:
+    if rule == 'keep':
+        return texts
+    if rule == 'first':
+        return texts[:1]
+    if rule == 'last':
+        return texts[-1:]
+    if rule == 'max':
+        readings = [reading_type(text).parse(text) for text in texts]
+        return [max(zip(readings, texts), key=lambda pair: pair[0].value)[1]]
+    resource_type, days = key
+    date = format_date(date_from_days(int(days) - _DAY_OFFSET))
+    raise ValueError(f"Противоречивые показания {resource_type} за {date}: {' | '.join(map(str.rstrip, texts))}")
+
+def _merged_lines(lines: Iterator[str], rule: str, stats: MergeStats) -> Iterator[str]:
+    for key, group in groupby(map(methodcaller('split', '\t', 3), lines), itemgetter(0, 1)):
+        texts = list(map(itemgetter(3), group))
+        if len(texts) == 1:
+            yield texts[0]
+            continue
+        # в группе записи идут по источникам и порядку в файле: оставляем первое вхождение каждой
+        unique = list(dict.fromkeys(texts))
+        if len(unique) > 1:
+            # строки могут различаться только записью чисел (1 и 1.0): сравниваются разобранные показания
+            canonical = {}
+            for text in unique:
+                canonical.setdefault(str(reading_type(text).parse(text)), text)
+            unique = list(canonical.values())
+        stats.duplicates += len(texts) - len(unique)
+        if len(unique) > 1:
+            stats.conflicts += 1
+            unique = _resolve(key, unique, rule)
+        yield from unique
+
+def merge_files(input_paths: List[str], output_path: str, rule: str = 'first', run_size: int = RUN_SIZE,
+                temp_dir: str = None, fanin: int = MERGE_FANIN) -> MergeStats:
+    """Сливает файлы показаний в один, упорядоченный по (тип ресурса, дата).
+
+    Показания читаются потоком и сортируются прогонами по run_size, прогоны лежат во временных файлах,
+    так что память не зависит от размера входа. Полные дубликаты отбрасываются, разные показания
+    с одним ключом разрешаются правилом rule: first/last - из первого/последнего входа, max - с наибольшим
+    значением, keep - оставить все, error - ValueError.
+    """
+    if rule not in CONFLICT_RULES:
+        raise ValueError(f"Неизвестное правило: {rule}. Допустимо: {', '.join(CONFLICT_RULES)}.")
+    stats = MergeStats()
+    with tempfile.TemporaryDirectory(dir=temp_dir) as directory:
+        for file_path in input_paths:
+            stats.errors[file_path] = ErrorCollector()
+        records = chain.from_iterable(_records(file_path, source, stats.errors[file_path])
+                                      for source, file_path in enumerate(input_paths))
+        runs = _reduce_runs(_sorted_runs(records, directory, run_size, stats), directory, fanin)
+        with stage('merge_write'), _replace_atomically(output_path) as output:
+            lines = _merged_lines(merge(*map(_iter_run, runs)), rule, stats)
+            while True:
+                batch = list(islice(lines, WRITE_BATCH))
+                if not batch:
+                    break
+                output.writelines(batch)
+                stats.written += len(batch)
+    record('merge_write', stats.written)
+    return stats
@@ -1,21 +1,148 @@
-from datetime import datetime
-from typing import List
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from heapq import merge
+from itertools import chain, compress, count, islice, repeat
+from operator import attrgetter, is_, itemgetter, le, methodcaller
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+from instrument import count as count_event, record, stage
+
+CHUNK_SIZE = 1 << 20
+BLOCK_SIZE = 8192
+WRITE_BATCH = 8192
+DATE_CACHE_SIZE = 1 << 16
+# увеличивать при любом изменении правил разбора: сбрасывает кэш результатов
+PARSER_VERSION = 2
+ERROR_LIMIT = 1000
+ERRORS_SUFFIX = '.errors'
+ERROR_KINDS = {
+    'fields': 'неверное количество полей',
+    'date': 'некорректная дата',
+    'number': 'некорректное число',
+    'type': 'тип без хранения',
+    'other': 'прочие',
+}
+EPOCH = datetime(1970, 1, 1)
+
+_date_text_cache = {}
+
+def format_date(date: datetime) -> str:
+    text = _date_text_cache.get(date)
+    if text is None:
+        text = date.strftime('%d.%m.%Y')
+        if len(_date_text_cache) >= DATE_CACHE_SIZE:
+            _date_text_cache.clear()
+        _date_text_cache[date] = text
+    return text
+
+READING_TYPES = {}
+
+class ReadingError(ValueError):
+    def __init__(self, message: str, kind: str = 'other', field: str = None):
+        super().__init__(message)
+        self.kind = kind
+        self.field = field
+
+def register_reading_type(reading_class):
+    READING_TYPES[reading_class.prefix] = reading_class
+    return reading_class
 
 class MeterReading:
+    __slots__ = ('resource_type', 'date', 'value')
+    prefix = ''
+    title = 'счётчика'
+    fields = ('value',)
+    labels = ('Значение',)
+    # показания изменяемые и сравниваются по значению
+    __hash__ = None
+
     def __init__(self, resource_type: str, date: datetime, value: float):
         self.resource_type = resource_type
         self.date = date
         self.value = value
 
+    @classmethod
+    def parse_fields(cls, line: str) -> tuple:
+        parts = line.strip().split(';')
+        if len(parts) != len(cls.fields) + 2:
+            raise ReadingError(f"Неверное количество полей для {cls.title}.", 'fields')
+        try:
+            return (parts[0], parse_date(parts[1]), *[float(part.replace(',', '.')) for part in parts[2:]])
+        except ValueError as e:
+            raise cls._field_error(parts, e) from None
+
+    @classmethod
+    def _field_error(cls, parts: List[str], error: ValueError) -> ReadingError:
+        # сообщение остаётся прежним, дополнительно определяется поле, на котором споткнулся разбор
+        try:
+            parse_date(parts[1])
+        except ValueError:
+            return ReadingError(str(error), 'date', 'date')
+        for name, part in zip(cls.fields, parts[2:]):
+            try:
+                float(part.replace(',', '.'))
+            except ValueError:
+                return ReadingError(str(error), 'number', name)
+        return ReadingError(str(error))
+
+    @classmethod
+    def parse(cls, line: str) -> 'MeterReading':
+        return cls(*cls.parse_fields(line))
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def __str__(self):
+        return ';'.join((self.resource_type, format_date(self.date), *map(str, self._values())))
+
+    def __eq__(self, other):
+        if isinstance(other, type(self)):
+            return (self.resource_type == other.resource_type and
+                         self.date == other.date and
+                         self._values() == other._values())
+        return NotImplemented
+
+# типы из registry разбираются и форматируются общими методами по fields;
+# вода и электричество составляют почти весь поток строк, для них методы записаны явно
+@register_reading_type
 class WaterMeterReading(MeterReading):
+    __slots__ = ('flow_rate', 'total_volume')
+    prefix = 'Вода'
+    title = 'водяного счётчика'
+    fields = ('value', 'flow_rate', 'total_volume')
+    labels = ('Значение', 'Мгновенное значение', 'Общее потребление')
+
     def __init__(self, resource_type: str, date: datetime, value: float, flow_rate: float, total_volume: float):
         super().__init__(resource_type, date, value)
         self.flow_rate = flow_rate
         self.total_volume = total_volume
 
+    @classmethod
+    def parse_fields(cls, line: str) -> tuple:
+        parts = line.strip().split(';')
+        if len(parts) != 5:
+            raise ReadingError("Неверное количество полей для водяного счётчика.", 'fields')
+        try:
+            return (
+                parts[0],
+                parse_date(parts[1]),
+                float(parts[2].replace(',', '.')),
+                float(parts[3].replace(',', '.')),
+                float(parts[4].replace(',', '.'))
+            )
+        except ValueError as e:
+            raise cls._field_error(parts, e) from None
+
     def __str__(self):
-        return f"{self.resource_type};{self.date.strftime('%d.%m.%Y')};{self.value};{self.flow_rate};{self.total_volume}"
-    
+        return f"{self.resource_type};{format_date(self.date)};{self.value};{self.flow_rate};{self.total_volume}"
+
     def __eq__(self, other):
         if isinstance(other, WaterMeterReading):
             return (self.resource_type == other.resource_type and
@@ -25,63 +152,1155 @@ class WaterMeterReading(MeterReading):
                          self.total_volume == other.total_volume)
         return NotImplemented
 
+@register_reading_type
 class ElectricityMeterReading(MeterReading):
+    __slots__ = ('power', 'total_energy', 'frequency')
+    prefix = 'Электричество'
+    title = 'электрического счётчика'
+    fields = ('value', 'power', 'total_energy', 'frequency')
+    labels = ('Значение', 'Мгновенное значение', 'Общее потребление', 'Частота')
+
     def __init__(self, resource_type: str, date: datetime, value: float, power: float, total_energy: float, frequency: float):
         super().__init__(resource_type, date, value)
         self.power = power
         self.total_energy = total_energy
         self.frequency = frequency
 
+    @classmethod
+    def parse_fields(cls, line: str) -> tuple:
+        parts = line.strip().split(';')
+        if len(parts) != 6:
+            raise ReadingError("Неверное количество полей для электрического счётчика.", 'fields')
+        try:
+            return (
+                parts[0],
+                parse_date(parts[1]),
+                float(parts[2].replace(',', '.')),
+                float(parts[3].replace(',', '.')),
+                float(parts[4].replace(',', '.')),
+                float(parts[5].replace(',', '.'))
+            )
+        except ValueError as e:
+            raise cls._field_error(parts, e) from None
+
     def __str__(self):
-        return f"{self.resource_type};{self.date.strftime('%d.%m.%Y')};{self.value};{self.power};{self.total_energy};{self.frequency}"
-
-def parse_water_reading(line: str) -> WaterMeterReading:
-    parts = line.strip().split(';')
-    if len(parts) != 5:
-        raise ValueError("Неверное количество полей для водяного счётчика.")
-    return WaterMeterReading(
-        resource_type=parts[0],
-        date=datetime.strptime(parts[1], '%d.%m.%Y'),
-        value=float(parts[2].replace(',', '.')),
-        flow_rate=float(parts[3].replace(',', '.')),
-        total_volume=float(parts[4].replace(',', '.'))
-    )
-
-def parse_electricity_reading(line: str) -> ElectricityMeterReading:
-    parts = line.strip().split(';')
-    if len(parts) != 6:
-        raise ValueError("Неверное количество полей для электрического счётчика.")
-    return ElectricityMeterReading(
-        resource_type=parts[0],
-        date=datetime.strptime(parts[1], '%d.%m.%Y'),
-        value=float(parts[2].replace(',', '.')),
-        power=float(parts[3].replace(',', '.')),
-        total_energy=float(parts[4].replace(',', '.')),
-        frequency=float(parts[5].replace(',', '.'))
-    )
+        return f"{self.resource_type};{format_date(self.date)};{self.value};{self.power};{self.total_energy};{self.frequency}"
+
+    def __eq__(self, other):
+        if isinstance(other, ElectricityMeterReading):
+            return (self.resource_type == other.resource_type and
+                         self.date == other.date and
+                         self.value == other.value and
+                         self.power == other.power and
+                         self.total_energy == other.total_energy and
+                         self.frequency == other.frequency)
+        return NotImplemented
+
+# типы, для которых есть столбцы, файлы .mtrb и таблицы SQLite
+STORED_TYPES = (WaterMeterReading, ElectricityMeterReading)
+
+def _match_prefix(line: str):
+    # первое поле не совпало с типом целиком («Вода холодная», строка без «;»): прежняя проверка по началу строки
+    for prefix, reading_class in READING_TYPES.items():
+        if line.startswith(prefix):
+            return reading_class
+    return None
+
+def reading_type(line: str):
+    return READING_TYPES.get(line.partition(';')[0]) or _match_prefix(line)
+
+_date_cache = {}
+_day_dates = {}
+
+def parse_date(text: str) -> datetime:
+    # одинаковые даты разделяют один объект datetime
+    entry = _date_cache.get(text)
+    if entry is None:
+        count_event('strptime')
+        date = datetime.strptime(text, '%d.%m.%Y')
+        if len(_date_cache) >= DATE_CACHE_SIZE:
+            _date_cache.clear()
+        entry = _date_cache[text] = (date, (date - EPOCH).days)
+    return entry[0]
+
+def date_from_days(days: int) -> datetime:
+    date = _day_dates.get(days)
+    if date is None:
+        date = EPOCH + timedelta(days=days)
+        if len(_day_dates) >= DATE_CACHE_SIZE:
+            _day_dates.clear()
+        _day_dates[days] = date
+    return date
+
+parse_water_fields = WaterMeterReading.parse_fields
+parse_electricity_fields = ElectricityMeterReading.parse_fields
+parse_water_reading = WaterMeterReading.parse
+parse_electricity_reading = ElectricityMeterReading.parse
+
+def parse_reading(line: str) -> MeterReading:
+    reading_class = reading_type(line)
+    if reading_class is None:
+        raise ValueError("Неизвестный тип ресурса.")
+    return reading_class.parse(line)
+
+def _parse_dates(texts: Iterable[str]) -> dict:
+    cache = _date_cache
+    dates = {}
+    for text in set(texts):
+        entry = cache.get(text)
+        if entry is None:
+            try:
+                parse_date(text)
+            except Exception:
+                continue
+            entry = cache[text]
+        dates[text] = entry
+    return dates
+
+def _record_error(idx: int, line: str, parse_fields, errors: list):
+    with stage('bad_rows'):
+        try:
+            parse_fields(line)
+        except Exception as e:
+            errors.append(LineError.from_exception(idx + 1, e))
+    record('bad_rows', 1, 1)
+
+def _to_floats(tokens: List[str], bad: set) -> List[float]:
+    values = []
+    tokens = iter(tokens)
+    while True:
+        try:
+            values.extend(map(float, tokens))
+            return values
+        except ValueError:
+            # extend оставляет уже преобразованные значения, продолжаем со следующего токена
+            bad.add(len(values))
+            values.append(0.0)
+
+def _bulk_fields(indexes: List[int], lines: List[str], width: int, parse_fields, errors: list) -> tuple:
+    lines = list(map(str.strip, lines))
+    counts = list(map(methodcaller('count', ';'), lines))
+    if counts.count(width - 1) != len(counts):
+        for idx, line, count in zip(indexes, lines, counts):
+            if count != width - 1:
+                _record_error(idx, line, parse_fields, errors)
+        indexes = [idx for idx, count in zip(indexes, counts) if count == width - 1]
+        lines = [line for line, count in zip(lines, counts) if count == width - 1]
+    if not lines:
+        return [], [], [], [[] for _ in range(width - 2)], []
+
+    text = ';'.join(lines)
+    tokens = text.split(';')
+    date_texts = tokens[1::width]
+    dates = _parse_dates(date_texts)
+    bad = set()
+    if len(dates) != len(set(date_texts)):
+        # строки с некорректной датой отбрасываются вместе с некорректными числами, без повторного разбиения
+        bad.update(row for row, date_text in enumerate(date_texts) if date_text not in dates)
+
+    numbers = [tokens[k::width] for k in range(2, width)]
+    if ',' in text:
+        numbers = [[token.replace(',', '.') for token in column] for column in numbers]
+    resource_types = tokens[0::width]
+    columns = [_to_floats(column, bad) for column in numbers]
+    if bad:
+        # сообщения для этих строк даёт построчный разбор
+        for row in sorted(bad):
+            _record_error(indexes[row], lines[row], parse_fields, errors)
+        keep = [row not in bad for row in range(len(lines))]
+        columns = [list(compress(column, keep)) for column in columns]
+        resource_types = list(compress(resource_types, keep))
+        date_texts = list(compress(date_texts, keep))
+        indexes = list(compress(indexes, keep))
+    entries = list(map(dates.__getitem__, date_texts))
+    # последним идут номера исходных строк разобранных показаний
+    return resource_types, list(map(itemgetter(0), entries)), list(map(itemgetter(1), entries)), columns, indexes
+
+def iter_blocks(lines: Iterable[str], block_size: int = BLOCK_SIZE) -> Iterator[List[str]]:
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, block_size))
+        if not block:
+            return
+        yield block
+
+def _reading_types(lines: List[str]) -> list:
+    kinds = list(map(READING_TYPES.get, map(itemgetter(0), map(methodcaller('partition', ';'), lines))))
+    for idx in compress(range(len(kinds)), map(is_, kinds, repeat(None))):
+        kinds[idx] = _match_prefix(lines[idx])
+    return kinds
+
+def _parse_block(lines: List[str], start: int = 0):
+    indexes = range(start, start + len(lines))
+    errors = []
+    parsed = {}
+    with stage('parse'):
+        kinds = _reading_types(lines)
+        for reading_class in READING_TYPES.values():
+            mask = list(map(is_, kinds, repeat(reading_class)))
+            parsed[reading_class] = _bulk_fields(list(compress(indexes, mask)), list(compress(lines, mask)),
+                                                 len(reading_class.fields) + 2, reading_class.parse_fields, errors)
+        errors.sort(key=attrgetter('line_number'))
+    record('parse', len(lines), len(errors))
+    return parsed, errors
+
+def _unsupported_error(line_number: int, reading_class) -> 'LineError':
+    return LineError(line_number, f"Показания {reading_class.title} не загружаются: хранятся только вода и электричество.", 'type')
+
+def _parse_stored_block(lines: List[str], start: int = 0):
+    # типы из registry без столбцов разбираются, но не пропадают молча: каждое такое показание становится ошибкой
+    parsed, errors = _parse_block(lines, start)
+    rejected = [_unsupported_error(idx + 1, reading_class) for reading_class, fields in parsed.items()
+                if reading_class not in STORED_TYPES for idx in fields[4]]
+    if rejected:
+        errors = sorted(errors + rejected, key=attrgetter('line_number'))
+    return parsed, errors
+
+def parse_meter_block(lines: List[str], start: int = 0):
+    parsed, errors = _parse_stored_block(lines, start)
+    return parsed[WaterMeterReading], parsed[ElectricityMeterReading], [str(error) for error in errors]
 
 def read_file(file_path: str) -> List[str]:
+    with stage('read_file'), open(file_path, 'r', encoding='utf-8') as file:
+        lines = file.readlines()
+    record('read_file', len(lines))
+    return lines
+
+def _text_batches(readings: Iterable[MeterReading]) -> Iterator[List[str]]:
+    if isinstance(readings, ReadingColumns):
+        for start in range(0, len(readings), WRITE_BATCH):
+            yield readings.format_rows(start, start + WRITE_BATCH)
+    elif isinstance(readings, SqliteReadings):
+        for columns in readings.pages(WRITE_BATCH):
+            yield columns.format_rows()
+    else:
+        for batch in iter_blocks(readings, WRITE_BATCH):
+            yield list(map(str, batch))
+
+@contextmanager
+def _replace_atomically(file_path: str, mode: str = 'w'):
+    directory, name = os.path.split(os.path.abspath(file_path))
+    temp_path = os.path.join(directory, f".{name}.{os.urandom(4).hex()}.tmp")
+    encoding = None if 'b' in mode else 'utf-8'
+    try:
+        with open(temp_path, mode.replace('w', 'x'), encoding=encoding) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def _write_atomic(file_path: str, batches: Iterable[List[str]], progress: Callable[[int], None] = None):
+    with stage('write_file'), _replace_atomically(file_path) as file:
+        written = 0
+        for batch in batches:
+            if batch:
+                file.write('\n'.join(batch) + '\n')
+                written += len(batch)
+                if progress is not None:
+                    progress(written)
+    record('write_file', written)
+
+def write_readings(file_path: str, readings: Iterable[MeterReading], progress: Callable[[int], None] = None):
+    _write_atomic(file_path, _text_batches(readings), progress)
+
+def write_file(file_path: str, water_readings: Iterable[WaterMeterReading], electricity_readings: Iterable[ElectricityMeterReading],
+               progress: Callable[[int], None] = None):
+    _write_atomic(file_path, chain(_text_batches(water_readings), _text_batches(electricity_readings)), progress)
+
+class LineError:
+    __slots__ = ('line_number', 'message', 'kind', 'field')
+
+    def __init__(self, line_number: int, message: str, kind: str = 'other', field: str = None):
+        self.line_number = line_number
+        self.message = message
+        self.kind = kind
+        self.field = field
+
+    @classmethod
+    def from_exception(cls, line_number: int, error: Exception) -> 'LineError':
+        return cls(line_number, str(error), getattr(error, 'kind', 'other'), getattr(error, 'field', None))
+
+    @classmethod
+    def from_record(cls, record: str) -> 'LineError':
+        line_number, kind, field, message = record.rstrip('\n').split(';', 3)
+        return cls(int(line_number), message, kind, field or None)
+
+    def to_record(self) -> str:
+        return f"{self.line_number};{self.kind};{self.field or ''};{self.message.replace(chr(10), ' ')}"
+
+    def __str__(self):
+        return f"Ошибка в строке {self.line_number}: {self.message}"
+
+class ErrorCollector:
+    """Ошибки разбора: в памяти первые limit (None - без ограничения), остальные только считаются по видам.
+
+    Если задан spill_path, все ошибки построчно пишутся в этот файл.
+    """
+
+    def __init__(self, limit: Optional[int] = ERROR_LIMIT, spill_path: str = None):
+        self.limit = limit
+        self.errors: List[LineError] = []
+        self.counts = {}
+        self.total = 0
+        self.spill_path = spill_path
+        self._spill = None if spill_path is None else open(spill_path, 'w', encoding='utf-8')
+
+    def add(self, error: LineError):
+        self.extend((error,))
+
+    def extend(self, errors: Iterable[LineError]):
+        errors = list(errors)
+        if not errors:
+            return
+        counts = self.counts
+        for error in errors:
+            counts[error.kind] = counts.get(error.kind, 0) + 1
+        self.total += len(errors)
+        if self.limit is None:
+            self.errors.extend(errors)
+        elif len(self.errors) < self.limit:
+            self.errors.extend(errors[:self.limit - len(self.errors)])
+        if self._spill is not None:
+            self._spill.write(''.join([error.to_record() + '\n' for error in errors]))
+
+    def merge(self, other: 'ErrorCollector'):
+        # у other сверх его предела остались только счётчики по видам
+        counts, total = dict(self.counts), self.total
+        self.extend(other.errors)
+        for kind, number in other.counts.items():
+            counts[kind] = counts.get(kind, 0) + number
+        self.counts, self.total = counts, total + other.total
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.errors)
+
+    def messages(self) -> List[str]:
+        return list(map(str, self.errors))
+
+    def summary(self) -> str:
+        text = f"Ошибок: {self.total}"
+        if self.dropped:
+            text += f" (показаны первые {len(self.errors)})"
+        kinds = [f"{ERROR_KINDS.get(kind, kind)}: {number}" for kind, number in sorted(self.counts.items()) if number]
+        return f"{text}; {', '.join(kinds)}" if kinds else text
+
+    def dump(self, file_path: str):
+        with _replace_atomically(file_path) as file:
+            file.writelines(f"#{kind};{number}\n" for kind, number in self.counts.items())
+            file.writelines(error.to_record() + '\n' for error in self.errors)
+
+    @classmethod
+    def load(cls, file_path: str, limit: Optional[int] = ERROR_LIMIT) -> 'ErrorCollector':
+        # файл из dump или сброшенный spill: без строк «#» виды считаются по самим записям
+        collector = cls(limit)
+        counts = {}
+        with open(file_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if not line.startswith('#'):
+                    collector.extend(map(LineError.from_record, chain((line,), islice(file, WRITE_BATCH))))
+                    continue
+                kind, _, number = line[1:].rstrip('\n').rpartition(';')
+                counts[kind] = int(number)
+        if counts:
+            collector.counts = counts
+            collector.total = sum(counts.values())
+        return collector
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.total
+
+    def __iter__(self) -> Iterator[LineError]:
+        return iter(self.errors)
+
+def iter_file(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        tail = ''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if tail:
+            yield tail
+
+def iter_file_blocks(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[List[str]]:
     with open(file_path, 'r', encoding='utf-8') as file:
-        return file.readlines()
+        tail = ''
+        while True:
+            with stage('read_file'):
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    break
+                lines = (tail + chunk).split('\n')
+                tail = lines.pop()
+            if lines:
+                record('read_file', len(lines))
+                yield lines
+        if tail:
+            yield [tail]
+
+def iter_meter_readings(lines: Iterable[str], start: int = 0,
+                        types: tuple = None) -> Iterator[Union[WaterMeterReading, ElectricityMeterReading, LineError]]:
+    # types - допустимые классы показаний, остальные зарегистрированные типы возвращаются как ошибки
+    get_type = READING_TYPES.get
+    for idx, line in enumerate(lines, start):
+        reading_class = get_type(line.partition(';')[0]) or _match_prefix(line)
+        if reading_class is None:
+            continue
+        try:
+            item = reading_class.parse(line)
+        except Exception as e:
+            item = LineError.from_exception(idx + 1, e)
+        else:
+            if types is not None and reading_class not in types:
+                item = _unsupported_error(idx + 1, reading_class)
+        yield item
+
+def stream_meter_readings(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Union[WaterMeterReading, ElectricityMeterReading, LineError]]:
+    return iter_meter_readings(iter_file(file_path, chunk_size))
 
-def write_file(file_path: str, water_readings: List[WaterMeterReading], electricity_readings: List[ElectricityMeterReading]):
-    with open(file_path, 'w', encoding='utf-8') as file:
-        for reading in water_readings:
-            file.write(str(reading) + '\n')
-        for reading in electricity_readings:
-            file.write(str(reading) + '\n')
+def _error_result(errors: ErrorCollector, collector: Optional[ErrorCollector]):
+    # без collector возвращается прежний список строк
+    return errors.messages() if collector is None else collector
 
-def parse_meter_readings(lines: List[str]):
+def parse_meter_readings(lines: Iterable[str], collector: ErrorCollector = None):
     water_readings = []
     electricity_readings = []
-    errors = []
-    for idx, line in enumerate(lines):
+    errors = ErrorCollector(None) if collector is None else collector
+    # построчный разбор замеряется целиком: таймер на каждую строку стоил бы дороже самого разбора
+    errors_before = len(errors)
+    with stage('parse_lines'):
+        for item in iter_meter_readings(lines, types=STORED_TYPES):
+            if isinstance(item, WaterMeterReading):
+                water_readings.append(item)
+            elif isinstance(item, ElectricityMeterReading):
+                electricity_readings.append(item)
+            else:
+                errors.add(item)
+    record('parse_lines', len(water_readings) + len(electricity_readings) + len(errors) - errors_before, len(errors) - errors_before)
+
+    return water_readings, electricity_readings, _error_result(errors, collector)
+
+class ReadingColumns:
+    reading_class = MeterReading
+    fields = ('value',)
+
+    def __init__(self):
+        self.categories: List[str] = []
+        self._category_codes = {}
+        self.resource_type = array('I')
+        # дни от 01.01.1970, тот же буфер читается как numpy datetime64[D]
+        self.date = array('q')
+        for name in self.fields:
+            setattr(self, name, array('d'))
+
+    @classmethod
+    def from_buffers(cls, categories: List[str], resource_type, date, *values) -> 'ReadingColumns':
+        columns = cls()
+        columns.categories = list(categories)
+        columns._category_codes = {category: code for code, category in enumerate(columns.categories)}
+        columns.resource_type = resource_type
+        columns.date = date
+        for name, column in zip(cls.fields, values):
+            setattr(columns, name, column)
+        return columns
+
+    def _columns(self) -> list:
+        return [self.resource_type, self.date] + [getattr(self, name) for name in self.fields]
+
+    def _own(self):
+        # столбцы поверх чужого буфера (memoryview) копируются перед первым изменением
+        if not isinstance(self.date, array):
+            self.resource_type = array('I', self.resource_type)
+            self.date = array('q', self.date)
+            for name in self.fields:
+                setattr(self, name, array('d', getattr(self, name)))
+
+    def _code(self, resource_type: str) -> int:
+        code = self._category_codes.get(resource_type)
+        if code is None:
+            code = self._category_codes[resource_type] = len(self.categories)
+            self.categories.append(resource_type)
+        return code
+
+    def append_fields(self, resource_type: str, date: datetime, *values: float):
+        if len(values) != len(self.fields):
+            raise ValueError("Неверное количество полей.")
+        self._own()
+        row = [self._code(resource_type), (date - EPOCH).days, *values]
+        for column, value in zip(self._columns(), row):
+            column.append(value)
+
+    def extend_fields(self, resource_types: List[str], days: List[int], *values: List[float]):
+        if len(values) != len(self.fields):
+            raise ValueError("Неверное количество полей.")
+        self._own()
+        for resource_type in set(resource_types).difference(self._category_codes):
+            self._code(resource_type)
+        self.resource_type.extend(map(self._category_codes.__getitem__, resource_types))
+        self.date.extend(days)
+        for name, column in zip(self.fields, values):
+            getattr(self, name).extend(column)
+
+    def extend_columns(self, other: 'ReadingColumns'):
+        if other.fields != self.fields:
+            raise ValueError("Несовместимые наборы столбцов.")
+        self._own()
+        codes = [self._code(resource_type) for resource_type in other.categories]
+        self.resource_type.extend(map(codes.__getitem__, other.resource_type))
+        self.date.extend(other.date)
+        for name in self.fields:
+            getattr(self, name).extend(getattr(other, name))
+
+    def append(self, reading: MeterReading):
+        self.append_fields(reading.resource_type, reading.date, *(getattr(reading, name) for name in self.fields))
+
+    def extend(self, readings: Iterable[MeterReading]):
+        for reading in readings:
+            self.append(reading)
+
+    def __len__(self):
+        return len(self.date)
+
+    def __getitem__(self, idx: int) -> MeterReading:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.reading_class(
+            self.categories[self.resource_type[idx]],
+            date_from_days(self.date[idx]),
+            *(getattr(self, name)[idx] for name in self.fields)
+        )
+
+    def __setitem__(self, idx: int, reading: MeterReading):
+        self._own()
+        row = [self._code(reading.resource_type), (reading.date - EPOCH).days]
+        row.extend(getattr(reading, name) for name in self.fields)
+        for column, value in zip(self._columns(), row):
+            column[idx] = value
+
+    def __delitem__(self, idx: int):
+        self._own()
+        for column in self._columns():
+            del column[idx]
+
+    def __iter__(self) -> Iterator[MeterReading]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def format_rows(self, start: int = 0, stop: int = None) -> List[str]:
+        rows = slice(start, stop)
+        days = self.date[rows]
+        date_texts = {day: format_date(date_from_days(day)) for day in set(days)}
+        columns = [map(self.categories.__getitem__, self.resource_type[rows]), map(date_texts.__getitem__, days)]
+        columns.extend(map(str, getattr(self, name)[rows]) for name in self.fields)
+        return list(map(';'.join, zip(*columns)))
+
+class WaterReadingColumns(ReadingColumns):
+    reading_class = WaterMeterReading
+    fields = WaterMeterReading.fields
+
+class ElectricityReadingColumns(ReadingColumns):
+    reading_class = ElectricityMeterReading
+    fields = ElectricityMeterReading.fields
+
+def _index_keys(readings) -> tuple:
+    if isinstance(readings, ReadingColumns):
+        return list(map(readings.categories.__getitem__, readings.resource_type)), list(readings.date)
+    if isinstance(readings, SqliteReadings):
+        return readings.index_keys()
+    return [reading.resource_type for reading in readings], [(reading.date - EPOCH).days for reading in readings]
+
+class ReadingIndex:
+    # для каждого типа ресурса: дни по возрастанию и позиции показаний в исходной коллекции
+    def __init__(self, readings: Iterable[MeterReading] = ()):
+        self._days = {}
+        self._positions = {}
+        # порции не по порядку дат: сливаются одной сортировкой при первом обращении, а не при каждой порции
+        self._pending = {}
+        self._size = 0
+        self.extend(readings)
+
+    def __len__(self):
+        return self._size
+
+    def resource_types(self) -> List[str]:
+        self._settle()
+        return list(self._days)
+
+    def runs(self) -> Iterator[tuple]:
+        self._settle()
+        for resource_type, days in self._days.items():
+            yield resource_type, days, self._positions[resource_type]
+
+    def extend(self, readings: Iterable[MeterReading]):
+        if not isinstance(readings, (list, ReadingColumns, SqliteReadings)):
+            readings = list(readings)
+        resource_types, days = _index_keys(readings)
+        start = self._size
+        kinds = set(resource_types)
+        for resource_type in kinds:
+            if len(kinds) == 1:
+                new_days, new_positions = days, list(range(start, start + len(days)))
+            else:
+                mask = list(map(resource_type.__eq__, resource_types))
+                new_days = list(compress(days, mask))
+                new_positions = list(compress(count(start), mask))
+            old_days = self._days.setdefault(resource_type, [])
+            old_positions = self._positions.setdefault(resource_type, [])
+            if (resource_type not in self._pending and all(map(le, new_days, islice(new_days, 1, None)))
+                    and (not old_days or old_days[-1] <= new_days[0])):
+                old_days.extend(new_days)
+                old_positions.extend(new_positions)
+            else:
+                self._pending.setdefault(resource_type, []).append((new_days, new_positions))
+        self._size += len(days)
+
+    def _settle(self):
+        for resource_type, batches in self._pending.items():
+            days = self._days[resource_type]
+            positions = self._positions[resource_type]
+            for batch_days, batch_positions in batches:
+                days.extend(batch_days)
+                positions.extend(batch_positions)
+            # позиции порций больше прежних и возрастают, устойчивая сортировка по дню сохраняет их порядок внутри дня
+            order = sorted(range(len(days)), key=days.__getitem__)
+            self._days[resource_type] = list(map(days.__getitem__, order))
+            self._positions[resource_type] = list(map(positions.__getitem__, order))
+        self._pending.clear()
+
+    def _shift(self, start: int, delta: int):
+        self._settle()
+        for resource_type, positions in self._positions.items():
+            self._positions[resource_type] = [position + delta if position >= start else position for position in positions]
+
+    def _add(self, position: int, reading: MeterReading):
+        self._settle()
+        day = (reading.date - EPOCH).days
+        days = self._days.setdefault(reading.resource_type, [])
+        positions = self._positions.setdefault(reading.resource_type, [])
+        lo = bisect_left(days, day)
+        idx = bisect_left(positions, position, lo, bisect_right(days, day, lo))
+        days.insert(idx, day)
+        positions.insert(idx, position)
+
+    def _discard(self, position: int, reading: MeterReading):
+        self._settle()
+        day = (reading.date - EPOCH).days
+        days = self._days.get(reading.resource_type, [])
+        positions = self._positions.get(reading.resource_type, [])
+        lo = bisect_left(days, day)
+        hi = bisect_right(days, day, lo)
+        idx = bisect_left(positions, position, lo, hi)
+        if idx == hi or positions[idx] != position:
+            raise ValueError("Показание отсутствует в индексе.")
+        del days[idx]
+        del positions[idx]
+        if not days:
+            del self._days[reading.resource_type]
+            del self._positions[reading.resource_type]
+
+    def insert(self, position: int, reading: MeterReading):
+        if position < self._size:
+            self._shift(position, 1)
+        self._add(position, reading)
+        self._size += 1
+
+    def append(self, reading: MeterReading):
+        self.insert(self._size, reading)
+
+    def remove(self, position: int, reading: MeterReading):
+        self._discard(position, reading)
+        self._size -= 1
+        self._shift(position + 1, -1)
+
+    def replace(self, position: int, old: MeterReading, new: MeterReading):
+        self._discard(position, old)
+        self._add(position, new)
+
+    def _types(self, resource_type: Optional[str]) -> List[str]:
+        self._settle()
+        if resource_type is None:
+            return list(self._days)
+        return [resource_type] if resource_type in self._days else []
+
+    def between(self, start: datetime, end: datetime, resource_type: str = None) -> List[int]:
+        first, last = (start - EPOCH).days, (end - EPOCH).days
+        runs = []
+        for name in self._types(resource_type):
+            days = self._days[name]
+            lo = bisect_left(days, first)
+            hi = bisect_right(days, last, lo)
+            runs.append(zip(days[lo:hi], self._positions[name][lo:hi]))
+        if len(runs) == 1:
+            return [position for _, position in runs[0]]
+        return [position for _, position in merge(*runs)]
+
+    def on(self, date: datetime, resource_type: str = None) -> List[int]:
+        return self.between(date, date, resource_type)
+
+    def latest_before(self, date: datetime, resource_type: str = None) -> Optional[int]:
+        # последнее показание с датой не позже указанной
+        day = (date - EPOCH).days
+        candidates = []
+        for name in self._types(resource_type):
+            idx = bisect_right(self._days[name], day) - 1
+            if idx >= 0:
+                candidates.append((self._days[name][idx], self._positions[name][idx]))
+        return max(candidates)[1] if candidates else None
+
+def iter_column_chunks(blocks: Iterable[List[str]]) -> Iterator[tuple]:
+    # sources: номера строк файла (с нуля) для показаний воды и электричества
+    start = 0
+    for block in blocks:
+        parsed, errors = _parse_stored_block(block, start)
+        water, electricity = parsed[WaterMeterReading], parsed[ElectricityMeterReading]
+        water_columns = WaterReadingColumns()
+        water_columns.extend_fields(water[0], water[2], *water[3])
+        electricity_columns = ElectricityReadingColumns()
+        electricity_columns.extend_fields(electricity[0], electricity[2], *electricity[3])
+        start += len(block)
+        yield water_columns, electricity_columns, errors, start, (array('q', water[4]), array('q', electricity[4]))
+
+def _parse_columns_blocks(blocks: Iterable[List[str]], errors: ErrorCollector):
+    water_columns = WaterReadingColumns()
+    electricity_columns = ElectricityReadingColumns()
+    for water, electricity, block_errors, _, _ in iter_column_chunks(blocks):
+        water_columns.extend_columns(water)
+        electricity_columns.extend_columns(electricity)
+        errors.extend(block_errors)
+
+    return water_columns, electricity_columns, errors
+
+def parse_meter_columns(lines: Iterable[str], collector: ErrorCollector = None):
+    errors = ErrorCollector(None) if collector is None else collector
+    water_columns, electricity_columns, _ = _parse_columns_blocks(iter_blocks(lines), errors)
+    return water_columns, electricity_columns, _error_result(errors, collector)
+
+def read_meter_columns(file_path: str, chunk_size: int = CHUNK_SIZE, collector: ErrorCollector = None):
+    errors = ErrorCollector(None) if collector is None else collector
+    water_columns, electricity_columns, _ = _parse_columns_blocks(iter_file_blocks(file_path, chunk_size), errors)
+    return water_columns, electricity_columns, _error_result(errors, collector)
+
+BINARY_SUFFIX = '.mtrb'
+BINARY_MAGIC = b'MTRB'
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<4sHH')
+_BLOCK_HEADER = struct.Struct('<BxHIq')
+_LENGTH = struct.Struct('<I')
+_BINARY_KINDS = {1: WaterReadingColumns, 2: ElectricityReadingColumns}
+
+def is_binary_path(file_path: str) -> bool:
+    return file_path.lower().endswith(BINARY_SUFFIX)
+
+def _align(pos: int) -> int:
+    return (pos + 7) & ~7
+
+def _as_columns(readings: Iterable[MeterReading], columns_class) -> ReadingColumns:
+    if isinstance(readings, columns_class):
+        return readings
+    if isinstance(readings, SqliteReadings):
+        return readings.columns()
+    columns = columns_class()
+    columns.extend(readings)
+    return columns
+
+def _pad(file):
+    position = file.tell()
+    file.write(bytes(_align(position) - position))
+
+def _write_binary_blocks(file, water_columns: ReadingColumns, electricity_columns: ReadingColumns,
+                         progress: Callable[[int], None] = None) -> int:
+    # file - что угодно с write и tell: файл на диске или буфер общей памяти
+    blocks = [(1, water_columns), (2, electricity_columns)]
+    file.write(_BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(blocks)))
+    written = 0
+    for kind, columns in blocks:
+        file.write(_BLOCK_HEADER.pack(kind, len(columns.fields), len(columns.categories), len(columns)))
+        for category in columns.categories:
+            data = category.encode('utf-8')
+            file.write(_LENGTH.pack(len(data)) + data)
+        _pad(file)
+        for column in columns._columns():
+            if sys.byteorder == 'big':
+                column = array(column.typecode if isinstance(column, array) else column.format, column)
+                column.byteswap()
+            file.write(memoryview(column).cast('B'))
+            _pad(file)
+        written += len(columns)
+        if progress is not None:
+            progress(written)
+    return written
+
+def write_binary(file_path: str, water_readings: Iterable[WaterMeterReading], electricity_readings: Iterable[ElectricityMeterReading],
+                 progress: Callable[[int], None] = None):
+    water_columns = _as_columns(water_readings, WaterReadingColumns)
+    electricity_columns = _as_columns(electricity_readings, ElectricityReadingColumns)
+    with stage('write_binary'), _replace_atomically(file_path, 'wb') as file:
+        written = _write_binary_blocks(file, water_columns, electricity_columns, progress)
+    record('write_binary', written)
+
+def _read_blocks(buffer, copy: bool):
+    view = memoryview(buffer)
+    if len(view) < _BINARY_HEADER.size:
+        raise ValueError("Файл повреждён: нет заголовка.")
+    magic, version, count = _BINARY_HEADER.unpack_from(view, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Файл не является бинарным файлом показаний.")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Неподдерживаемая версия формата: {version}.")
+    copy = copy or sys.byteorder == 'big'
+    blocks = {}
+    pos = _BINARY_HEADER.size
+    try:
+        for _ in range(count):
+            kind, field_count, category_count, rows = _BLOCK_HEADER.unpack_from(view, pos)
+            pos += _BLOCK_HEADER.size
+            columns_class = _BINARY_KINDS.get(kind)
+            if columns_class is None or field_count != len(columns_class.fields):
+                raise ValueError(f"Неизвестный тип блока: {kind}.")
+            categories = []
+            for _ in range(category_count):
+                (length,) = _LENGTH.unpack_from(view, pos)
+                categories.append(str(view[pos + _LENGTH.size:pos + _LENGTH.size + length], 'utf-8'))
+                pos += _LENGTH.size + length
+            pos = _align(pos)
+            buffers = []
+            for typecode in ['I', 'q'] + ['d'] * field_count:
+                size = rows * array(typecode).itemsize
+                data = view[pos:pos + size]
+                if len(data) != size:
+                    raise ValueError("Файл повреждён: столбец обрезан.")
+                if copy:
+                    column = array(typecode)
+                    column.frombytes(data)
+                    if sys.byteorder == 'big':
+                        column.byteswap()
+                else:
+                    column = data.cast(typecode)
+                buffers.append(column)
+                pos = _align(pos + size)
+            blocks[kind] = columns_class.from_buffers(categories, *buffers)
+    except struct.error:
+        raise ValueError("Файл повреждён: заголовок блока обрезан.")
+    return blocks.get(1, WaterReadingColumns()), blocks.get(2, ElectricityReadingColumns())
+
+def _map_file(file_path: str) -> mmap.mmap:
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError("Файл повреждён: нет заголовка.")
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_binary(file_path: str):
+    with stage('read_binary'), open(file_path, 'rb') as file:
+        water, electricity = _read_blocks(file.read(), copy=True)
+    record('read_binary', len(water) + len(electricity))
+    return water, electricity
+
+def open_binary(file_path: str):
+    # столбцы ссылаются прямо на отображённый файл, без копирования
+    return _read_blocks(_map_file(file_path), copy=False)
+
+def csv_to_binary(csv_path: str, binary_path: str) -> List[str]:
+    water_columns, electricity_columns, errors = read_meter_columns(csv_path)
+    write_binary(binary_path, water_columns, electricity_columns)
+    return errors
+
+def binary_to_csv(binary_path: str, csv_path: str):
+    write_file(csv_path, *read_binary(binary_path))
+
+SQLITE_SUFFIXES = ('.sqlite', '.sqlite3', '.db')
+SQLITE_VERSION = 1
+SQLITE_PAGE = 4096
+# таблица на каждый тип показаний, как блоки бинарного формата
+_SQLITE_TABLES = {'water': WaterReadingColumns, 'electricity': ElectricityReadingColumns}
+
+def is_sqlite_path(file_path: str) -> bool:
+    return file_path.lower().endswith(SQLITE_SUFFIXES)
+
+def _sqlite_table(reading_class) -> str:
+    for table, columns_class in _SQLITE_TABLES.items():
+        if issubclass(reading_class, columns_class.reading_class):
+            return table
+    raise ValueError(f"Показания {reading_class.title} не хранятся в базе.")
+
+def _real_column(values: tuple):
+    # NaN SQLite хранит как NULL
+    if None not in values:
+        return values
+    return [float('nan') if value is None else value for value in values]
+
+def _column_rows(columns: ReadingColumns) -> Iterator[tuple]:
+    return zip(map(columns.categories.__getitem__, columns.resource_type), columns.date,
+               *(getattr(columns, name) for name in columns.fields))
+
+class SqliteReadings:
+    """Показания одной таблицы SqliteStore с интерфейсом последовательности, как у ReadingColumns.
+
+    В памяти держатся только идентификаторы строк по порядку, показания читаются страницами по page_size.
+    Изменения выполняются в текущей транзакции хранилища и видны сразу, на диск попадают после commit.
+    """
+
+    def __init__(self, store: 'SqliteStore', table: str, page_size: int = SQLITE_PAGE):
+        self.store = store
+        self.table = table
+        self.columns_class = _SQLITE_TABLES[table]
+        self.reading_class = self.columns_class.reading_class
+        self.fields = self.columns_class.fields
+        self.page_size = page_size
+        names = ('resource_type', 'date') + self.fields
+        self._select = f"SELECT {', '.join(names)} FROM {table}"
+        self._insert_sql = f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})"
+        self._update_sql = f"UPDATE {table} SET {', '.join(name + ' = ?' for name in names)} WHERE id = ?"
+        self.ids = array('q', chain.from_iterable(self._execute(f"SELECT id FROM {table} ORDER BY id")))
+        self._page = None
+        self._page_start = -1
+
+    def _execute(self, sql: str, parameters: tuple = ()):
+        return self.store.connection.execute(sql, parameters)
+
+    def _values(self, reading: MeterReading) -> tuple:
+        return (reading.resource_type, (reading.date - EPOCH).days, *(getattr(reading, name) for name in self.fields))
+
+    def _position(self, idx: int) -> int:
+        return range(len(self.ids))[idx]
+
+    def _invalidate(self):
+        self._page = None
+        self._page_start = -1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def columns(self, start: int = 0, stop: int = None) -> ReadingColumns:
+        # идентификаторы возрастают вместе с позицией, поэтому диапазон позиций - это диапазон первичного ключа
+        stop = len(self.ids) if stop is None else min(stop, len(self.ids))
+        columns = self.columns_class()
+        if start >= stop:
+            return columns
+        if start == 0 and stop == len(self.ids):
+            rows = self._execute(f"{self._select} ORDER BY id").fetchall()
+        else:
+            rows = self._execute(f"{self._select} WHERE id BETWEEN ? AND ? ORDER BY id",
+                                 (self.ids[start], self.ids[stop - 1])).fetchall()
+        values = list(zip(*rows))
+        columns.extend_fields(values[0], values[1], *map(_real_column, values[2:]))
+        return columns
+
+    def pages(self, page_size: int = None) -> Iterator[ReadingColumns]:
+        page_size = page_size or self.page_size
+        for start in range(0, len(self.ids), page_size):
+            yield self.columns(start, start + page_size)
+
+    def column(self, field: str) -> array:
+        if field not in self.fields:
+            raise ValueError(f"Нет столбца {field}.")
+        values = tuple(chain.from_iterable(self._execute(f"SELECT {field} FROM {self.table} ORDER BY id")))
+        return array('d', _real_column(values))
+
+    def index_keys(self) -> tuple:
+        rows = self._execute(f"SELECT resource_type, date FROM {self.table} ORDER BY id").fetchall()
+        return list(map(itemgetter(0), rows)), list(map(itemgetter(1), rows))
+
+    def __getitem__(self, idx: int) -> MeterReading:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        idx = self._position(idx)
+        start = idx - idx % self.page_size
+        if start != self._page_start:
+            self._page = self.columns(start, start + self.page_size)
+            self._page_start = start
+            count_event('sqlite_page')
+        return self._page[idx - start]
+
+    def __iter__(self) -> Iterator[MeterReading]:
+        for columns in self.pages():
+            yield from columns
+
+    def __setitem__(self, idx: int, reading: MeterReading):
+        self._execute(self._update_sql, (*self._values(reading), self.ids[self._position(idx)]))
+        self._invalidate()
+
+    def __delitem__(self, idx: int):
+        idx = self._position(idx)
+        self._execute(f"DELETE FROM {self.table} WHERE id = ?", (self.ids[idx],))
+        del self.ids[idx]
+        self._invalidate()
+
+    def append(self, reading: MeterReading):
+        self.ids.append(self._execute(self._insert_sql, self._values(reading)).lastrowid)
+        self._invalidate()
+
+    def _insert(self, rows: Iterable[tuple]):
+        # новые строки получают ключи больше последнего, порядок позиций сохраняется
+        last = self.ids[-1] if self.ids else 0
+        self.store.connection.executemany(self._insert_sql, rows)
+        self.ids.extend(chain.from_iterable(self._execute(f"SELECT id FROM {self.table} WHERE id > ? ORDER BY id", (last,))))
+        self._invalidate()
+
+    def extend(self, readings: Iterable[MeterReading]):
+        self._insert(map(self._values, readings))
+
+    def extend_columns(self, columns: ReadingColumns):
+        if columns.fields != self.fields:
+            raise ValueError("Несовместимые наборы столбцов.")
+        self._insert(_column_rows(columns))
+
+class SqliteStore:
+    """Показания в базе SQLite: таблица на тип показаний с индексом (тип ресурса, дата).
+
+    Правки копятся в открытой транзакции до commit, так же как несохранённые изменения в окне.
+    """
+
+    def __init__(self, file_path: str, create: bool = True):
+        # sqlite3 нужен только хранилищу и не замедляет запуск CLI
+        import sqlite3
+        if not create:
+            os.stat(file_path)
+        self.file_path = file_path
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._readings = {}
         try:
-            if line.startswith('Вода'):
-                water_readings.append(parse_water_reading(line))
-            elif line.startswith('Электричество'):
-                electricity_readings.append(parse_electricity_reading(line))
-        except Exception as e:
-            errors.append(f"Ошибка в строке {idx + 1}: {e}")
+            self._create_schema()
+        except sqlite3.DatabaseError as e:
+            self.connection.close()
+            raise ValueError(f"Файл не является базой показаний: {e}") from None
+        except ValueError:
+            self.connection.close()
+            raise
+
+    def _create_schema(self):
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version not in (0, SQLITE_VERSION):
+            raise ValueError(f"Неподдерживаемая версия базы: {version}.")
+        with self.connection:
+            for table, columns_class in _SQLITE_TABLES.items():
+                fields = ''.join(f", {name} REAL" for name in columns_class.fields)
+                self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                        f"(id INTEGER PRIMARY KEY, resource_type TEXT NOT NULL, date INTEGER NOT NULL{fields})")
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_type_date ON {table} (resource_type, date)")
+            self.connection.execute(f"PRAGMA user_version = {SQLITE_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def readings(self, reading_class) -> SqliteReadings:
+        # один объект на таблицу: его список идентификаторов должен видеть все изменения
+        table = _sqlite_table(reading_class)
+        readings = self._readings.get(table)
+        if readings is None:
+            readings = self._readings[table] = SqliteReadings(self, table)
+        return readings
+
+    def insert_columns(self, water_columns: ReadingColumns, electricity_columns: ReadingColumns):
+        self.readings(WaterMeterReading).extend_columns(water_columns)
+        self.readings(ElectricityMeterReading).extend_columns(electricity_columns)
+
+    def import_csv(self, file_path: str, collector: ErrorCollector = None, progress: Callable[[int], None] = None):
+        """Добавляет показания из CSV одной транзакцией, executemany на каждый блок разбора."""
+        errors = ErrorCollector(None) if collector is None else collector
+        imported = 0
+        try:
+            with stage('sqlite_import'), self.connection:
+                for water, electricity, block_errors, _, _ in iter_column_chunks(iter_file_blocks(file_path)):
+                    self.insert_columns(water, electricity)
+                    errors.extend(block_errors)
+                    imported += len(water) + len(electricity)
+                    if progress is not None:
+                        progress(imported)
+        except BaseException:
+            self._readings.clear()
+            raise
+        record('sqlite_import', imported)
+        self.analyze()
+        return _error_result(errors, collector)
+
+    def export_csv(self, file_path: str, progress: Callable[[int], None] = None):
+        write_file(file_path, self.readings(WaterMeterReading), self.readings(ElectricityMeterReading), progress)
+
+    def query(self, reading_class, start: datetime, end: datetime, resource_type: str = None) -> ReadingColumns:
+        # выборка по индексу (тип ресурса, дата), показания упорядочены по типу ресурса и дате
+        readings = self.readings(reading_class)
+        condition, parameters = "date BETWEEN ? AND ?", ((start - EPOCH).days, (end - EPOCH).days)
+        if resource_type is not None:
+            condition, parameters = "resource_type = ? AND " + condition, (resource_type, *parameters)
+        rows = self.connection.execute(f"{readings._select} WHERE {condition} ORDER BY resource_type, date, id",
+                                       parameters).fetchall()
+        columns = readings.columns_class()
+        if rows:
+            values = list(zip(*rows))
+            columns.extend_fields(values[0], values[1], *map(_real_column, values[2:]))
+        return columns
+
+    def analyze(self):
+        # статистика индекса нужна планировщику для выборок по дате без типа ресурса
+        with self.connection:
+            self.connection.execute("ANALYZE")
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+        self._readings.clear()
+
+    def close(self):
+        # незафиксированные изменения отбрасываются
+        self.connection.close()
+
+def _column_batches(readings: Iterable[MeterReading], columns_class) -> Iterator[ReadingColumns]:
+    if isinstance(readings, ReadingColumns):
+        yield readings
+    elif isinstance(readings, SqliteReadings):
+        yield from readings.pages()
+    else:
+        for batch in iter_blocks(readings, WRITE_BATCH):
+            columns = columns_class()
+            columns.extend(batch)
+            yield columns
+
+def write_sqlite(file_path: str, water_readings: Iterable[WaterMeterReading], electricity_readings: Iterable[ElectricityMeterReading],
+                 progress: Callable[[int], None] = None):
+    # база собирается во временном файле рядом и подменяет старую целиком, как при записи CSV
+    written = 0
+    with stage('write_sqlite'), _replace_atomically(file_path, 'wb') as file, SqliteStore(file.name) as store:
+        with store.connection:
+            for readings, reading_class in ((water_readings, WaterMeterReading), (electricity_readings, ElectricityMeterReading)):
+                target = store.readings(reading_class)
+                for columns in _column_batches(readings, target.columns_class):
+                    target.extend_columns(columns)
+                    written += len(columns)
+                    if progress is not None:
+                        progress(written)
+        store.analyze()
+    record('write_sqlite', written)
 
-    return water_readings, electricity_readings, errors
+def read_sqlite(file_path: str):
+    with stage('read_sqlite'), SqliteStore(file_path, create=False) as store:
+        water = store.readings(WaterMeterReading).columns()
+        electricity = store.readings(ElectricityMeterReading).columns()
+    record('read_sqlite', len(water) + len(electricity))
+    return water, electricity
@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import json
+import socket
+from operator import attrgetter
+from typing import Dict, List
+
+from instrument import enable_from_env, finish, record, stage
+from model import ErrorCollector, LineError, ReadingIndex, format_date, iter_meter_readings, parse_date
+
+SERVICE_CHUNK = 64 << 10
+RESPONSE_BATCH = 1000
+DEFAULT_PORT = 8765
+COMMANDS = ('SYNC', 'STATS', 'QUERY', 'LATEST', 'QUIT')
+
+class RunningTotal:
+    __slots__ = ('fields', 'readings', 'first', 'last', 'sums', 'latest')
+
+    def __init__(self, fields: tuple):
+        self.fields = fields
+        self.readings = 0
+        self.first = None
+        self.last = None
+        self.sums = [0.0] * len(fields)
+        self.latest = None
+
+    def extend(self, readings: list):
+        dates = list(map(attrgetter('date'), readings))
+        first, last = min(dates), max(dates)
+        self.readings += len(readings)
+        if self.first is None or first < self.first:
+            self.first = first
+        if self.last is None or last >= self.last:
+            self.last = last
+            # при равных датах последним считается показание, пришедшее позже
+            self.latest = readings[len(dates) - 1 - dates[::-1].index(last)]
+        self.sums = [total + sum(map(attrgetter(name), readings)) for total, name in zip(self.sums, self.fields)]
+
+    def as_dict(self) -> dict:
+        return {
+            'readings': self.readings,
+            'first': format_date(self.first),
+            'last': format_date(self.last),
+            'sums': dict(zip(self.fields, self.sums)),
+            'latest': str(self.latest),
+        }
+
+class Session:
+    def __init__(self):
+        self.lines = 0
+        self.readings = 0
+        self.errors = ErrorCollector()
+
+class MeterService:
+    def __init__(self):
+        self.readings: Dict[type, list] = {}
+        self.indexes: Dict[type, ReadingIndex] = {}
+        self.totals: Dict[str, RunningTotal] = {}
+        self.clients = 0
+
+    def add_lines(self, lines: List[str], session: Session):
+        with stage('service_ingest'):
+            self._add_lines(lines, session)
+        record('service_ingest', len(lines))
+
+    def _add_lines(self, lines: List[str], session: Session):
+        parsed = {}
+        for item in iter_meter_readings(lines, session.lines):
+            if isinstance(item, LineError):
+                session.errors.add(item)
+            else:
+                parsed.setdefault(type(item), []).append(item)
+        session.lines += len(lines)
+        for reading_class, items in parsed.items():
+            if reading_class not in self.readings:
+                self.readings[reading_class] = []
+                self.indexes[reading_class] = ReadingIndex()
+            self.indexes[reading_class].extend(items)
+            self.readings[reading_class].extend(items)
+            session.readings += len(items)
+            resource_types = set(map(attrgetter('resource_type'), items))
+            for resource_type in resource_types:
+                group = items if len(resource_types) == 1 else [item for item in items if item.resource_type == resource_type]
+                total = self.totals.get(resource_type)
+                if total is None:
+                    total = self.totals[resource_type] = RunningTotal(reading_class.fields)
+                total.extend(group)
+
+    def query(self, resource_type: str, start: str, end: str) -> List[str]:
+        start, end = parse_date(start), parse_date(end)
+        rows = []
+        for reading_class, index in self.indexes.items():
+            readings = self.readings[reading_class]
+            rows.extend(readings[position] for position in index.between(start, end, resource_type))
+        rows.sort(key=lambda reading: reading.date)
+        return [str(reading) for reading in rows]
+
+    def latest(self, resource_type: str, date: str):
+        date = parse_date(date)
+        found = None
+        for reading_class, index in self.indexes.items():
+            position = index.latest_before(date, resource_type)
+            if position is not None:
+                reading = self.readings[reading_class][position]
+                if found is None or reading.date >= found.date:
+                    found = reading
+        return None if found is None else str(found)
+
+    def stats(self) -> dict:
+        return {resource_type: total.as_dict() for resource_type, total in self.totals.items()}
+
+    async def _reply(self, writer: asyncio.StreamWriter, response: dict, rows: List[str] = ()):
+        writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+        # большие ответы отправляются частями, каждая ждёт освобождения буфера сокета
+        for start in range(0, len(rows), RESPONSE_BATCH):
+            writer.write(('\n'.join(rows[start:start + RESPONSE_BATCH]) + '\n').encode('utf-8'))
+            await writer.drain()
+        await writer.drain()
+
+    async def _command(self, line: str, session: Session, writer: asyncio.StreamWriter) -> bool:
+        name, _, arguments = line.partition(' ')
+        arguments = arguments.split(';') if arguments else []
+        try:
+            if name == 'QUIT':
+                await self._reply(writer, {'ok': True})
+                return False
+            if name == 'SYNC':
+                errors = session.errors
+                response = {'ok': True, 'lines': session.lines, 'readings': session.readings, 'errors': errors.messages(),
+                            'error_total': errors.total, 'error_counts': errors.counts}
+                session.errors = ErrorCollector()
+                await self._reply(writer, response)
+            elif name == 'STATS':
+                await self._reply(writer, {'ok': True, 'totals': self.stats()})
+            elif name == 'QUERY' and len(arguments) == 3:
+                rows = self.query(*arguments)
+                await self._reply(writer, {'ok': True, 'count': len(rows)}, rows)
+            elif name == 'LATEST' and len(arguments) == 2:
+                await self._reply(writer, {'ok': True, 'reading': self.latest(*arguments)})
+            else:
+                await self._reply(writer, {'ok': False, 'error': f"Неверная команда: {line}"})
+        except ValueError as e:
+            await self._reply(writer, {'ok': False, 'error': str(e)})
+        return True
+
+    async def _process(self, lines: List[str], session: Session, writer: asyncio.StreamWriter) -> bool:
+        batch = []
+        for line in lines:
+            if line[:1].isascii() and line.partition(' ')[0].rstrip('\r') in COMMANDS:
+                # команда видит все строки, отправленные до неё
+                self.add_lines(batch, session)
+                batch = []
+                if not await self._command(line.rstrip('\r'), session, writer):
+                    return False
+            else:
+                batch.append(line)
+        self.add_lines(batch, session)
+        return True
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        session = Session()
+        self.clients += 1
+        tail = b''
+        try:
+            while True:
+                chunk = await reader.read(SERVICE_CHUNK)
+                if not chunk:
+                    if tail:
+                        await self._process([tail.decode('utf-8', errors='replace')], session, writer)
+                    break
+                data = tail + chunk
+                end = data.rfind(b'\n') + 1
+                data, tail = data[:end], data[end:]
+                if data and not await self._process(data[:-1].decode('utf-8', errors='replace').split('\n'), session, writer):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+async def start_server(service: MeterService = None, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                       path: str = None) -> asyncio.AbstractServer:
+    service = service or MeterService()
+    if path is not None:
+        return await asyncio.start_unix_server(service.handle_client, path)
+    return await asyncio.start_server(service.handle_client, host, port)
+
+def submit_file(file_path: str, host: str = '127.0.0.1', port: int = DEFAULT_PORT, path: str = None) -> dict:
+    if path is not None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, open(file_path, 'rb') as file:
+        last = b'\n'
+        while True:
+            chunk = file.read(SERVICE_CHUNK)
+            if not chunk:
+                break
+            connection.sendall(chunk)
+            last = chunk[-1:]
+        if last != b'\n':
+            connection.sendall(b'\n')
+        connection.sendall(b'SYNC\nQUIT\n')
+        response = connection.makefile('r', encoding='utf-8').readline()
+    return json.loads(response)
+
+async def serve(host: str, port: int, path: str = None):
+    server = await start_server(None, host, port, path)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сервис разбора показаний счётчиков.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', help="путь к Unix-сокету вместо TCP")
+    args = parser.parse_args(argv)
+    enable_from_env()
+    try:
+        asyncio.run(serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finish()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import atexit
+import hashlib
+import os
+import struct
+import time
+
+from instrument import count, record, stage
+from model import ElectricityReadingColumns, ErrorCollector, WaterReadingColumns, _as_columns, _error_result
+from model import _read_blocks, _write_binary_blocks, read_meter_columns
+
+SHM_MAGIC = b'MTRS'
+SHM_VERSION = 1
+# сигнатура, версия, состояние, поколение, размер данных, pid издателя; данные - блоки бинарного формата .mtrb
+_HEADER = struct.Struct('<4sHHQQQ')
+HEADER_SIZE = _HEADER.size
+STATE_WRITING = 0
+STATE_READY = 1
+STATE_RETIRED = 2
+ATTACH_TIMEOUT = 5.0
+ATTACH_POLL = 0.01
+
+class PublicationNotReady(ValueError):
+    pass
+
+def segment_name(file_path: str) -> str:
+    # одно имя для всех процессов, открывающих файл; короткое, потому что на macOS имя ограничено 31 символом
+    digest = hashlib.sha1(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+    return f"mtr-{digest[:16]}"
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != 'posix':
+        # на Windows сегмент исчезает вместе с последним открытым дескриптором, проверять некого
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _untrack(segment):
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+
+def _attach_segment(name: str):
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # до Python 3.13 подключение регистрируется в resource_tracker, и при выходе читателя чужой сегмент был бы удалён
+        segment = shared_memory.SharedMemory(name)
+        if _HEADER.unpack_from(segment.buf, 0)[5] != os.getpid():
+            _untrack(segment)
+        return segment
+
+class _SizeCounter:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(memoryview(data).cast('B'))
+
+    def tell(self) -> int:
+        return self.size
+
+class _BufferWriter:
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.position = 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        self.buffer[self.position:self.position + len(data)] = data
+        self.position += len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+class SharedReadingsPublisher:
+    """Публикует разобранные показания в multiprocessing.shared_memory под постоянным именем.
+
+    Каждая публикация создаёт новый сегмент и увеличивает поколение, прежний помечается устаревшим и удаляется;
+    подключённые читатели дочитывают его и видят stale(). Сегмент удаляется при close, при выходе процесса
+    через atexit, а при аварийном завершении - resource_tracker из multiprocessing.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.generation = 0
+        self.readings = 0
+        self.segment = None
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _set_state(self, state: int):
+        struct.pack_into('<H', self.segment.buf, 6, state)
+
+    def _retire(self):
+        if self.segment is None:
+            return
+        self._set_state(STATE_RETIRED)
+        self.segment.close()
+        self.segment.unlink()
+        self.segment = None
+
+    def _create(self, size: int):
+        from multiprocessing import shared_memory
+        try:
+            return shared_memory.SharedMemory(self.name, create=True, size=size)
+        except FileExistsError:
+            pass
+        # сегмент мог остаться от процесса, который не успел его удалить; unlink снимает регистрацию подключения
+        previous = shared_memory.SharedMemory(self.name)
+        pid = _HEADER.unpack_from(previous.buf, 0)[5]
+        previous.close()
+        if _pid_alive(pid):
+            _untrack(previous)
+            raise ValueError(f"Сегмент {self.name} уже публикует процесс {pid}.")
+        previous.unlink()
+        count('shm_orphan_removed')
+        return shared_memory.SharedMemory(self.name, create=True, size=size)
+
+    def publish(self, water_readings, electricity_readings) -> int:
+        water = _as_columns(water_readings, WaterReadingColumns)
+        electricity = _as_columns(electricity_readings, ElectricityReadingColumns)
+        with stage('shm_publish'):
+            counter = _SizeCounter()
+            _write_binary_blocks(counter, water, electricity)
+            self._retire()
+            self.segment = self._create(HEADER_SIZE + counter.size)
+            self.generation += 1
+            _HEADER.pack_into(self.segment.buf, 0, SHM_MAGIC, SHM_VERSION, STATE_WRITING, self.generation,
+                              counter.size, os.getpid())
+            _write_binary_blocks(_BufferWriter(self.segment.buf[HEADER_SIZE:HEADER_SIZE + counter.size]), water, electricity)
+            self._set_state(STATE_READY)
+        self.readings = len(water) + len(electricity)
+        record('shm_publish', self.readings)
+        return self.generation
+
+    def publish_file(self, file_path: str, collector: ErrorCollector = None):
+        errors = ErrorCollector(None) if collector is None else collector
+        water, electricity, _ = read_meter_columns(file_path, collector=errors)
+        self.publish(water, electricity)
+        return _error_result(errors, collector)
+
+    def close(self):
+        self._retire()
+        atexit.unregister(self.close)
+
+class SharedReadings:
+    """Показания, опубликованные другим процессом: столбцы water и electricity смотрят прямо в общую память.
+
+    Показания (WaterMeterReading, ElectricityMeterReading) создаются только при обращении по индексу.
+    После close столбцы недоступны.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.segment = _attach_segment(name)
+        self._payload = None
+        self.water = self.electricity = None
+        try:
+            magic, version, state, self.generation, size, self.publisher_pid = _HEADER.unpack_from(self.segment.buf, 0)
+            if magic != SHM_MAGIC:
+                raise ValueError(f"Сегмент {name} не содержит показаний.")
+            if version != SHM_VERSION:
+                raise ValueError(f"Неподдерживаемая версия публикации: {version}.")
+            if state != STATE_READY:
+                raise PublicationNotReady(f"Публикация {name} не готова.")
+            self._payload = self.segment.buf[HEADER_SIZE:HEADER_SIZE + size]
+            self.water, self.electricity = _read_blocks(self._payload, copy=False)
+        except BaseException:
+            self.close()
+            raise
+        count('shm_attach')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.water) + len(self.electricity)
+
+    def stale(self) -> bool:
+        # издатель опубликовал новое поколение или завершился
+        if self.segment is None or struct.unpack_from('<H', self.segment.buf, 6)[0] != STATE_READY:
+            return True
+        return not _pid_alive(self.publisher_pid)
+
+    def close(self):
+        if self.segment is None:
+            return
+        # общую память нельзя закрыть, пока на неё ссылаются столбцы
+        for columns in (self.water, self.electricity):
+            if columns is not None:
+                for column in columns._columns():
+                    if isinstance(column, memoryview):
+                        column.release()
+        if self._payload is not None:
+            self._payload.release()
+        self.water = self.electricity = self._payload = None
+        self.segment.close()
+        self.segment = None
+
+def attach(name: str, timeout: float = ATTACH_TIMEOUT) -> SharedReadings:
+    """Подключается к публикации, дожидаясь её появления или окончания записи не дольше timeout секунд."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return SharedReadings(name)
+        except (FileNotFoundError, PublicationNotReady):
+            if time.monotonic() >= deadline:
+                raise
+        time.sleep(ATTACH_POLL)
+
+def read_shared(name: str, timeout: float = ATTACH_TIMEOUT) -> tuple:
+    # копия столбцов, не зависящая от жизни сегмента
+    with attach(name, timeout) as shared:
+        water, electricity = WaterReadingColumns(), ElectricityReadingColumns()
+        water.extend_columns(shared.water)
+        electricity.extend_columns(shared.electricity)
+    return water, electricity
@@ -1,6 +1,40 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+from array import array
+from unittest import mock
 from datetime import datetime
 from model import WaterMeterReading, ElectricityMeterReading, parse_water_reading, parse_electricity_reading, parse_meter_readings
+from model import ErrorCollector, LineError, iter_meter_readings, stream_meter_readings, read_file, write_file, write_readings
+from analytics import MinMaxPyramid, consumption, counter_anomalies, frequency_anomalies, rolling_average, series_pyramids, summarize
+from bench import compare, generate_meter_file
+from cache import ParseCache, read_meter_columns_cached
+from cli import main as cli_main
+from merge import merge_files
+import instrument
+from service import MeterService, start_server, submit_file
+from shm import SharedReadingsPublisher, attach
+from ingest import NO_SOURCE, IndexedMeterFile, MeterFileFollower, parse_file_parallel, read_columns_parallel, split_file
+from ingest import write_file_incremental
+from model import binary_to_csv, csv_to_binary, open_binary, read_binary, write_binary
+from model import SqliteStore, read_sqlite, write_sqlite
+from model import ElectricityReadingColumns, WaterReadingColumns, iter_column_chunks, iter_file_blocks, parse_meter_columns, parse_meter_block, read_meter_columns
+from model import PARSER_VERSION, READING_TYPES, MeterReading, ReadingIndex, parse_reading, reading_type, register_reading_type
+
+# окна проверяются без дисплея
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+try:
+    from PyQt5 import QtCore, QtWidgets
+except ImportError:
+    QtWidgets = None
+else:
+    from view import ChartDialog, MeterApp, ReadingTableModel, SummaryDialog
 
 class TestMeterReadingParsing(unittest.TestCase):
 
@@ -37,6 +71,18 @@ class TestMeterReadingParsing(unittest.TestCase):
         with self.assertRaises(ValueError):
             parse_electricity_reading(line)
 
+    def test_electricity_equality(self):
+        reading = ElectricityMeterReading("Электричество", datetime(2024, 4, 5), 321.0, 1.0, 654.0, 50.0)
+        self.assertEqual(reading, parse_electricity_reading("Электричество;05.04.2024;321;1;654;50"))
+        self.assertNotEqual(reading, ElectricityMeterReading("Электричество", datetime(2024, 4, 5), 321.0, 1.0, 654.0, 60.0))
+
+    def test_readings_are_compact(self):
+        first = parse_water_reading("Вода;01.04.2024;1;2;3")
+        second = parse_electricity_reading("Электричество;01.04.2024;1;2;3;50")
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertFalse(hasattr(second, "__dict__"))
+        self.assertIs(first.date, second.date)
+
     def test_water_str_format(self):
         reading = WaterMeterReading("Вода", datetime(2024, 4, 1), 123.0, 3.0, 456.0)
         self.assertEqual(str(reading), "Вода;01.04.2024;123.0;3.0;456.0")
@@ -73,6 +119,1168 @@ class TestMeterReadingParsing(unittest.TestCase):
         self.assertEqual(len(water_readings + electricity_readings), 1)
         self.assertIsInstance(water_readings[0], WaterMeterReading)
 
+class TestReadingTypeRegistry(unittest.TestCase):
+
+    def tearDown(self):
+        READING_TYPES.pop("Газ", None)
+
+    def test_dispatch_by_first_field_with_prefix_fallback(self):
+        self.assertIs(reading_type("Вода;01.04.2024;1;2;3"), WaterMeterReading)
+        self.assertIs(reading_type("Электричество;05.04.2024;1;2;3;50"), ElectricityMeterReading)
+        self.assertIs(reading_type("Вода холодная;01.04.2024;1;2;3"), WaterMeterReading)
+        self.assertIsNone(reading_type("Газ;01.04.2024;1;2"))
+        self.assertEqual(str(parse_reading("Вода холодная;01.04.2024;1;2;3")), "Вода холодная;01.04.2024;1.0;2.0;3.0")
+        with self.assertRaises(ValueError):
+            parse_reading("Тепло;01.04.2024;1")
+
+    def test_registered_type_is_parsed_and_formatted_from_schema(self):
+        @register_reading_type
+        class GasMeterReading(MeterReading):
+            __slots__ = ('total_volume',)
+            prefix = "Газ"
+            title = "газового счётчика"
+            fields = ('value', 'total_volume')
+            labels = ("Значение", "Общее потребление")
+
+            def __init__(self, resource_type, date, value, total_volume):
+                super().__init__(resource_type, date, value)
+                self.total_volume = total_volume
+
+        items = list(iter_meter_readings(["Газ;01.04.2024;1,5;20", "Газ;01.04.2024;1", "Вода;01.04.2024;1;2;3"]))
+        self.assertEqual(items[0], GasMeterReading("Газ", datetime(2024, 4, 1), 1.5, 20.0))
+        self.assertEqual(str(items[0]), "Газ;01.04.2024;1.5;20.0")
+        self.assertEqual(str(items[1]), "Ошибка в строке 2: Неверное количество полей для газового счётчика.")
+        self.assertIsInstance(items[2], WaterMeterReading)
+        self.assertNotEqual(items[0], parse_water_reading("Газ;01.04.2024;1.5;20;0"))
+
+    def test_registered_type_without_storage_is_reported_as_error(self):
+        @register_reading_type
+        class GasMeterReading(MeterReading):
+            __slots__ = ()
+            prefix = "Газ"
+            title = "газового счётчика"
+
+        lines = ["Вода;01.04.2024;1;2;3", "Газ;01.04.2024;1,5", "Газ;x", "Электричество;05.04.2024;1;2;3;50"]
+        expected = ["Ошибка в строке 2: Показания газового счётчика не загружаются: хранятся только вода и электричество.",
+                    "Ошибка в строке 3: Неверное количество полей для газового счётчика."]
+        water, electricity, errors = parse_meter_readings(lines)
+        self.assertEqual((len(water), len(electricity), errors), (1, 1, expected))
+        water, electricity, errors = parse_meter_columns(lines)
+        self.assertEqual((len(water), len(electricity), errors), (1, 1, expected))
+        self.assertEqual([error.kind for error in next(iter_column_chunks([lines]))[2]], ["type", "fields"])
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("\n".join(lines) + "\n")
+            water, electricity, errors = MeterFileFollower(path).poll()
+            self.assertEqual((len(water), len(electricity), errors), (1, 1, expected))
+        finally:
+            os.remove(path)
+
+    def test_base_reading_is_formatted_and_compared(self):
+        reading = MeterReading("Газ", datetime(2024, 4, 1), 1.5)
+        self.assertEqual(str(reading), "Газ;01.04.2024;1.5")
+        self.assertEqual(reading, MeterReading.parse("Газ;01.04.2024;1,5"))
+        self.assertNotEqual(reading, MeterReading("Газ", datetime(2024, 4, 1), 2.0))
+
+    def test_readings_compare_by_value_and_are_unhashable(self):
+        for reading in (MeterReading("Газ", datetime(2024, 4, 1), 1.5), parse_water_reading("Вода;01.04.2024;1;2;3"),
+                        parse_electricity_reading("Электричество;05.04.2024;1;2;3;50")):
+            with self.assertRaises(TypeError):
+                hash(reading)
+
+class TestStreamingReader(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            for i in range(50):
+                file.write(f"Вода;01.04.2024;{i}.5;3.21;456.78\n")
+                file.write("Электричество;05.04.2024;321.0;1.23;654.3;50\n")
+                file.write("Вода;плохая дата;1;2;3\n")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_iter_meter_readings_yields_errors_in_place(self):
+        lines = ["Вода;01.04.2024;1;2;3", "Вода;01.04.2024;1;2", "Что-то непонятное"]
+        items = list(iter_meter_readings(lines))
+        self.assertEqual(len(items), 2)
+        self.assertIsInstance(items[0], WaterMeterReading)
+        self.assertIsInstance(items[1], LineError)
+        self.assertEqual(items[1].line_number, 2)
+        self.assertTrue(str(items[1]).startswith("Ошибка в строке 2: "))
+
+    def test_stream_matches_list_parser_with_small_chunks(self):
+        expected = parse_meter_readings(read_file(self.path))
+        water, electricity, errors = [], [], []
+        for item in stream_meter_readings(self.path, chunk_size=7):
+            if isinstance(item, WaterMeterReading):
+                water.append(item)
+            elif isinstance(item, ElectricityMeterReading):
+                electricity.append(str(item))
+            else:
+                errors.append(str(item))
+        self.assertEqual(water, expected[0])
+        self.assertEqual(electricity, [str(r) for r in expected[1]])
+        self.assertEqual(errors, expected[2])
+
+class TestErrorCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [
+            "Вода;01.04.2024;1;2;3\n",
+            "Вода;01.04.2024;1;2\n",
+            "Вода;31.02.2024;1;2;3\n",
+            "Электричество;01.04.2024;1;2;3;abc\n",
+            "Вода;01.04.2024;1;x;3\n",
+        ]
+
+    def test_errors_carry_kind_and_field(self):
+        for parse in (parse_meter_readings, parse_meter_columns):
+            collector = ErrorCollector()
+            _, _, errors = parse(self.lines, collector=collector)
+            self.assertIs(errors, collector)
+            self.assertEqual([(e.line_number, e.kind, e.field) for e in errors],
+                             [(2, 'fields', None), (3, 'date', 'date'), (4, 'number', 'frequency'), (5, 'number', 'flow_rate')])
+            self.assertEqual(errors.messages(), parse_meter_readings(self.lines)[2])
+
+    def test_limit_keeps_counts_and_spills_everything(self):
+        fd, spill_path = tempfile.mkstemp(suffix=".errors")
+        os.close(fd)
+        try:
+            with ErrorCollector(1, spill_path) as collector:
+                parse_meter_readings(self.lines * 3, collector=collector)
+            self.assertEqual((len(collector), len(collector.errors), collector.dropped), (12, 1, 11))
+            self.assertEqual(collector.counts, {'fields': 3, 'date': 3, 'number': 6})
+            self.assertIn("некорректное число: 6", collector.summary())
+            spilled = ErrorCollector.load(spill_path, None)
+            self.assertEqual(spilled.counts, collector.counts)
+            self.assertEqual(spilled.messages()[-1], "Ошибка в строке 15: could not convert string to float: 'x'")
+            collector.dump(spill_path)
+            restored = ErrorCollector.load(spill_path)
+            self.assertEqual((restored.total, restored.counts, restored.messages()),
+                             (12, collector.counts, collector.messages()))
+        finally:
+            os.remove(spill_path)
+
+class TestReadingColumns(unittest.TestCase):
+
+    lines = [
+        "Вода;01.04.2024;123.45;3.21;456.78",
+        "Электричество;05.04.2024;321.0;1.23;654.3;50",
+        "Вода;не-дата;abc;3.21;456.78",
+        "Вода;02.04.2024;1,5;2;460",
+    ]
+
+    def test_columns_match_object_parser(self):
+        water, electricity, errors = parse_meter_columns(self.lines)
+        expected = parse_meter_readings(self.lines)
+        self.assertEqual(list(water), expected[0])
+        self.assertEqual([str(r) for r in electricity], [str(r) for r in expected[1]])
+        self.assertEqual(errors, expected[2])
+
+    def test_column_layout(self):
+        water, _, _ = parse_meter_columns(self.lines)
+        self.assertEqual(water.date.typecode, "q")
+        self.assertEqual(list(water.date), [19814, 19815])
+        self.assertEqual(list(water.value), [123.45, 1.5])
+        self.assertEqual(water.categories, ["Вода"])
+        self.assertEqual(list(water.resource_type), [0, 0])
+
+    def test_append_set_delete(self):
+        columns = WaterReadingColumns()
+        columns.append(WaterMeterReading("Вода", datetime(2024, 4, 1), 1.0, 2.0, 3.0))
+        columns.append(WaterMeterReading("Вода", datetime(2024, 4, 2), 4.0, 5.0, 6.0))
+        columns[0] = WaterMeterReading("Вода", datetime(2024, 4, 3), 7.0, 8.0, 9.0)
+        del columns[1]
+        self.assertEqual(len(columns), 1)
+        self.assertEqual(columns[0], WaterMeterReading("Вода", datetime(2024, 4, 3), 7.0, 8.0, 9.0))
+
+class TestReadingIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.readings = [
+            parse_water_reading("Вода;10.01.2025;1;1;1"),
+            parse_water_reading("Вода;01.01.2025;2;2;2"),
+            parse_water_reading("Водопровод;05.01.2025;3;3;3"),
+            parse_water_reading("Вода;10.01.2025;4;4;4"),
+            parse_water_reading("Вода;01.02.2025;5;5;5"),
+        ]
+        columns = WaterReadingColumns()
+        columns.extend(self.readings[:3])
+        self.index = ReadingIndex(columns)
+        self.index.extend(self.readings[3:])
+
+    def test_range_point_and_latest_lookups(self):
+        self.assertEqual(self.index.between(datetime(2025, 1, 1), datetime(2025, 1, 31), "Вода"), [1, 0, 3])
+        self.assertEqual(self.index.between(datetime(2025, 1, 1), datetime(2025, 1, 31)), [1, 2, 0, 3])
+        self.assertEqual(self.index.on(datetime(2025, 1, 10)), [0, 3])
+        self.assertEqual(self.index.on(datetime(2025, 1, 10), "Газ"), [])
+        self.assertEqual(self.index.latest_before(datetime(2025, 1, 20), "Вода"), 3)
+        self.assertEqual(self.index.latest_before(datetime(2025, 1, 7)), 2)
+        self.assertIsNone(self.index.latest_before(datetime(2024, 12, 31)))
+
+    def test_insert_remove_and_replace_keep_positions(self):
+        self.index.remove(1, self.readings[1])
+        self.assertEqual(self.index.between(datetime(2025, 1, 1), datetime(2025, 12, 31)), [1, 0, 2, 3])
+        self.index.insert(0, parse_water_reading("Вода;15.01.2025;6;6;6"))
+        self.assertEqual(self.index.between(datetime(2025, 1, 1), datetime(2025, 12, 31), "Вода"), [1, 3, 0, 4])
+        self.index.replace(4, self.readings[4], parse_water_reading("Вода;02.01.2025;5;5;5"))
+        self.assertEqual(self.index.latest_before(datetime(2025, 1, 3), "Вода"), 4)
+        self.assertEqual(len(self.index), 5)
+        with self.assertRaises(ValueError):
+            self.index.remove(0, self.readings[1])
+
+    def test_unordered_batches_match_single_build(self):
+        index = ReadingIndex()
+        for start in range(0, len(self.readings), 2):
+            index.extend(self.readings[start:start + 2])
+        single = ReadingIndex(self.readings)
+        self.assertEqual(sorted(index.runs()), sorted(single.runs()))
+        index.extend([parse_water_reading("Вода;01.01.2025;6;6;6")])
+        index.append(parse_water_reading("Вода;01.01.2025;7;7;7"))
+        self.assertEqual(index.on(datetime(2025, 1, 1)), [1, 5, 6])
+
+class TestAnalytics(unittest.TestCase):
+
+    def setUp(self):
+        self.water = WaterReadingColumns()
+        self.water.extend(parse_water_reading(line) for line in [
+            "Вода;01.01.2025;0;1;100",
+            "Вода;02.01.2025;0;3;105",
+            "Вода;01.01.2025;0;2;110",
+            "Вода;03.01.2025;0;4;5",
+            "Вода;01.02.2025;0;5;25",
+        ])
+
+    def test_consumption_handles_resets_and_negative_deltas(self):
+        self.assertEqual(consumption(self.water, "total_volume"), {"Вода": [
+            (datetime(2025, 1, 1), 10.0), (datetime(2025, 1, 2), 0.0),
+            (datetime(2025, 1, 3), 5.0), (datetime(2025, 2, 1), 20.0)]})
+        self.assertEqual(consumption(list(self.water), "total_volume", "month"),
+                         {"Вода": [(datetime(2025, 1, 1), 15.0), (datetime(2025, 2, 1), 20.0)]})
+        anomalies = counter_anomalies(self.water, "total_volume")
+        self.assertEqual([(a.position, a.kind) for a in anomalies], [(1, "negative"), (3, "reset")])
+
+    def test_rolling_average_frequency_and_summary(self):
+        averages = rolling_average(self.water, "flow_rate", window=2)
+        self.assertEqual([value for _, value in averages["Вода"]], [1.0, 1.5, 2.5, 3.5, 4.5])
+        electricity = [parse_electricity_reading("Электричество;01.01.2025;1;2;3;50"),
+                       parse_electricity_reading("Электричество;02.01.2025;1;2;4;49.5"),
+                       parse_electricity_reading("Электричество;03.01.2025;1;2;5;60")]
+        self.assertEqual(frequency_anomalies(electricity), [1])
+        summary = summarize(self.water, electricity)
+        self.assertEqual(summary["Вода"]["consumption"], 35.0)
+        self.assertEqual((summary["Вода"]["resets"], summary["Вода"]["negative"]), (1, 1))
+        self.assertEqual(summary["Электричество"]["bad_frequency"], 1)
+        self.assertEqual(summary["Электричество"]["consumption"], 2.0)
+
+    def test_min_max_pyramid_levels_and_incremental_update(self):
+        pyramid = series_pyramids(self.water, "flow_rate")["Вода"]
+        keys, mins, maxs = pyramid.levels[0]
+        self.assertEqual((list(mins), list(maxs)), ([1.0, 3.0, 4.0, 5.0], [2.0, 3.0, 4.0, 5.0]))
+        level, keys, mins, maxs = pyramid.buckets(keys[0], keys[-1], 2)
+        self.assertLessEqual(len(keys), 2)
+        self.assertEqual((min(mins), max(maxs)), (1.0, 5.0))
+        updated = MinMaxPyramid()
+        for day, values in ((20089, [1.0, 2.0]), (20090, [3.0]), (20091, [4.0]), (20120, [5.0]), (20200, [9.0])):
+            updated.set_day(day, values)
+        updated.set_day(20200, [])
+        self.assertEqual([tuple(map(list, level)) for level in updated.levels],
+                         [tuple(map(list, level)) for level in pyramid.levels])
+
+class TestBulkParser(unittest.TestCase):
+
+    lines = [
+        "Вода;01.04.2024;123.45;3.21;456.78\n",
+        "Вода;1.4.2024;1,5;2;3\n",
+        "Водопровод;02.04.2024;1;2;3\n",
+        "Вода;31.02.2024;1;2;3\n",
+        "Вода;01,04.2024;1;2;3\n",
+        "Вода;01.04.2024;1;2;3;\n",
+        "Электричество;05.04.2024;321.0;1.23;654.3;50\n",
+        "Электричество;05.04.2024;321.0;abc;654.3;50\n",
+        "Электричество;05.04.2024; 1 ;2;3;60\t\n",
+        "Газ;05.04.2024;1;2;3\n",
+        "\n",
+    ]
+
+    def assert_same(self, expected, actual):
+        self.assertEqual([str(r) for r in expected[0]], [str(r) for r in actual[0]])
+        self.assertEqual([str(r) for r in expected[1]], [str(r) for r in actual[1]])
+        self.assertEqual(expected[2], actual[2])
+
+    def test_bulk_matches_per_line_parser(self):
+        expected = parse_meter_readings(self.lines)
+        self.assertEqual(len(expected[2]), 4)
+        self.assert_same(expected, parse_meter_columns(self.lines))
+
+    def test_block_start_offsets_line_numbers(self):
+        _, _, errors = parse_meter_block(self.lines, start=100)
+        self.assertTrue(errors[0].startswith("Ошибка в строке 104: "))
+
+    def test_read_meter_columns_small_chunks(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.writelines(self.lines * 20)
+        try:
+            self.assert_same(parse_meter_readings(read_file(path)), read_meter_columns(path, chunk_size=17))
+        finally:
+            os.remove(path)
+
+class TestParallelIngestion(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            for i in range(40):
+                file.write(f"Вода;0{i % 9 + 1}.04.2024;{i},5;3.21;456.78\n")
+                file.write("Электричество;05.04.2024;321.0;1.23;654.3;50\n")
+                file.write(f"Электричество;{i}.13.2024;1;2;3;50\n")
+            file.write("Вода;01.04.2024;1;2;3")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_ranges_end_on_line_boundaries(self):
+        ranges = split_file(self.path, range_size=100)
+        self.assertGreater(len(ranges), 1)
+        with open(self.path, "rb") as file:
+            data = file.read()
+        self.assertEqual(ranges[-1][1], len(data))
+        for start, end in ranges[:-1]:
+            self.assertEqual(data[end - 1:end], b"\n")
+
+    def test_parallel_matches_serial(self):
+        expected = parse_meter_readings(read_file(self.path))
+        water, electricity, errors = parse_file_parallel(self.path, workers=2, range_size=100)
+        self.assertEqual(water, expected[0])
+        self.assertEqual([str(r) for r in electricity], [str(r) for r in expected[1]])
+        self.assertEqual(errors, expected[2])
+
+    def test_parallel_spill_keeps_every_error(self):
+        spill_path = self.path + ".errors"
+        try:
+            with ErrorCollector(0, spill_path) as collector:
+                read_columns_parallel(self.path, workers=2, range_size=100, collector=collector)
+            self.assertEqual((len(collector.errors), collector.total), (0, 40))
+            self.assertEqual(ErrorCollector.load(spill_path, None).messages(), parse_meter_readings(read_file(self.path))[2])
+        finally:
+            os.remove(spill_path)
+
+class TestWriteFile(unittest.TestCase):
+
+    lines = [
+        "Вода;01.04.2024;123.45;3.21;456.78",
+        "Электричество;05.04.2024;321;1.23;654.3;50",
+        "Вода;1.4.0999;1,5;2e3;-0",
+    ]
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def read_bytes(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def test_output_matches_str_format(self):
+        water, electricity, _ = parse_meter_readings(self.lines)
+        expected = "".join(str(r) + "\n" for r in water + electricity).encode("utf-8")
+        write_file(self.path, water, electricity)
+        self.assertEqual(self.read_bytes(), expected)
+        write_file(self.path, *parse_meter_columns(self.lines)[:2])
+        self.assertEqual(self.read_bytes(), expected)
+        write_readings(self.path, (r for r in water + electricity))
+        self.assertEqual(self.read_bytes(), expected)
+
+    def test_failed_write_keeps_original(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("старое содержимое\n")
+
+        def broken():
+            yield parse_water_reading(self.lines[0])
+            raise RuntimeError("сбой")
+
+        with self.assertRaises(RuntimeError):
+            write_file(self.path, broken(), [])
+        self.assertEqual(self.read_bytes(), "старое содержимое\n".encode("utf-8"))
+        self.assertEqual([name for name in os.listdir(os.path.dirname(self.path)) if name.endswith(".tmp")
+                          and os.path.basename(self.path) in name], [])
+
+    def load_with_sources(self):
+        water, electricity = WaterReadingColumns(), ElectricityReadingColumns()
+        sources = [], []
+        for chunk_water, chunk_electricity, _, line_count, chunk_sources in iter_column_chunks(iter_file_blocks(self.path)):
+            water.extend_columns(chunk_water)
+            electricity.extend_columns(chunk_electricity)
+            sources[0].extend(chunk_sources[0])
+            sources[1].extend(chunk_sources[1])
+        return water, electricity, (array("q", sources[0]), array("q", sources[1])), line_count
+
+    def test_incremental_write_copies_unchanged_lines(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("Вода;01.04.2024;1;2;3\nВода;x\nВода;02.04.2024;1,5;2;3\nЭлектричество;05.04.2024;1;2;3;50\n"
+                       "Вода;03.04.2024;4;5;6\nВода;04.04.2024;7;8;9")
+        water, electricity, sources, line_count = self.load_with_sources()
+        self.assertEqual((list(sources[0]), list(sources[1]), line_count), ([0, 2, 4, 5], [3], 6))
+        water[1] = parse_water_reading("Вода;02.04.2024;10;2;3")
+        sources[0][1] = NO_SOURCE
+        del water[2]
+        del sources[0][2]
+        electricity.append(parse_electricity_reading("Электричество;06.04.2024;2;2;2;60"))
+        sources[1].append(NO_SOURCE)
+        copied = write_file_incremental(self.path, water, electricity, sources, line_count)
+        self.assertEqual(copied, 3)
+        self.assertEqual(self.read_bytes().decode("utf-8"),
+                         "Вода;01.04.2024;1;2;3\nВода;02.04.2024;10.0;2.0;3.0\nВода;04.04.2024;7;8;9\n"
+                         "Электричество;05.04.2024;1;2;3;50\nЭлектричество;06.04.2024;2.0;2.0;2.0;60.0\n")
+
+    def test_incremental_write_falls_back_when_lines_differ(self):
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("Вода;01.04.2024;1;2;3\n")
+        water, electricity, sources, line_count = self.load_with_sources()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("Вода;02.04.2024;1;2;3\n")
+        self.assertEqual(write_file_incremental(self.path, water, electricity, sources, line_count), 0)
+        self.assertEqual(self.read_bytes(), "Вода;01.04.2024;1.0;2.0;3.0\n".encode("utf-8"))
+
+class TestIndexedMeterFile(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as file:
+            for i in range(30):
+                file.write(f"Вода;01.04.2024;{i};3.21;456.78\r\n")
+                file.write("Электричество;05.04.2024;321.0;abc;654.3;50\n")
+            file.write("Электричество;05.04.2024;1;2;3;50")
+
+    def tearDown(self):
+        for path in (self.path, self.path + ".idx"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_random_access_matches_sequential_parse(self):
+        lines = read_file(self.path)
+        with IndexedMeterFile(self.path) as indexed:
+            self.assertEqual(len(indexed), len(lines))
+            self.assertEqual(indexed.line(4), lines[4].rstrip("\n"))
+            self.assertEqual(indexed.lines(58, 100), [line.rstrip("\n") for line in lines[58:]])
+            self.assertEqual(indexed.reading(10), parse_water_reading(lines[10]))
+            items = indexed.readings(20, 2)
+            self.assertEqual(items[0], parse_water_reading(lines[20]))
+            self.assertEqual(str(items[1]), parse_meter_readings(lines)[2][10])
+
+    def test_sidecar_index_reused_and_invalidated(self):
+        IndexedMeterFile(self.path).close()
+        self.assertTrue(os.path.exists(self.path + ".idx"))
+        with open(self.path + ".idx", "r+b") as file:
+            file.seek(-8, os.SEEK_END)
+            file.write((1).to_bytes(8, "little"))
+        with IndexedMeterFile(self.path) as indexed:
+            self.assertEqual(indexed.offsets[-1], 1)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("\nВода;02.04.2024;1;2;3\n")
+        with IndexedMeterFile(self.path) as indexed:
+            self.assertEqual(len(indexed), 62)
+            self.assertEqual(str(indexed.reading(61)), "Вода;02.04.2024;1.0;2.0;3.0")
+
+class TestMeterFileFollower(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        self.append("Вода;01.04.2024;1;3.21;456.78\n")
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def append(self, text):
+        with open(self.path, "a", encoding="utf-8", newline="") as file:
+            file.write(text)
+
+    def test_only_complete_new_lines_are_parsed(self):
+        follower = MeterFileFollower(self.path, chunk_size=16)
+        water, electricity, errors = follower.poll()
+        self.assertEqual(water, [parse_water_reading("Вода;01.04.2024;1;3.21;456.78")])
+        self.assertEqual(follower.poll(), ([], [], []))
+
+        self.append("Электричество;05.04.2024;1;2;3;50\r\nВода;02.04.2024;x;1;2\nВода;03.04")
+        water, electricity, errors = follower.poll()
+        self.assertEqual(water, [])
+        self.assertEqual(electricity, [parse_electricity_reading("Электричество;05.04.2024;1;2;3;50")])
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith("Ошибка в строке 3:"))
+
+        self.append(".2024;2;3;4\n")
+        water, electricity, errors = follower.poll()
+        self.assertEqual(water, [parse_water_reading("Вода;03.04.2024;2;3;4")])
+        self.assertEqual(follower.line_count, 4)
+
+    def test_truncation_and_rewrite_request_reload(self):
+        follower = MeterFileFollower(self.path)
+        follower.poll()
+        with open(self.path, "r+b") as file:
+            file.seek(len("Вода;01.04.2024;".encode("utf-8")))
+            file.write(b"9")
+        self.assertIsNone(follower.poll())
+
+        follower.reset()
+        follower.poll()
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("")
+        self.assertIsNone(follower.poll())
+
+    def test_rotation_requests_reload(self):
+        follower = MeterFileFollower(self.path)
+        follower.poll()
+        fd, rotated = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            os.replace(self.path, rotated)
+            self.assertEqual(follower.poll(), ([], [], []))
+            self.append("Вода;01.04.2024;1;3.21;456.78\nВода;02.04.2024;1;3.21;456.78\n")
+            self.assertIsNone(follower.poll())
+        finally:
+            os.remove(rotated)
+
+class TestBinaryFormat(unittest.TestCase):
+
+    lines = [
+        "Вода;01.04.2024;123.45;3.21;456.78\n",
+        "Электричество;05.04.1960;321.0;1.23;654.3;50\n",
+        "Вода-2;02.04.2024;0.1;-2,5;1e300\n",
+    ]
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".mtrb")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_round_trip_is_lossless(self):
+        water, electricity, _ = parse_meter_readings(self.lines)
+        write_binary(self.path, water, electricity)
+        loaded_water, loaded_electricity = read_binary(self.path)
+        self.assertEqual(list(loaded_water), water)
+        self.assertEqual([str(r) for r in loaded_electricity], [str(r) for r in electricity])
+
+    def test_open_binary_is_zero_copy(self):
+        write_binary(self.path, *parse_meter_columns(self.lines)[:2])
+        water, _ = open_binary(self.path)
+        self.assertIsInstance(water.value, memoryview)
+        self.assertEqual(list(water.value), [123.45, 0.1])
+        water.append(parse_water_reading(self.lines[0]))
+        self.assertEqual(len(water), 3)
+
+    def test_csv_converters(self):
+        fd, csv_path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.writelines(self.lines + ["мусор\n", "Вода;x;1;2;3\n"])
+        try:
+            errors = csv_to_binary(csv_path, self.path)
+            self.assertEqual(errors, parse_meter_readings(read_file(csv_path))[2])
+            binary_to_csv(self.path, csv_path)
+            water, electricity, errors = parse_meter_readings(read_file(csv_path))
+            self.assertEqual((len(water), len(electricity), errors), (2, 1, []))
+        finally:
+            os.remove(csv_path)
+
+    def test_rejects_foreign_file(self):
+        with open(self.path, "wb") as file:
+            file.write(b"Voda;01.04.2024;1;2;3\n")
+        with self.assertRaises(ValueError):
+            read_binary(self.path)
+
+class TestSqliteStore(unittest.TestCase):
+
+    lines = TestBinaryFormat.lines + ["мусор\n", "Вода;03.04.2024;nan;1;2\n"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.directory.name, "meters.csv")
+        self.path = os.path.join(self.directory.name, "meters.db")
+        with open(self.csv_path, "w", encoding="utf-8") as file:
+            file.writelines(self.lines)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_export_round_trip(self):
+        with SqliteStore(self.path) as store:
+            errors = store.import_csv(self.csv_path)
+        self.assertEqual(errors, parse_meter_readings(self.lines)[2])
+        water, electricity = read_sqlite(self.path)
+        self.assertEqual(water.format_rows(), read_meter_columns(self.csv_path)[0].format_rows())
+        self.assertEqual([str(r) for r in electricity], ["Электричество;05.04.1960;321.0;1.23;654.3;50.0"])
+        with SqliteStore(self.path) as store:
+            store.export_csv(self.csv_path)
+        self.assertEqual(read_file(self.csv_path)[-1], "Электричество;05.04.1960;321.0;1.23;654.3;50.0\n")
+
+    def test_paged_edits_are_kept_until_commit(self):
+        write_sqlite(self.path, *read_meter_columns(self.csv_path)[:2])
+        added = WaterMeterReading("Вода", datetime(2024, 5, 1), 7.0, 8.0, 9.0)
+        with SqliteStore(self.path) as store:
+            water = store.readings(WaterMeterReading)
+            water.page_size = 2
+            water.append(added)
+            del water[0]
+            water[0] = added
+            self.assertEqual([str(r) for r in water][1:], ["Вода;03.04.2024;nan;1.0;2.0", "Вода;01.05.2024;7.0;8.0;9.0"])
+            self.assertEqual(water[-3], added)
+            self.assertEqual(ReadingIndex(water).on(datetime(2024, 5, 1)), [0, 2])
+            self.assertEqual(len(store.query(WaterMeterReading, datetime(2024, 4, 1), datetime(2024, 4, 30), "Вода")), 1)
+        self.assertEqual(len(read_sqlite(self.path)[0]), 3)
+        with SqliteStore(self.path) as store:
+            store.readings(WaterMeterReading).append(added)
+            store.commit()
+        self.assertEqual(read_sqlite(self.path)[0][-1], added)
+
+    def test_rejects_foreign_file(self):
+        with self.assertRaises(ValueError):
+            read_sqlite(self.csv_path)
+        with self.assertRaises(FileNotFoundError):
+            read_sqlite(self.path)
+
+    def test_cli_converts_to_and_from_database(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(cli_main(["convert", self.csv_path, self.path]), 0)
+            self.assertEqual(cli_main(["convert", self.path, self.csv_path]), 0)
+        self.assertEqual(len(read_file(self.csv_path)), 4)
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fd, self.path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write("Вода;01.04.2024;1;3.21;456.78\nЭлектричество;05.04.2024;1;2;3;50\nВода;x;1;2;3\n")
+        self.cache = ParseCache(self.directory)
+
+    def tearDown(self):
+        os.remove(self.path)
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_second_read_comes_from_cache(self):
+        expected = read_meter_columns(self.path)
+        first = read_meter_columns_cached(self.path, self.cache)
+        key = self.cache.key(self.path)
+        self.assertIsNotNone(self.cache.load(key))
+        with mock.patch("cache.read_meter_columns", side_effect=AssertionError("повторный разбор")):
+            second = read_meter_columns_cached(self.path, self.cache)
+        for result in (first, second):
+            self.assertEqual(list(result[0]), list(expected[0]))
+            self.assertEqual(list(result[1]), list(expected[1]))
+            self.assertEqual(result[2], expected[2])
+
+    def test_changed_content_or_parser_version_misses(self):
+        key = self.cache.key(self.path)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("Вода;02.04.2024;1;3.21;456.78\n")
+        new_key = self.cache.key(self.path)
+        self.assertNotEqual(new_key, key)
+        with mock.patch("cache.PARSER_VERSION", PARSER_VERSION + 1):
+            self.assertNotEqual(self.cache.key(self.path), new_key)
+
+    def test_error_limit_of_first_reader_does_not_truncate_cache(self):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(f"Вода;{i}.13.2024;1;2;3\n" for i in range(10))
+        water, electricity, errors = read_meter_columns_cached(self.path, self.cache, ErrorCollector(5))
+        self.assertEqual((len(errors.errors), errors.total), (5, 11))
+        errors = read_meter_columns_cached(self.path, self.cache)[2]
+        self.assertEqual(errors, read_meter_columns(self.path)[2])
+        partial = ErrorCollector(0)
+        partial.add(LineError(1, "ошибка"))
+        with self.assertRaises(ValueError):
+            self.cache.store("partial", [], [], partial)
+
+    def test_corrupt_entry_falls_back_to_parse(self):
+        read_meter_columns_cached(self.path, self.cache)
+        key = self.cache.key(self.path)
+        with open(os.path.join(self.directory, key + ".mtrb"), "r+b") as file:
+            file.write(b"XXXX")
+        self.assertIsNone(self.cache.load(key))
+        self.assertEqual(os.listdir(self.directory), [])
+        water, electricity, errors = read_meter_columns_cached(self.path, self.cache)
+        self.assertEqual((len(water), len(electricity), len(errors)), (1, 1, 1))
+
+    def test_source_lines_round_trip(self):
+        self.assertIsNone(self.cache.load_sources("entry"))
+        sources = array("q", [0, 2]), array("q", [1])
+        self.cache.store("entry", [], [], ErrorCollector(), (4, sources))
+        self.assertEqual(self.cache.load_sources("entry"), (4, sources))
+        self.cache.discard("entry")
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_eviction_drops_least_recently_used(self):
+        errors = ErrorCollector()
+        self.cache.store("old", [], [], errors)
+        errors.add(LineError(1, "ошибка"))
+        self.cache.store("new", [], [], errors)
+        os.utime(os.path.join(self.directory, "old.mtrb"), ns=(1, 1))
+        self.cache.limit = sum(os.path.getsize(os.path.join(self.directory, "new" + suffix)) for suffix in (".mtrb", ".errors"))
+        self.cache.evict()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["new.errors", "new.mtrb"])
+
+class TestMergeFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.inputs = []
+        contents = [
+            "Электричество;02.04.2024;5;1;50;50\nВода;03.04.2024;3;1;30\nВода;01.04.2024;1;1;10\nВода;x\n",
+            "Вода;02.04.2024;2;1;20\nВода;01.04.2024;1.0;1;10\nВода;03.04.2024;4;1;40\nВода;01.01.1969;0;0;0\n",
+        ]
+        for number, text in enumerate(contents):
+            path = os.path.join(self.directory, f"{number}.csv")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(text)
+            self.inputs.append(path)
+        self.output = os.path.join(self.directory, "merged.csv")
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def merged(self, rule):
+        # маленькие прогоны и fanin 2 проверяют многопроходное слияние через временные файлы
+        stats = merge_files(self.inputs, self.output, rule, run_size=2, temp_dir=self.directory, fanin=2)
+        with open(self.output, encoding="utf-8") as file:
+            return stats, [line.split(";")[1] + ";" + line.split(";")[2] for line in file.read().splitlines()]
+
+    def test_sorted_deduplicated_with_conflict_rules(self):
+        stats, rows = self.merged("first")
+        # строки переносятся как есть, «1» и «1.0» считаются одним показанием
+        self.assertEqual(rows, ["01.01.1969;0", "01.04.2024;1", "02.04.2024;2", "03.04.2024;3", "02.04.2024;5"])
+        self.assertEqual((stats.readings, stats.duplicates, stats.conflicts, stats.written), (7, 1, 1, 5))
+        self.assertEqual(len(stats.errors[self.inputs[0]]), 1)
+        self.assertEqual(self.merged("last")[1][3], "03.04.2024;4")
+        self.assertEqual(self.merged("max")[1][3], "03.04.2024;4")
+        self.assertEqual(len(self.merged("keep")[1]), 6)
+        with self.assertRaises(ValueError):
+            self.merged("error")
+        self.assertEqual([name for name in os.listdir(self.directory) if not name.endswith(".csv")], [])
+
+class TestMeterService(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.service = MeterService()
+        self.server = await start_server(self.service, port=0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def request(self, writer, reader, command):
+        writer.write((command + "\n").encode("utf-8"))
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    async def test_concurrent_clients_share_totals_and_queries(self):
+        first = await asyncio.open_connection("127.0.0.1", self.port)
+        second = await asyncio.open_connection("127.0.0.1", self.port)
+        first[1].write("Вода;01.01.2025;1;2;100\nВода;x;1;2;3\n".encode("utf-8"))
+        second[1].write("Электричество;05.01.2025;1;2;3;50\r\nВода;03.01.2025;1;4;110\n".encode("utf-8"))
+        sync = await self.request(first[1], first[0], "SYNC")
+        self.assertEqual((sync["lines"], sync["readings"]), (2, 1))
+        self.assertEqual(sync["errors"], ["Ошибка в строке 2: time data 'x' does not match format '%d.%m.%Y'"])
+        self.assertEqual((await self.request(second[1], second[0], "SYNC"))["readings"], 2)
+
+        totals = (await self.request(first[1], first[0], "STATS"))["totals"]
+        self.assertEqual(totals["Вода"]["readings"], 2)
+        self.assertEqual(totals["Вода"]["sums"]["total_volume"], 210.0)
+        self.assertEqual(totals["Вода"]["latest"], "Вода;03.01.2025;1.0;4.0;110.0")
+
+        reader, writer = second
+        response = await self.request(writer, reader, "QUERY Вода;01.01.2025;31.01.2025")
+        rows = [(await reader.readline()).decode("utf-8").rstrip("\n") for _ in range(response["count"])]
+        self.assertEqual(rows, ["Вода;01.01.2025;1.0;2.0;100.0", "Вода;03.01.2025;1.0;4.0;110.0"])
+        latest = await self.request(writer, reader, "LATEST Вода;02.01.2025")
+        self.assertEqual(latest["reading"], "Вода;01.01.2025;1.0;2.0;100.0")
+        self.assertFalse((await self.request(writer, reader, "LATEST Вода"))["ok"])
+        for reader, writer in (first, second):
+            await self.request(writer, reader, "QUIT")
+            self.assertEqual(await reader.read(), b"")
+            writer.close()
+
+    async def test_submit_file_over_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        socket_path = os.path.join(directory, "meters.sock")
+        data_path = os.path.join(directory, "meters.csv")
+        generate_meter_file(data_path, 5000, error_rate=0.01, seed=2)
+        server = await start_server(self.service, path=socket_path)
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, submit_file, data_path, None, None, socket_path)
+            water, electricity, errors = parse_meter_readings(read_file(data_path))
+            self.assertEqual(result["lines"], 5000)
+            self.assertEqual(result["readings"], len(water) + len(electricity))
+            self.assertEqual(result["errors"], errors)
+        finally:
+            server.close()
+            await server.wait_closed()
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+class TestSharedMemory(unittest.TestCase):
+
+    lines = TestBinaryFormat.lines
+
+    def setUp(self):
+        self.name = f"mtr-test-{os.getpid()}"
+
+    def test_publish_attach_and_new_generation(self):
+        water, electricity, _ = parse_meter_columns(self.lines)
+        with SharedReadingsPublisher(self.name) as publisher:
+            self.assertEqual(publisher.publish(water, electricity), 1)
+            shared = attach(self.name)
+            self.assertIsInstance(shared.water.value, memoryview)
+            self.assertEqual(list(shared.water), list(water))
+            self.assertEqual(str(shared.electricity[0]), "Электричество;05.04.1960;321.0;1.23;654.3;50.0")
+            self.assertFalse(shared.stale())
+            publisher.publish(water, ElectricityReadingColumns())
+            self.assertTrue(shared.stale())
+            self.assertEqual(len(shared), 3)
+            shared.close()
+            with attach(self.name) as shared:
+                self.assertEqual((shared.generation, len(shared)), (2, 2))
+        with self.assertRaises(FileNotFoundError):
+            attach(self.name, timeout=0)
+
+    def test_cli_publisher_serves_other_processes_and_cleans_up(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "meters.csv")
+        with open(path, "w", encoding="utf-8") as file:
+            file.writelines(self.lines)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+        process = subprocess.Popen([sys.executable, script, "publish", path, "--name", self.name],
+                                   stdout=subprocess.PIPE, text=True, encoding="utf-8")
+        try:
+            self.assertIn("поколение 1, показаний 3, ошибок 0", process.stdout.readline())
+            with attach(self.name) as shared:
+                self.assertEqual(shared.publisher_pid, process.pid)
+                self.assertEqual(list(shared.water), parse_meter_readings(self.lines)[0])
+            process.terminate()
+            self.assertEqual(process.wait(10), 0)
+            with self.assertRaises(FileNotFoundError):
+                attach(self.name, timeout=0)
+        finally:
+            process.kill()
+            process.stdout.close()
+            os.remove(path)
+            os.rmdir(directory)
+
+class TestCommandLine(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "meters.csv")
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write("Вода;01.04.2024;1;3.21;456.78\nЭлектричество;05.04.2024;1;2;3;50\nВода;x\n")
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def run_cli(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = cli_main(list(argv))
+        return code, output.getvalue()
+
+    def test_validate_convert_and_summarize(self):
+        code, output = self.run_cli("validate", self.path)
+        self.assertEqual(code, 1)
+        self.assertIn("Ошибка в строке 3: Неверное количество полей для водяного счётчика.", output)
+        binary_path = os.path.join(self.directory, "meters.mtrb")
+        self.assertEqual(self.run_cli("convert", self.path, binary_path)[0], 0)
+        self.assertEqual(self.run_cli("convert", self.path, binary_path, "--strict")[0], 1)
+        self.assertEqual(self.run_cli("validate", binary_path), (0, f"{binary_path}: показаний 2, ошибок 0\n"))
+        code, output = self.run_cli("summarize", binary_path, "--period", "day")
+        self.assertEqual(code, 0)
+        self.assertIn("Электричество: показаний 1 (05.04.2024 - 05.04.2024)", output)
+
+    def test_cli_does_not_import_qt(self):
+        script = "import sys, cli; print(sorted(name for name in ('PyQt5', 'view') if name in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = ["Вода;01.04.2024;1;2;3\n", "Вода;x\n", "Электричество;01.04.2024;1;2;3;50\n"]
+        self.addCleanup(instrument.finish)
+
+    def test_disabled_stage_is_shared_null_context(self):
+        self.assertIs(instrument.stage("parse"), instrument.stage("write_file"))
+        parse_meter_columns(self.lines)
+        self.assertIsNone(instrument.finish())
+
+    def test_stages_rows_and_errors_are_reported(self):
+        instrument.enable()
+        parse_meter_columns(self.lines)
+        parse_meter_readings(self.lines)
+        report = instrument.finish()
+        self.assertEqual({name: (stats["rows"], stats["errors"]) for name, stats in report["stages"].items()},
+                         {"parse": (3, 1), "bad_rows": (1, 1), "parse_lines": (3, 1)})
+        text = instrument.prometheus_text(report)
+        self.assertIn('meter_stage_rows_total{stage="parse"} 3', text)
+        self.assertIn('meter_stage_errors_total{stage="parse_lines"} 1', text)
+
+    def test_cli_flag_writes_report(self):
+        fd, data_path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.writelines(self.lines)
+        report_path = data_path + ".json"
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(cli_main(["--profile", report_path, "validate", data_path]), 1)
+            with open(report_path, encoding="utf-8") as file:
+                report = json.load(file)
+            self.assertEqual(report["stages"]["parse"]["rows"], 3)
+            self.assertFalse(instrument.enabled())
+        finally:
+            os.remove(data_path)
+            if os.path.exists(report_path):
+                os.remove(report_path)
+
+class TestBenchmarkHarness(unittest.TestCase):
+
+    def test_generated_file_has_requested_size_and_errors(self):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            generate_meter_file(path, 2000, error_rate=0.1, seed=1, batch=300)
+            lines = read_file(path)
+            water, electricity, errors = parse_meter_readings(lines)
+            self.assertEqual(len(lines), 2000)
+            self.assertEqual(len(water) + len(electricity) + len(errors), 2000)
+            self.assertTrue(100 < len(errors) < 300)
+        finally:
+            os.remove(path)
+
+    def test_compare_reports_only_regressions_beyond_threshold(self):
+        baseline = {"stages": {"a": {"rows_per_sec": 1000.0}, "b": {"rows_per_sec": 1000.0}}}
+        results = {"stages": {"a": {"rows_per_sec": 850.0}, "b": {"rows_per_sec": 700.0}, "c": {"skipped": "нет"}}}
+        regressions = compare(results, baseline, 0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("b: "))
+
+
+@unittest.skipIf(QtWidgets is None, "PyQt5 не установлен")
+class GuiTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+class ReadingModelTestCase(GuiTestCase):
+    # таблица с уже загруженными показаниями и номерами исходных строк
+
+    lines = [
+        "Вода;01.04.2024;1;2;3",
+        "Электричество;05.04.2024;1;2;3;50",
+        "Вода;02.04.2024;4;5;6",
+        "Вода;x",
+        "Электричество;06.04.2024;4;5;6;60",
+    ]
+
+    def setUp(self):
+        water, electricity, _, _, sources = next(iter_column_chunks([self.lines]))
+        self.model = ReadingTableModel()
+        self.model.set_readings(water, electricity, sources)
+
+    def rows(self):
+        return [str(self.model.reading(row)) for row in range(self.model.rowCount())]
+
+    def sources(self):
+        return list(self.model.sources[0]), list(self.model.sources[1])
+
+
+class TestReadingTableModel(ReadingModelTestCase):
+
+    def test_rows_are_water_then_electricity_with_source_lines(self):
+        self.assertEqual(self.model.rowCount(), 4)
+        self.assertEqual(self.model.data(self.model.index(1, 2)), "4.0")
+        self.assertEqual(self.model.data(self.model.index(3, 0)), "Электричество")
+        self.assertEqual(self.model.data(self.model.index(0, 5)), "")
+        self.assertEqual(self.sources(), ([0, 2], [1, 4]))
+
+    def test_add_edit_delete_mark_changed_rows(self):
+        row = self.model.append(parse_water_reading("Вода;03.04.2024;7;8;9"))
+        self.assertEqual(row, 2)
+        self.assertEqual(self.sources(), ([0, 2, NO_SOURCE], [1, 4]))
+        self.assertTrue(self.model.setData(self.model.index(3, 2), "10,5"))
+        self.assertEqual(str(self.model.reading(3)), "Электричество;05.04.2024;10.5;2.0;3.0;50.0")
+        self.assertEqual(self.sources(), ([0, 2, NO_SOURCE], [NO_SOURCE, 4]))
+        self.assertFalse(self.model.setData(self.model.index(3, 1), "32.13.2024"))
+        self.model.remove_row(0)
+        self.assertEqual(self.sources(), ([2, NO_SOURCE], [NO_SOURCE, 4]))
+        self.assertEqual(self.rows(), ["Вода;02.04.2024;4.0;5.0;6.0", "Вода;03.04.2024;7.0;8.0;9.0",
+                                       "Электричество;05.04.2024;10.5;2.0;3.0;50.0",
+                                       "Электричество;06.04.2024;4.0;5.0;6.0;60.0"])
+        self.model.mark_saved()
+        self.assertEqual(self.sources(), ([0, 1], [2, 3]))
+
+
+class MeterAppTestCase(GuiTestCase):
+    # окно с CSV-файлом во временном каталоге, без кэша разбора
+
+    text = ("Вода;01.04.2024;1,5;2;3\n"
+            "Вода;x\n"
+            "Электричество;05.04.2024;1;2;3;50\n"
+            "Вода;02.04.2024;4;5;6\n")
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "data.csv")
+        with open(self.path, "w", encoding="utf-8") as file:
+            file.write(self.text)
+        self.window = MeterApp()
+        self.window.cache = None
+        self.window.file_path = self.path
+        # окно ошибок модальное
+        patcher = mock.patch.object(MeterApp, "show_errors")
+        self.show_errors = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.window.follow_timer.stop()
+        if self.window.store is not None:
+            self.window.store.close()
+        self.window.deleteLater()
+        self.directory.cleanup()
+
+    def wait(self):
+        while self.window.task is not None:
+            self.window.task.wait(10)
+            self.application.processEvents()
+
+    def read_text(self):
+        with open(self.path, encoding="utf-8") as file:
+            return file.read()
+
+
+class TestMeterApp(MeterAppTestCase):
+
+    def test_edit_save_reload_rewrites_only_changed_lines(self):
+        self.window.load_data()
+        self.wait()
+        self.assertEqual(self.window.model.rowCount(), 3)
+        self.assertEqual(len(self.show_errors.call_args[0][0]), 1)
+        model = self.window.model
+        self.assertTrue(model.setData(model.index(1, 2), "7"))
+        model.append(parse_electricity_reading("Электричество;06.04.2024;1;2;3;60"))
+        self.window.save_data()
+        self.wait()
+        self.assertEqual(self.read_text(), "Вода;01.04.2024;1,5;2;3\nВода;02.04.2024;7.0;5.0;6.0\n"
+                                           "Электричество;05.04.2024;1;2;3;50\n"
+                                           "Электричество;06.04.2024;1.0;2.0;3.0;60.0\n")
+        self.assertEqual(list(model.sources[0]) + list(model.sources[1]), [0, 1, 2, 3])
+        model.remove_row(0)
+        self.window.save_data()
+        self.wait()
+        self.assertEqual(self.read_text(), "Вода;02.04.2024;7.0;5.0;6.0\nЭлектричество;05.04.2024;1;2;3;50\n"
+                                           "Электричество;06.04.2024;1.0;2.0;3.0;60.0\n")
+        self.window.load_data()
+        self.wait()
+        self.assertEqual([str(model.reading(row)) for row in range(model.rowCount())],
+                         ["Вода;02.04.2024;7.0;5.0;6.0", "Электричество;05.04.2024;1.0;2.0;3.0;50.0",
+                          "Электричество;06.04.2024;1.0;2.0;3.0;60.0"])
+
+
+class TestFollowDuringLoad(MeterAppTestCase):
+
+    def test_follow_enabled_during_load_does_not_duplicate_rows(self):
+        self.window.load_data()
+        self.assertFalse(self.window.follow_check.isEnabled())
+        self.window.follow_check.setChecked(True)
+        self.wait()
+        self.assertEqual(self.window.model.rowCount(), 3)
+        self.assertTrue(self.window.follow_timer.isActive())
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write("Вода;03.04.2024;7;8;9\n")
+        self.window.poll_file()
+        self.assertEqual(self.window.model.rowCount(), 4)
+
+
+class TestDateFilterModel(ReadingModelTestCase):
+
+    def test_filter_maps_rows_to_readings_and_follows_changes(self):
+        self.model.set_date_filter(datetime(2024, 4, 2), datetime(2024, 4, 5))
+        self.assertEqual(self.rows(), ["Вода;02.04.2024;4.0;5.0;6.0", "Электричество;05.04.2024;1.0;2.0;3.0;50.0"])
+        # изменённая строка остаётся на месте до следующего пересчёта фильтра
+        self.assertTrue(self.model.setData(self.model.index(0, 1), "10.04.2024"))
+        self.assertEqual(self.rows()[0], "Вода;10.04.2024;4.0;5.0;6.0")
+        self.model.refilter()
+        self.assertEqual(self.rows(), ["Электричество;05.04.2024;1.0;2.0;3.0;50.0"])
+        self.assertEqual(self.model.append(parse_water_reading("Вода;04.04.2024;7;8;9")), 0)
+        self.assertEqual(self.model.append(parse_water_reading("Вода;20.04.2024;7;8;9")), -1)
+        self.model.remove_row(1)
+        self.assertEqual(self.rows(), ["Вода;04.04.2024;7.0;8.0;9.0"])
+        self.assertEqual(self.sources(), ([0, NO_SOURCE, NO_SOURCE, NO_SOURCE], [4]))
+        self.model.set_date_filter(datetime(2024, 4, 1), datetime(2024, 4, 30), "Электричество")
+        self.assertEqual(self.rows(), ["Электричество;06.04.2024;4.0;5.0;6.0;60.0"])
+        self.model.set_date_filter()
+        self.assertEqual(self.model.rowCount(), 5)
+
+
+class TestSummaryDialog(ReadingModelTestCase):
+
+    def test_summary_dialog_uses_model_indexes(self):
+        dialog = SummaryDialog(self.model)
+        self.assertIn("Вода: показаний 2", dialog.summary_label.text())
+        self.assertEqual(dialog.table.rowCount(), 2)
+
+
+class TestChartDialog(ReadingModelTestCase):
+
+    def test_chart_follows_model_changes(self):
+        dialog = ChartDialog(self.model)
+        self.assertTrue(dialog.stale)
+        dialog.show()
+        self.assertFalse(dialog.stale)
+        self.model.append(parse_water_reading("Вода;03.04.2024;7;8;9"))
+        self.model.setData(self.model.index(0, 2), "-1")
+        self.model.remove_row(1)
+        incremental = dialog.chart.pyramids["Вода"].buckets(0, 1 << 20, 100)
+        dialog.rebuild()
+        self.assertEqual(dialog.chart.pyramids["Вода"].buckets(0, 1 << 20, 100), incremental)
+        self.assertEqual(list(incremental[2]), [-1.0, 7.0])
+        dialog.close()
+
+
+class TestSqliteInMeterApp(MeterAppTestCase):
+
+    def test_database_is_opened_with_prebuilt_index_and_saved_in_place(self):
+        database = os.path.join(self.directory.name, "data.sqlite")
+        water, electricity, _ = read_meter_columns(self.path)
+        write_sqlite(database, water, electricity)
+        self.window.file_path = database
+        self.window.load_data()
+        self.wait()
+        model = self.window.model
+        self.assertEqual(model.water_index.on(datetime(2024, 4, 2), "Вода"), [1])
+        self.assertTrue(model.setData(model.index(0, 2), "8"))
+        self.window.save_data()
+        self.window.store.close()
+        self.window.store = None
+        self.assertEqual(str(read_sqlite(database)[0][0]), "Вода;01.04.2024;8.0;2.0;3.0")
+
 
 if __name__ == "__main__":
     unittest.main()
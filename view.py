@@ -1,6 +1,38 @@
-from PyQt5 import QtWidgets
+import os
+from array import array
+from itertools import repeat
+from math import ceil, floor
+from PyQt5 import QtCore, QtGui, QtWidgets
 from datetime import datetime
-from model import parse_meter_readings, parse_water_reading, parse_electricity_reading, write_file, read_file, WaterMeterReading, ElectricityMeterReading
+from model import iter_column_chunks, iter_file_blocks, write_file, WaterMeterReading, READING_TYPES, ERROR_KINDS, ErrorCollector
+from model import ElectricityReadingColumns, ReadingIndex, WaterReadingColumns, is_binary_path, read_binary, write_binary
+from model import ElectricityMeterReading, ReadingColumns, SqliteStore, date_from_days, format_date, is_sqlite_path, write_sqlite
+from model import _index_keys
+from ingest import NO_SOURCE, MeterFileFollower, write_file_incremental
+from analytics import MinMaxPyramid, series_pyramids, summarize
+from cache import ParseCache, file_unchanged
+from instrument import record, stage
+
+CHART_COLORS = ('#1f77b4', '#d62728', '#2ca02c', '#ff7f0e', '#9467bd', '#8c564b')
+CHART_ZOOM = 0.8
+FILE_FILTER = "CSV Files (*.csv);;Binary Files (*.mtrb);;SQLite (*.sqlite *.db)"
+FOLLOW_INTERVAL = 1000
+ERROR_FETCH = 200
+
+
+def is_text_path(file_path: str) -> bool:
+    return not (is_binary_path(file_path) or is_sqlite_path(file_path))
+
+def column_labels() -> list:
+    # столбцы общие для всех типов: подпись поля по его позиции, разные подписи через «/»
+    labels = []
+    for reading_class in READING_TYPES.values():
+        for position, label in enumerate(reading_class.labels):
+            if position == len(labels):
+                labels.append(label)
+            elif label not in labels[position].split(" / "):
+                labels[position] += " / " + label
+    return labels
 
 class AddReadingDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
@@ -11,7 +43,8 @@ class AddReadingDialog(QtWidgets.QDialog):
         layout = QtWidgets.QVBoxLayout()
 
         self.type_combo = QtWidgets.QComboBox()
-        self.type_combo.addItems(["Вода", "Электричество"])
+        self.type_combo.addItems(list(READING_TYPES))
+        self.type_combo.currentIndexChanged.connect(self.update_fields)
         layout.addWidget(QtWidgets.QLabel("Тип ресурса:"))
         layout.addWidget(self.type_combo)
 
@@ -21,58 +54,687 @@ class AddReadingDialog(QtWidgets.QDialog):
         layout.addWidget(QtWidgets.QLabel("Дата:"))
         layout.addWidget(self.date_edit)
 
-        self.value_edit = QtWidgets.QLineEdit()
-        self.flow_rate_edit = QtWidgets.QLineEdit()
-        self.total_volume_edit = QtWidgets.QLineEdit()
-        self.frequency_edit = QtWidgets.QLineEdit()
-
-        layout.addWidget(QtWidgets.QLabel("Значение:"))
-        layout.addWidget(self.value_edit)
-        layout.addWidget(QtWidgets.QLabel("Мгновенное значение (flow/power):"))
-        layout.addWidget(self.flow_rate_edit)
-        layout.addWidget(QtWidgets.QLabel("Общее потребление (volume/energy):"))
-        layout.addWidget(self.total_volume_edit)
-        layout.addWidget(QtWidgets.QLabel("Частота (frequency, только для электричества):"))
-        layout.addWidget(self.frequency_edit)
+        self.field_labels = []
+        self.field_edits = []
+        for _ in range(max(len(reading_class.fields) for reading_class in READING_TYPES.values())):
+            label = QtWidgets.QLabel()
+            edit = QtWidgets.QLineEdit()
+            layout.addWidget(label)
+            layout.addWidget(edit)
+            self.field_labels.append(label)
+            self.field_edits.append(edit)
 
         self.ok_button = QtWidgets.QPushButton("Добавить")
         self.ok_button.clicked.connect(self.validate_and_accept)
         layout.addWidget(self.ok_button)
 
         self.setLayout(layout)
+        self.update_fields()
+
+    def reading_class(self):
+        return READING_TYPES[self.type_combo.currentText()]
+
+    def update_fields(self):
+        labels = self.reading_class().labels
+        for position, (label, edit) in enumerate(zip(self.field_labels, self.field_edits)):
+            label.setVisible(position < len(labels))
+            edit.setVisible(position < len(labels))
+            if position < len(labels):
+                label.setText(f"{labels[position]}:")
 
     def validate_and_accept(self):
         try:
-            float(self.value_edit.text())
-            if self.type_combo.currentText() == "Вода":
-                float(self.flow_rate_edit.text())
-                float(self.total_volume_edit.text())
-            else:
-                float(self.flow_rate_edit.text())
-                float(self.total_volume_edit.text())
-                float(self.frequency_edit.text())
+            for edit in self.field_edits[:len(self.reading_class().fields)]:
+                float(edit.text())
             self.accept()
         except ValueError:
             QtWidgets.QMessageBox.warning(self, "Ошибка", "Введите корректные числовые значения.")
 
     def get_data(self):
-        if self.type_combo.currentText() == "Вода":
-            return {
-                'type': self.type_combo.currentText(),
-                'date': self.date_edit.date().toString("dd.MM.yyyy"),
-                'value': self.value_edit.text(),
-                'flow_rate': self.flow_rate_edit.text(),
-                'total_volume': self.total_volume_edit.text(),
-            }
+        data = {
+            'type': self.type_combo.currentText(),
+            'date': self.date_edit.date().toString("dd.MM.yyyy"),
+        }
+        data.update((name, edit.text()) for name, edit in zip(self.reading_class().fields, self.field_edits))
+        return data
+
+class ErrorTableModel(QtCore.QAbstractTableModel):
+    # строки добавляются порциями по мере прокрутки: окно открывается сразу при любом числе ошибок
+    headers = ["Строка", "Вид", "Поле", "Сообщение"]
+
+    def __init__(self, errors: ErrorCollector, parent=None):
+        super().__init__(parent)
+        self.errors = errors.errors
+        self.loaded = 0
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(self.headers)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.loaded < len(self.errors)
+
+    def fetchMore(self, parent):
+        count = min(ERROR_FETCH, len(self.errors) - self.loaded)
+        self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+        self.loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        error = self.errors[index.row()]
+        return (str(error.line_number), ERROR_KINDS.get(error.kind, error.kind), error.field or "", error.message)[index.column()]
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+class ErrorDialog(QtWidgets.QDialog):
+    def __init__(self, errors: ErrorCollector, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Некорректные строки")
+        self.setGeometry(200, 200, 700, 500)
+
+        layout = QtWidgets.QVBoxLayout()
+        self.summary_label = QtWidgets.QLabel(errors.summary())
+        self.summary_label.setWordWrap(True)
+        layout.addWidget(self.summary_label)
+
+        self.model = ErrorTableModel(errors, self)
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.model)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        self.setLayout(layout)
+
+class SummaryDialog(QtWidgets.QDialog):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.setWindowTitle("Сводка потребления")
+        self.setGeometry(200, 200, 600, 500)
+
+        layout = QtWidgets.QVBoxLayout()
+
+        self.period_combo = QtWidgets.QComboBox()
+        self.period_combo.addItems(["По месяцам", "По дням"])
+        self.period_combo.currentIndexChanged.connect(self.update_summary)
+        layout.addWidget(self.period_combo)
+
+        self.summary_label = QtWidgets.QLabel()
+        layout.addWidget(self.summary_label)
+
+        self.table = QtWidgets.QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["Тип", "Период", "Потребление"])
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        self.setLayout(layout)
+        self.update_summary()
+
+    def update_summary(self):
+        period = 'month' if self.period_combo.currentIndex() == 0 else 'day'
+        date_format = '%m.%Y' if period == 'month' else '%d.%m.%Y'
+        summary = summarize(self.model.water_readings, self.model.electricity_readings, period,
+                            self.model.water_index, self.model.electricity_index)
+        lines = []
+        rows = []
+        for resource_type, item in summary.items():
+            lines.append(f"{resource_type}: показаний {item['readings']} "
+                         f"({item['first']:%d.%m.%Y} - {item['last']:%d.%m.%Y}), "
+                         f"потребление {item['consumption']:.2f}, сбросов счётчика {item['resets']}, "
+                         f"отрицательных приростов {item['negative']}, "
+                         f"средняя мощность/расход {item['average_rate']:.2f} (последние {item['recent_rate']:.2f})")
+            if item['bad_frequency']:
+                lines.append(f"{resource_type}: показаний с частотой не 50/60 Гц: {item['bad_frequency']}")
+            rows.extend((resource_type, f"{start:{date_format}}", f"{total:.2f}") for start, total in item['periods'])
+        self.summary_label.setText("\n".join(lines) or "Нет данных")
+        self.summary_label.setWordWrap(True)
+        self.table.setRowCount(len(rows))
+        for row, cells in enumerate(rows):
+            for column, text in enumerate(cells):
+                self.table.setItem(row, column, QtWidgets.QTableWidgetItem(text))
+
+class ChartWidget(QtWidgets.QWidget):
+    """График минимумов и максимумов по пирамидам MinMaxPyramid: на пиксель приходится не больше одного интервала."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pyramids = {}
+        # (первый, последний день) видимого диапазона
+        self.view = None
+        self._drag = None
+        self.setMinimumSize(400, 250)
+
+    def full_range(self):
+        spans = [pyramid.span() for pyramid in self.pyramids.values() if len(pyramid)]
+        if not spans:
+            return None
+        first, last = min(span[0] for span in spans), max(span[1] for span in spans)
+        return first, max(last + 1, first + 1)
+
+    def set_pyramids(self, pyramids: dict):
+        self.pyramids = pyramids
+        self.view = self.full_range()
+        self.update()
+
+    def plot_rect(self) -> QtCore.QRect:
+        return self.rect().adjusted(70, 25, -10, -25)
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.white)
+        plot = self.plot_rect()
+        series = []
+        if self.view is not None and plot.width() > 0:
+            first, last = self.view
+            for resource_type, pyramid in self.pyramids.items():
+                level, keys, mins, maxs = pyramid.buckets(floor(first), ceil(last), plot.width())
+                if keys:
+                    series.append((resource_type, level, keys, mins, maxs))
+        if not series:
+            painter.drawText(self.rect(), QtCore.Qt.AlignCenter, "Нет данных")
+            return
+        low = min(min(item[3]) for item in series)
+        high = max(max(item[4]) for item in series)
+        if high == low:
+            low, high = low - 0.5, high + 0.5
+        x_scale = plot.width() / (last - first)
+        y_scale = plot.height() / (high - low)
+        painter.drawRect(plot)
+        painter.drawText(5, plot.top() + 10, f"{high:.6g}")
+        painter.drawText(5, plot.bottom(), f"{low:.6g}")
+        painter.drawText(plot.left(), self.height() - 7, format_date(date_from_days(floor(first))))
+        last_text = format_date(date_from_days(ceil(last) - 1))
+        painter.drawText(plot.right() - painter.fontMetrics().width(last_text), self.height() - 7, last_text)
+        legend_x = plot.left()
+        for number, (resource_type, level, keys, mins, maxs) in enumerate(series):
+            color = QtGui.QColor(CHART_COLORS[number % len(CHART_COLORS)])
+            painter.setPen(color)
+            painter.drawText(legend_x, 17, resource_type)
+            legend_x += painter.fontMetrics().width(resource_type) + 15
+            # вертикальный отрезок минимум-максимум в середине каждого интервала, отрезки соединены ломаной
+            half = (1 << level) / 2
+            points = []
+            for key, minimum, maximum in zip(keys, mins, maxs):
+                x = plot.left() + ((key << level) + half - first) * x_scale
+                points.append(QtCore.QPointF(x, plot.bottom() - (minimum - low) * y_scale))
+                points.append(QtCore.QPointF(x, plot.bottom() - (maximum - low) * y_scale))
+            painter.save()
+            painter.setClipRect(plot)
+            painter.drawPolyline(QtGui.QPolygonF(points))
+            painter.restore()
+
+    def wheelEvent(self, event):
+        if self.view is None:
+            return
+        first, last = self.view
+        plot = self.plot_rect()
+        anchor = first + (event.x() - plot.left()) * (last - first) / max(plot.width(), 1)
+        factor = CHART_ZOOM ** (event.angleDelta().y() / 120)
+        if (last - first) * factor < 1:
+            factor = 1 / (last - first)
+        self.view = anchor - (anchor - first) * factor, anchor + (last - anchor) * factor
+        self.update()
+
+    def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.LeftButton and self.view is not None:
+            self._drag = event.x(), self.view
+
+    def mouseMoveEvent(self, event):
+        if self._drag is None:
+            return
+        x, (first, last) = self._drag
+        shift = (event.x() - x) * (last - first) / max(self.plot_rect().width(), 1)
+        self.view = first - shift, last - shift
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.view = self.full_range()
+        self.update()
+
+class ChartDialog(QtWidgets.QDialog):
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.model = model
+        self.setWindowTitle("График показаний")
+        self.setGeometry(150, 150, 800, 450)
+        # пирамиды строятся при показе окна, пока оно скрыто изменения только отмечаются
+        self.stale = True
+
+        layout = QtWidgets.QVBoxLayout()
+        controls = QtWidgets.QHBoxLayout()
+        self.kind_combo = QtWidgets.QComboBox()
+        self.kind_combo.addItems([WaterMeterReading.prefix, ElectricityMeterReading.prefix])
+        self.kind_combo.currentIndexChanged.connect(self.update_fields)
+        controls.addWidget(self.kind_combo)
+        self.field_combo = QtWidgets.QComboBox()
+        self.field_combo.currentIndexChanged.connect(self.rebuild)
+        controls.addWidget(self.field_combo)
+        controls.addStretch()
+        controls.addWidget(QtWidgets.QLabel("Колесо - масштаб, перетаскивание - сдвиг, двойной щелчок - весь период"))
+        layout.addLayout(controls)
+
+        self.chart = ChartWidget()
+        layout.addWidget(self.chart)
+        self.setLayout(layout)
+
+        model.readings_reset.connect(self.rebuild)
+        model.readings_changed.connect(self.update_readings)
+        self.update_fields()
+
+    def current(self) -> tuple:
+        if self.kind_combo.currentIndex() == 0:
+            return self.model.water_readings, self.model.water_index, WaterMeterReading
+        return self.model.electricity_readings, self.model.electricity_index, ElectricityMeterReading
+
+    def update_fields(self):
+        reading_class = self.current()[2]
+        self.field_combo.blockSignals(True)
+        self.field_combo.clear()
+        for name, label in zip(reading_class.fields, reading_class.labels):
+            self.field_combo.addItem(label, name)
+        self.field_combo.blockSignals(False)
+        self.rebuild()
+
+    def rebuild(self):
+        if not self.isVisible():
+            self.stale = True
+            return
+        readings, index, _ = self.current()
+        self.chart.set_pyramids(series_pyramids(readings, self.field_combo.currentData(), index))
+        self.stale = False
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.stale:
+            self.rebuild()
+
+    def update_readings(self, readings, changed):
+        current, index, _ = self.current()
+        if readings is not current or self.stale:
+            return
+        if not self.isVisible():
+            self.stale = True
+            return
+        field = self.field_combo.currentData()
+        column = getattr(readings, field) if isinstance(readings, ReadingColumns) else None
+        pyramids = self.chart.pyramids
+        for resource_type, day in set(zip(*_index_keys(changed))):
+            positions = index.on(date_from_days(day), resource_type)
+            if column is not None:
+                values = list(map(column.__getitem__, positions))
+            else:
+                values = [getattr(readings[position], field) for position in positions]
+            pyramid = pyramids.get(resource_type)
+            if pyramid is None:
+                pyramid = pyramids[resource_type] = MinMaxPyramid()
+            pyramid.set_day(day, values)
+            if not len(pyramid):
+                del pyramids[resource_type]
+        if self.chart.view is None:
+            self.chart.view = self.chart.full_range()
+        self.chart.update()
+
+class LoadThread(QtCore.QThread):
+    chunk_loaded = QtCore.pyqtSignal(object, object, object)
+    progress = QtCore.pyqtSignal(int, int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, file_path: str, parent=None, follower: MeterFileFollower = None, cache: ParseCache = None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.follower = follower
+        self.cache = cache
+        self.cancelled = False
+        self.errors = ErrorCollector()
+        # число строк и stat файла, к которым относятся номера исходных строк показаний
+        self.line_count = None
+        self.stat = None
+        # открытая база: показания читаются из неё страницами, а не загружаются целиком
+        self.store = None
+        self.store_readings = None
+        self.store_indexes = None
+
+    def run(self):
+        with stage('gui_load'):
+            self._load()
+
+    def _load(self):
+        try:
+            if is_binary_path(self.file_path):
+                water, electricity = read_binary(self.file_path)
+                self.chunk_loaded.emit(water, electricity, None)
+                self.progress.emit(len(water) + len(electricity), 0)
+                return
+            if is_sqlite_path(self.file_path):
+                self.store = SqliteStore(self.file_path, create=False)
+                water = self.store.readings(WaterMeterReading)
+                electricity = self.store.readings(ElectricityMeterReading)
+                self.store_readings = water, electricity
+                # индекс по всей таблице строится здесь, а не в потоке интерфейса
+                self.store_indexes = ReadingIndex(water), ReadingIndex(electricity)
+                self.progress.emit(len(water) + len(electricity), 0)
+                return
+            stat = os.stat(self.file_path)
+            key = None
+            if self.cache is not None and self.follower is None:
+                key = self.cache.key(self.file_path)
+                cached = self.cache.load(key)
+                if cached is not None:
+                    water, electricity, errors = cached
+                    self.errors.merge(errors)
+                    sources = self.cache.load_sources(key)
+                    self.chunk_loaded.emit(water, electricity, None if sources is None else sources[1])
+                    self.progress.emit(len(water) + len(electricity) + len(self.errors), len(self.errors))
+                    if sources is not None:
+                        self.line_count, self.stat = sources[0], stat
+                    return
+                loaded = WaterReadingColumns(), ElectricityReadingColumns()
+                loaded_sources = array('q'), array('q')
+                # окну хватает первых ERROR_LIMIT ошибок, в кэш уходят все
+                all_errors = ErrorCollector(None)
+            blocks = self.follower.iter_new_blocks() if self.follower else iter_file_blocks(self.file_path)
+            lines = 0
+            for water, electricity, errors, lines, sources in iter_column_chunks(blocks):
+                if self.cancelled:
+                    return
+                self.errors.extend(errors)
+                self.chunk_loaded.emit(water, electricity, sources)
+                self.progress.emit(lines, len(self.errors))
+                if key is not None:
+                    all_errors.extend(errors)
+                    loaded[0].extend_columns(water)
+                    loaded[1].extend_columns(electricity)
+                    loaded_sources[0].extend(sources[0])
+                    loaded_sources[1].extend(sources[1])
+            self.line_count, self.stat = lines, stat
+            if key is not None and file_unchanged(self.file_path, stat):
+                try:
+                    self.cache.store(key, *loaded, all_errors, (lines, loaded_sources))
+                except OSError:
+                    # без кэша загрузка всё равно удалась
+                    pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class SaveCancelled(Exception):
+    pass
+
+class SaveThread(QtCore.QThread):
+    progress = QtCore.pyqtSignal(int, int)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, file_path: str, water_readings, electricity_readings, parent=None, incremental: tuple = None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.water_readings = water_readings
+        self.electricity_readings = electricity_readings
+        # (номера исходных строк, число строк файла): неизменённые показания копируются из файла
+        self.incremental = incremental
+        self.written = 0
+        self.copied = 0
+        self.cancelled = False
+        self.succeeded = False
+
+    def report(self, written: int):
+        if self.cancelled:
+            raise SaveCancelled()
+        self.written = written
+        self.progress.emit(written, 0)
+
+    def run(self):
+        try:
+            if self.incremental is not None:
+                self.copied = write_file_incremental(self.file_path, self.water_readings, self.electricity_readings,
+                                                     *self.incremental, progress=self.report)
+            else:
+                if is_sqlite_path(self.file_path):
+                    write = write_sqlite
+                else:
+                    write = write_binary if is_binary_path(self.file_path) else write_file
+                write(self.file_path, self.water_readings, self.electricity_readings, progress=self.report)
+            self.succeeded = True
+        except SaveCancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ReadingTableModel(QtCore.QAbstractTableModel):
+    headers = ["Тип", "Дата"] + column_labels()
+    # для графика: коллекция целиком заменена; в коллекции добавлены, изменены или удалены показания
+    readings_reset = QtCore.pyqtSignal()
+    readings_changed = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.water_readings = []
+        self.electricity_readings = []
+        self.water_index = ReadingIndex()
+        self.electricity_index = ReadingIndex()
+        # номера строк исходного файла для показаний воды и электричества, NO_SOURCE - добавлено или изменено;
+        # None - источник неизвестен и при сохранении форматируется всё
+        self.sources = (array('q'), array('q'))
+        self.date_filter = None
+        self.rows = None
+        self._cached_row = -1
+        self._cached_cells = []
+
+    def set_readings(self, water_readings, electricity_readings, sources: tuple = None, indexes: tuple = None):
+        self.beginResetModel()
+        self.water_readings = water_readings
+        self.electricity_readings = electricity_readings
+        if sources is None and not (len(water_readings) or len(electricity_readings)):
+            sources = (array('q'), array('q'))
+        self.sources = sources
+        if indexes is None:
+            indexes = ReadingIndex(water_readings), ReadingIndex(electricity_readings)
+        self.water_index, self.electricity_index = indexes
+        self._update_rows()
+        self._cached_row = -1
+        self.endResetModel()
+        self.readings_reset.emit()
+
+    def _update_rows(self):
+        if self.date_filter is None:
+            self.rows = None
+            return
+        offset = len(self.water_readings)
+        water_rows = self.water_index.between(*self.date_filter)
+        electricity_rows = self.electricity_index.between(*self.date_filter)
+        self.rows = sorted(water_rows) + sorted(row + offset for row in electricity_rows)
+
+    def set_date_filter(self, start: datetime = None, end: datetime = None, resource_type: str = None):
+        self.beginResetModel()
+        self.date_filter = None if start is None else (start, end, resource_type)
+        self._update_rows()
+        self._cached_row = -1
+        self.endResetModel()
+
+    def refilter(self):
+        self.set_date_filter(*(self.date_filter or ()))
+
+    def source_row(self, row: int) -> int:
+        return row if self.rows is None else self.rows[row]
+
+    def locate(self, row: int):
+        row = self.source_row(row)
+        if row < len(self.water_readings):
+            return self.water_readings, row
+        return self.electricity_readings, row - len(self.water_readings)
+
+    def _sources_of(self, readings):
+        if self.sources is None:
+            return None
+        return self.sources[0] if readings is self.water_readings else self.sources[1]
+
+    def mark_saved(self, track: bool = True):
+        # после записи текстового файла показания занимают его строки подряд: сначала вода, затем электричество
+        water_count = len(self.water_readings)
+        self.sources = None
+        if track:
+            self.sources = (array('q', range(water_count)),
+                            array('q', range(water_count, water_count + len(self.electricity_readings))))
+
+    def reading(self, row: int):
+        readings, idx = self.locate(row)
+        return readings[idx]
+
+    def cells(self, row: int) -> list:
+        if row != self._cached_row:
+            cells = str(self.reading(row)).split(';')
+            self._cached_cells = cells + [""] * (len(self.headers) - len(cells))
+            self._cached_row = row
+        return self._cached_cells
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self.rows is not None:
+            return len(self.rows)
+        return len(self.water_readings) + len(self.electricity_readings)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return None
+        return self.cells(index.row())[index.column()]
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return section + 1
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() > 0:
+            flags |= QtCore.Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid() or role != QtCore.Qt.EditRole:
+            return False
+        readings, idx = self.locate(index.row())
+        cells = list(self.cells(index.row()))
+        cells[index.column()] = str(value).strip()
+        reading_class = type(readings[idx])
+        try:
+            reading = reading_class.parse(';'.join(cells[:len(reading_class.fields) + 2]))
+        except ValueError:
+            return False
+        index_of = self.water_index if readings is self.water_readings else self.electricity_index
+        old = readings[idx]
+        index_of.replace(idx, old, reading)
+        readings[idx] = reading
+        sources = self._sources_of(readings)
+        if sources is not None:
+            sources[idx] = NO_SOURCE
+        self._cached_row = -1
+        self.dataChanged.emit(self.index(index.row(), 0), self.index(index.row(), len(self.headers) - 1))
+        self.readings_changed.emit(readings, [old, reading])
+        return True
+
+    def append(self, reading):
+        if isinstance(reading, WaterMeterReading):
+            readings, index, row = self.water_readings, self.water_index, len(self.water_readings)
+        else:
+            readings, index = self.electricity_readings, self.electricity_index
+            row = len(self.water_readings) + len(self.electricity_readings)
+        sources = self._sources_of(readings)
+        if sources is not None:
+            sources.append(NO_SOURCE)
+        if self.rows is not None:
+            readings.append(reading)
+            index.append(reading)
+            self.refilter()
+            self.readings_changed.emit(readings, [reading])
+            return self.rows.index(row) if row in self.rows else -1
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        readings.append(reading)
+        index.append(reading)
+        self._cached_row = -1
+        self.endInsertRows()
+        self.readings_changed.emit(readings, [reading])
+        return row
+
+    def _extend(self, water, electricity, extend_water, extend_electricity, sources):
+        with stage('gui_insert'):
+            if self.sources is not None:
+                if sources is None:
+                    self.sources = None
+                else:
+                    self.sources[0].extend(sources[0])
+                    self.sources[1].extend(sources[1])
+            self._insert(water, electricity, extend_water, extend_electricity)
+        record('gui_insert', len(water) + len(electricity))
+        if len(water):
+            self.readings_changed.emit(self.water_readings, water)
+        if len(electricity):
+            self.readings_changed.emit(self.electricity_readings, electricity)
+
+    def _insert(self, water, electricity, extend_water, extend_electricity):
+        if self.rows is not None:
+            extend_water(water)
+            extend_electricity(electricity)
+            self.water_index.extend(water)
+            self.electricity_index.extend(electricity)
+            self.refilter()
+            return
+        if len(water):
+            row = len(self.water_readings)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row + len(water) - 1)
+            extend_water(water)
+            self.water_index.extend(water)
+            self.endInsertRows()
+        if len(electricity):
+            row = self.rowCount()
+            self.beginInsertRows(QtCore.QModelIndex(), row, row + len(electricity) - 1)
+            extend_electricity(electricity)
+            self.electricity_index.extend(electricity)
+            self.endInsertRows()
+        self._cached_row = -1
+
+    def extend_columns(self, water_columns, electricity_columns, sources: tuple = None):
+        self._extend(water_columns, electricity_columns,
+                     self.water_readings.extend_columns, self.electricity_readings.extend_columns, sources)
+
+    def extend(self, water_readings, electricity_readings):
+        sources = (array('q', repeat(NO_SOURCE, len(water_readings))), array('q', repeat(NO_SOURCE, len(electricity_readings))))
+        self._extend(water_readings, electricity_readings,
+                     self.water_readings.extend, self.electricity_readings.extend, sources)
+
+    def remove_row(self, row: int):
+        readings, idx = self.locate(row)
+        index = self.water_index if readings is self.water_readings else self.electricity_index
+        sources = self._sources_of(readings)
+        if sources is not None:
+            del sources[idx]
+        old = readings[idx]
+        if self.rows is not None:
+            index.remove(idx, old)
+            del readings[idx]
+            self.refilter()
         else:
-            return {
-                'type': self.type_combo.currentText(),
-                'date': self.date_edit.date().toString("dd.MM.yyyy"),
-                'value': self.value_edit.text(),
-                'power': self.flow_rate_edit.text(),
-                'total_energy': self.total_volume_edit.text(),
-                'frequency': self.frequency_edit.text()
-            }
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            index.remove(idx, old)
+            del readings[idx]
+            self._cached_row = -1
+            self.endRemoveRows()
+        self.readings_changed.emit(readings, [old])
 
 class MeterApp(QtWidgets.QMainWindow):
     def __init__(self):
@@ -80,10 +742,41 @@ class MeterApp(QtWidgets.QMainWindow):
         self.setWindowTitle("Meter Readings")
         self.setGeometry(100, 100, 800, 600)
 
-        self.table = QtWidgets.QTableWidget(self)
-        self.table.setGeometry(10, 10, 780, 500)
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(["Тип", "Дата", "Значение", "Мгновенное значение", "Общее потребление", "Частота"])
+        self.model = ReadingTableModel(self)
+        self.table = QtWidgets.QTableView(self)
+        self.table.setGeometry(10, 10, 780, 465)
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+
+        self.filter_check = QtWidgets.QCheckBox("Фильтр по дате", self)
+        self.filter_check.setGeometry(10, 482, 130, 30)
+        self.filter_check.toggled.connect(self.apply_filter)
+
+        self.filter_start_edit = QtWidgets.QDateEdit(self)
+        self.filter_start_edit.setGeometry(150, 482, 110, 30)
+        self.filter_start_edit.setCalendarPopup(True)
+        self.filter_start_edit.setDate(datetime.today().date().replace(day=1))
+        self.filter_start_edit.dateChanged.connect(self.apply_filter)
+
+        self.filter_end_edit = QtWidgets.QDateEdit(self)
+        self.filter_end_edit.setGeometry(270, 482, 110, 30)
+        self.filter_end_edit.setCalendarPopup(True)
+        self.filter_end_edit.setDate(datetime.today().date())
+        self.filter_end_edit.dateChanged.connect(self.apply_filter)
+
+        self.filter_type_combo = QtWidgets.QComboBox(self)
+        self.filter_type_combo.setGeometry(390, 482, 150, 30)
+        self.filter_type_combo.addItems(["Все типы", "Вода", "Электричество"])
+        self.filter_type_combo.currentIndexChanged.connect(self.apply_filter)
+
+        self.chart_button = QtWidgets.QPushButton("График", self)
+        self.chart_button.setGeometry(580, 482, 100, 30)
+        self.chart_button.clicked.connect(self.show_chart)
+
+        self.summary_button = QtWidgets.QPushButton("Сводка", self)
+        self.summary_button.setGeometry(690, 482, 100, 30)
+        self.summary_button.clicked.connect(self.show_summary)
 
         self.load_button = QtWidgets.QPushButton("Загрузить", self)
         self.load_button.setGeometry(10, 520, 100, 30)
@@ -101,61 +794,225 @@ class MeterApp(QtWidgets.QMainWindow):
         self.save_button.setGeometry(340, 520, 100, 30)
         self.save_button.clicked.connect(self.select_file_to_save)
 
-        self.water_readings = []
-        self.electricity_readings = []
+        self.progress_bar = QtWidgets.QProgressBar(self)
+        self.progress_bar.setGeometry(450, 520, 230, 30)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(0)
+
+        self.cancel_button = QtWidgets.QPushButton("Отмена", self)
+        self.cancel_button.setGeometry(690, 520, 100, 30)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_task)
+
+        self.status_label = QtWidgets.QLabel(self)
+        self.status_label.setGeometry(10, 560, 600, 25)
+
+        self.follow_check = QtWidgets.QCheckBox("Следить за файлом", self)
+        self.follow_check.setGeometry(620, 560, 170, 25)
+        self.follow_check.toggled.connect(self.set_follow)
+
+        self.follow_timer = QtCore.QTimer(self)
+        self.follow_timer.setInterval(FOLLOW_INTERVAL)
+        self.follow_timer.timeout.connect(self.poll_file)
+
         self.file_path = ""
+        self.task = None
+        self.follower = None
+        self.cache = ParseCache()
+        # (путь, число строк, stat) файла, на строки которого ссылаются model.sources
+        self.source = None
+        # база SQLite, показания которой открыты в таблице; правки фиксируются при сохранении в неё же
+        self.store = None
+        self.chart_dialog = None
+
+    @property
+    def water_readings(self):
+        return self.model.water_readings
+
+    @property
+    def electricity_readings(self):
+        return self.model.electricity_readings
 
     def select_file_to_load(self):
-        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Выбрать файл для загрузки", "", "CSV Files (*.csv)")
+        file_name, _ = QtWidgets.QFileDialog.getOpenFileName(self, "Выбрать файл для загрузки", "", FILE_FILTER)
         if file_name:
             self.file_path = file_name
             self.load_data()
 
     def select_file_to_save(self):
-        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Выбрать файл для сохранения", "", "CSV Files (*.csv)")
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Выбрать файл для сохранения", "", FILE_FILTER)
         if file_name:
             self.file_path = file_name
             self.save_data()
 
+    def apply_filter(self):
+        if not self.filter_check.isChecked():
+            self.model.set_date_filter()
+            return
+        start = datetime(*self.filter_start_edit.date().getDate())
+        end = datetime(*self.filter_end_edit.date().getDate())
+        resource_type = self.filter_type_combo.currentText() if self.filter_type_combo.currentIndex() else None
+        self.model.set_date_filter(start, end, resource_type)
+        self.status_label.setText(f"Показано строк: {self.model.rowCount()}")
+
+    def show_summary(self):
+        SummaryDialog(self.model, self).exec_()
+
+    def show_chart(self):
+        # окно немодальное и обновляется по мере загрузки и правок
+        if self.chart_dialog is None:
+            self.chart_dialog = ChartDialog(self.model, self)
+        self.chart_dialog.show()
+        self.chart_dialog.raise_()
+
+    def set_follow(self, enabled: bool):
+        self.follow_timer.stop()
+        self.follower = None
+        if not enabled:
+            return
+        if not self.file_path or not is_text_path(self.file_path):
+            self.follow_check.setChecked(False)
+            self.status_label.setText("Слежение доступно только для загруженного CSV-файла")
+            return
+        self.follower = MeterFileFollower(self.file_path)
+        if self.task is None:
+            self.load_data()
+
+    def poll_file(self):
+        if self.follower is None or self.task is not None:
+            return
+        result = self.follower.poll()
+        if result is None:
+            self.status_label.setText("Файл усечён или заменён, полная перезагрузка...")
+            self.load_data()
+            return
+        water, electricity, errors = result
+        if water or electricity or errors:
+            self.model.extend(water, electricity)
+            message = f"Новых строк: {len(water) + len(electricity)}, ошибок: {len(errors)}"
+            self.status_label.setText(f"{message}. {errors[0]}" if errors else message)
+
+    def set_busy(self, busy: bool, cancellable: bool = False):
+        for widget in (self.load_button, self.add_button, self.delete_button, self.save_button, self.summary_button, self.table,
+                       self.follow_check):
+            widget.setEnabled(not busy)
+        self.cancel_button.setEnabled(busy and cancellable)
+        self.progress_bar.setRange(0, 0 if busy else 1)
+
+    def cancel_task(self):
+        if self.task is not None:
+            self.task.cancelled = True
+            self.cancel_button.setEnabled(False)
+
     def load_data(self):
-        if not self.file_path:
+        if not self.file_path or self.task is not None:
             return
-        try:
-            lines = read_file(self.file_path)
-            self.water_readings, self.electricity_readings, errors = parse_meter_readings(lines)
-            self.table.setRowCount(0)
-            for reading in self.water_readings + self.electricity_readings:
-                row = self.table.rowCount()
-                self.table.insertRow(row)
-                data = str(reading).split(';')
-                for col, item in enumerate(data):
-                    self.table.setItem(row, col, QtWidgets.QTableWidgetItem(item))
-            if errors:
-                QtWidgets.QMessageBox.warning(self, "Некорректные строки", "\n".join(errors))
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(self, "Ошибка загрузки", f"Не удалось загрузить данные: {e}")
+        self.follow_timer.stop()
+        if self.follower is not None:
+            if self.follower.file_path != self.file_path or not is_text_path(self.file_path):
+                self.follow_check.setChecked(False)
+            else:
+                self.follower.reset()
+        self.model.set_readings(WaterReadingColumns(), ElectricityReadingColumns())
+        self.source = None
+        if self.store is not None:
+            # несохранённые правки в базе отбрасываются, как и для файлов
+            self.store.close()
+            self.store = None
+        self.task = LoadThread(self.file_path, self, self.follower, self.cache)
+        self.task.chunk_loaded.connect(self.model.extend_columns)
+        self.task.progress.connect(self.show_load_progress)
+        self.task.failed.connect(self.show_load_error)
+        self.task.finished.connect(self.finish_load)
+        self.set_busy(True, cancellable=True)
+        self.status_label.setText("Загрузка...")
+        self.task.start()
+
+    def show_load_progress(self, lines: int, errors: int):
+        self.status_label.setText(f"Обработано строк: {lines}, ошибок: {errors}")
+
+    def show_load_error(self, message: str):
+        QtWidgets.QMessageBox.critical(self, "Ошибка загрузки", f"Не удалось загрузить данные: {message}")
+
+    def finish_load(self):
+        task, self.task = self.task, None
+        self.set_busy(False)
+        if task.cancelled:
+            self.model.set_readings(WaterReadingColumns(), ElectricityReadingColumns())
+            if task.store is not None:
+                task.store.close()
+            self.status_label.setText("Загрузка отменена")
+            self.follow_check.setChecked(False)
+            return
+        if task.store_readings is not None:
+            self.store = task.store
+            self.model.set_readings(*task.store_readings, indexes=task.store_indexes)
+            self.status_label.setText(f"Открыта база, показаний: {self.model.rowCount()}")
+        if task.line_count is not None:
+            self.source = (task.file_path, task.line_count, task.stat)
+        if self.follower is not None and self.follower is not task.follower:
+            # слежение включили во время загрузки: читатель стоит в начале файла и повторил бы все строки
+            self.load_data()
+            return
+        if task.errors:
+            self.show_errors(task.errors)
+        if self.follower is not None:
+            self.follow_timer.start()
+
+    def show_errors(self, errors: ErrorCollector):
+        ErrorDialog(errors, self).exec_()
 
     def add_item(self):
         dialog = AddReadingDialog(self)
         if dialog.exec_() == QtWidgets.QDialog.Accepted:
             data = dialog.get_data()
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            for col, value in enumerate(data.values()):
-                self.table.setItem(row, col, QtWidgets.QTableWidgetItem(value))
+            reading = dialog.reading_class().parse(';'.join(data.values()))
+            row = self.model.append(reading)
+            self.table.scrollTo(self.model.index(row, 0))
 
     def delete_item(self):
-        selected = self.table.currentRow()
+        selected = self.table.currentIndex().row()
         if selected >= 0:
-            self.table.removeRow(selected)
+            self.model.remove_row(selected)
 
     def save_data(self):
-        self.water_readings = []
-        self.electricity_readings = []
-        for row in range(self.table.rowCount()):
-            data = [self.table.item(row, col).text() if self.table.item(row, col) else "" for col in range(6)]
-            if data[0] == "Вода":
-                self.water_readings.append(parse_water_reading(';'.join(data[:5])))
-            elif data[0] == "Электричество":
-                self.electricity_readings.append(parse_electricity_reading(';'.join(data)))
-        write_file(self.file_path, self.water_readings, self.electricity_readings)
+        if not self.file_path or self.task is not None:
+            return
+        if self.store is not None and self.file_path == self.store.file_path:
+            # правки уже в базе, остаётся зафиксировать транзакцию
+            self.store.commit()
+            self.status_label.setText(f"Сохранено показаний: {len(self.water_readings) + len(self.electricity_readings)}")
+            return
+        incremental = None
+        if (self.model.sources is not None and self.source is not None and self.source[0] == self.file_path
+                and is_text_path(self.file_path) and file_unchanged(self.file_path, self.source[2])):
+            incremental = (self.model.sources, self.source[1])
+        self.task = SaveThread(self.file_path, self.water_readings, self.electricity_readings, self, incremental)
+        self.task.progress.connect(self.show_save_progress)
+        self.task.failed.connect(self.show_save_error)
+        self.task.finished.connect(self.finish_save)
+        self.set_busy(True, cancellable=True)
+        self.status_label.setText("Сохранение...")
+        self.task.start()
+
+    def show_save_progress(self, written: int, _):
+        self.status_label.setText(f"Записано строк: {written}")
+
+    def show_save_error(self, message: str):
+        QtWidgets.QMessageBox.critical(self, "Ошибка сохранения", f"Не удалось сохранить данные: {message}")
+
+    def finish_save(self):
+        task, self.task = self.task, None
+        self.set_busy(False)
+        if task.cancelled:
+            self.status_label.setText("Сохранение отменено, файл не изменён")
+        if not task.succeeded:
+            return
+        saved = len(self.water_readings) + len(self.electricity_readings)
+        text_file = is_text_path(task.file_path)
+        self.model.mark_saved(text_file)
+        self.source = (task.file_path, saved, os.stat(task.file_path)) if text_file else None
+        message = f"Сохранено показаний: {saved}"
+        if task.incremental is not None:
+            message += f", без изменений скопировано: {task.copied}"
+        self.status_label.setText(message)